@@ -10,6 +10,22 @@ import React, { useState, useEffect } from 'react';
 // Base URL for your Flask API
 const API_BASE_URL = 'http://127.0.0.1:5000/api';
 
+// List endpoints are paginated: each response carries the cursor for the next
+// page in the X-Next-Cursor header. This follows the cursors and returns all rows.
+const fetchAllPages = async (path) => {
+  let rows = [];
+  let cursor = null;
+  do {
+    const separator = path.includes('?') ? '&' : '?';
+    const url = `${API_BASE_URL}${path}${cursor ? `${separator}cursor=${encodeURIComponent(cursor)}` : ''}`;
+    const response = await fetch(url);
+    if (!response.ok) throw new Error(`Failed to fetch ${path}`);
+    rows = rows.concat(await response.json());
+    cursor = response.headers.get('X-Next-Cursor');
+  } while (cursor);
+  return rows;
+};
+
 // Main App Component
 function App() {
   const [activeTab, setActiveTab] = useState('dashboard');
@@ -93,31 +109,42 @@ function App() {
 
 // --- Dashboard Component ---
 function Dashboard({ showMessage }) {
-  const [inventory, setInventory] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [fluctuations, setFluctuations] = useState([]);
   const [transactions, setTransactions] = useState([]);
 
   useEffect(() => {
-    fetchInventory();
+    fetchSummary();
     fetchFluctuations();
     fetchTransactions();
   }, []);
 
-  const fetchInventory = async () => {
+  // Refresh the totals as soon as movements commit (server-sent events from /changes/stream).
+  useEffect(() => {
+    const events = new EventSource(`${API_BASE_URL}/changes/stream`);
+    events.addEventListener('inventory', () => {
+      fetchSummary();
+      fetchTransactions();
+    });
+    return () => events.close();
+  }, []);
+
+  // Totals are aggregated server-side; no inventory rows are downloaded.
+  const fetchSummary = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/fuelinventory`);
-      if (!response.ok) throw new Error('Failed to fetch inventory');
+      const response = await fetch(`${API_BASE_URL}/dashboard/summary`);
+      if (!response.ok) throw new Error('Failed to fetch dashboard summary');
       const data = await response.json();
-      setInventory(data);
+      setSummary(data);
     } catch (error) {
-      console.error('Error fetching inventory:', error);
+      console.error('Error fetching dashboard summary:', error);
       showMessage('Failed to load inventory data.', 'error');
     }
   };
 
   const fetchFluctuations = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/pricefluctuations`);
+      const response = await fetch(`${API_BASE_URL}/pricefluctuations?limit=5`);
       if (!response.ok) throw new Error('Failed to fetch price fluctuations');
       const data = await response.json();
       setFluctuations(data);
@@ -129,7 +156,7 @@ function Dashboard({ showMessage }) {
 
   const fetchTransactions = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/fueltransactions`);
+      const response = await fetch(`${API_BASE_URL}/fueltransactions?limit=5`);
       if (!response.ok) throw new Error('Failed to fetch transactions');
       const data = await response.json();
       setTransactions(data);
@@ -139,29 +166,38 @@ function Dashboard({ showMessage }) {
     }
   };
 
-  // Calculate total stock by fuel type for overview
-  const totalStockByFuelType = inventory.reduce((acc, item) => {
-    acc[item.fuelTypeName] = (acc[item.fuelTypeName] || 0) + item.currentStock;
-    return acc;
-  }, {});
+  const stockByFuelType = summary ? summary.stockByFuelType : [];
+  const latestPrices = summary ? summary.latestPrices : [];
+  const recentMovements = summary ? summary.movements.last7Days : null;
 
   return (
     <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
       {/* Current Fuel Stock Overview */}
       <div className="bg-white p-6 rounded-lg shadow-lg">
         <h2 className="text-2xl font-semibold mb-4 text-blue-700">Current Fuel Stock</h2>
-        {Object.keys(totalStockByFuelType).length > 0 ? (
+        {stockByFuelType.length > 0 ? (
           <ul className="space-y-2">
-            {Object.entries(totalStockByFuelType).map(([type, stock]) => (
-              <li key={type} className="flex justify-between items-center text-lg">
-                <span className="font-medium">{type}:</span>
-                <span className="text-gray-700">{stock.toFixed(2)} Liters</span>
-              </li>
-            ))}
+            {stockByFuelType.map((item) => {
+              const latest = latestPrices.find((p) => p.fuelTypeID === item.fuelTypeID);
+              return (
+                <li key={item.fuelTypeID} className="flex justify-between items-center text-lg">
+                  <span className="font-medium">{item.fuelTypeName}:</span>
+                  <span className="text-gray-700">
+                    {item.currentStock.toFixed(2)} Liters
+                    {latest && <span className="text-sm text-gray-500"> @ {latest.price.toFixed(2)}</span>}
+                  </span>
+                </li>
+              );
+            })}
           </ul>
         ) : (
           <p className="text-gray-600">No fuel stock data available.</p>
         )}
+        {recentMovements && (
+          <p className="mt-4 text-sm text-gray-600">
+            {recentMovements.count} movements ({recentMovements.quantity.toFixed(2)} Liters) in the last 7 days
+          </p>
+        )}
       </div>
 
       {/* Recent Price Fluctuations */}
@@ -255,22 +291,15 @@ function PriceEntry({ showMessage }) {
 
   const fetchMasterData = async () => {
     try {
-      const [fuelTypesRes, suppliersRes, townshipsRes, sitesRes] = await Promise.all([
-        fetch(`${API_BASE_URL}/fueltypes`),
-        fetch(`${API_BASE_URL}/suppliers`),
-        fetch(`${API_BASE_URL}/townships`),
-        fetch(`${API_BASE_URL}/sites`),
-      ]);
-
-      const fuelTypesData = await fuelTypesRes.json();
-      const suppliersData = await suppliersRes.json();
-      const townshipsData = await townshipsRes.json();
-      const sitesData = await sitesRes.json();
-
-      setFuelTypes(fuelTypesData);
-      setSuppliers(suppliersData);
-      setTownships(townshipsData);
-      setSites(sitesData);
+      // One round trip for every list the form needs
+      const response = await fetch(`${API_BASE_URL}/masterdata?include=fuelTypes,suppliers,townships,sites`);
+      if (!response.ok) throw new Error('Failed to fetch master data');
+      const data = await response.json();
+
+      setFuelTypes(data.fuelTypes);
+      setSuppliers(data.suppliers);
+      setTownships(data.townships);
+      setSites(data.sites);
     } catch (error) {
       console.error('Error fetching master data:', error);
       showMessage('Failed to load master data for price entry.', 'error');
@@ -440,7 +469,7 @@ function TransactionEntry({ showMessage }) {
   const [suppliers, setSuppliers] = useState([]);
   const [warehouses, setWarehouses] = useState([]);
   const [sites, setSites] = useState([]);
-  const [fuelPrices, setFuelPrices] = useState([]); // To fetch available fuel prices
+  const [effectivePrice, setEffectivePrice] = useState(null); // Price the server resolves for this movement
 
   const [formData, setFormData] = useState({
     transactionType: '',
@@ -460,42 +489,51 @@ function TransactionEntry({ showMessage }) {
 
   useEffect(() => {
     fetchMasterData();
-    fetchFuelPrices();
   }, []);
 
-  const fetchMasterData = async () => {
-    try {
-      const [fuelTypesRes, suppliersRes, warehousesRes, sitesRes] = await Promise.all([
-        fetch(`${API_BASE_URL}/fueltypes`),
-        fetch(`${API_BASE_URL}/suppliers`),
-        fetch(`${API_BASE_URL}/warehouses`),
-        fetch(`${API_BASE_URL}/sites`),
-      ]);
-
-      const fuelTypesData = await fuelTypesRes.json();
-      const suppliersData = await suppliersRes.json();
-      const warehousesData = await warehousesRes.json();
-      const sitesData = await sitesRes.json();
-
-      setFuelTypes(fuelTypesData);
-      setSuppliers(suppliersData);
-      setWarehouses(warehousesData);
-      setSites(sitesData);
-    } catch (error) {
-      console.error('Error fetching master data:', error);
-      showMessage('Failed to load master data for transaction entry.', 'error');
+  // Ask the server which price applies whenever the fuel type, date or route changes
+  useEffect(() => {
+    const { fuelTypeID, transactionDate, sourceLocationType, sourceLocationID,
+            destinationLocationType, destinationLocationID } = formData;
+    if (!fuelTypeID || !transactionDate) {
+      setEffectivePrice(null);
+      return;
     }
-  };
+    const params = new URLSearchParams({ fuelTypeID, date: new Date(transactionDate).toISOString() });
+    if (sourceLocationType && sourceLocationID) {
+      params.set('sourceLocationType', sourceLocationType);
+      params.set('sourceLocationID', sourceLocationID);
+    }
+    if (destinationLocationType && destinationLocationID) {
+      params.set('destinationLocationType', destinationLocationType);
+      params.set('destinationLocationID', destinationLocationID);
+    }
+    let cancelled = false;
+    fetch(`${API_BASE_URL}/fuelprices/effective?${params}`)
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => { if (!cancelled) setEffectivePrice(data); })
+      .catch((error) => {
+        console.error('Error resolving fuel price:', error);
+        if (!cancelled) setEffectivePrice(null);
+      });
+    return () => { cancelled = true; };
+  }, [formData.fuelTypeID, formData.transactionDate, formData.sourceLocationType, formData.sourceLocationID,
+      formData.destinationLocationType, formData.destinationLocationID]);
 
-  const fetchFuelPrices = async () => {
+  const fetchMasterData = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/fuelprices`);
-      if (!response.ok) throw new Error('Failed to fetch fuel prices');
+      // One round trip for every list the form needs
+      const response = await fetch(`${API_BASE_URL}/masterdata?include=fuelTypes,suppliers,warehouses,sites`);
+      if (!response.ok) throw new Error('Failed to fetch master data');
       const data = await response.json();
-      setFuelPrices(data);
+
+      setFuelTypes(data.fuelTypes);
+      setSuppliers(data.suppliers);
+      setWarehouses(data.warehouses);
+      setSites(data.sites);
     } catch (error) {
-      console.error('Error fetching fuel prices:', error);
-      showMessage('Failed to load fuel prices.', 'error');
+      console.error('Error fetching master data:', error);
+      showMessage('Failed to load master data for transaction entry.', 'error');
     }
   };
 
@@ -516,7 +554,7 @@ function TransactionEntry({ showMessage }) {
         quantity: parseFloat(formData.quantity),
         sourceLocationID: parseInt(formData.sourceLocationID),
         destinationLocationID: parseInt(formData.destinationLocationID),
-        fuelPriceID: formData.fuelPriceID ? parseInt(formData.fuelPriceID) : null,
+        fuelPriceID: effectivePrice ? effectivePrice.fuelPriceID : null, // The server resolves it when null
         transportationCost: parseFloat(formData.transportationCost),
         loadingUnloadingCost: parseFloat(formData.loadingUnloadingCost),
         otherCost: parseFloat(formData.otherCost),
@@ -714,24 +752,17 @@ function TransactionEntry({ showMessage }) {
             />
           </div>
           <div>
-            <label htmlFor="fuelPriceID" className="block text-sm font-medium text-gray-700 mb-1">Associated Fuel Price (Optional)</label>
-            <select
+            <label htmlFor="fuelPriceID" className="block text-sm font-medium text-gray-700 mb-1">Effective Fuel Price</label>
+            <input
+              type="text"
               id="fuelPriceID"
               name="fuelPriceID"
-              value={formData.fuelPriceID}
-              onChange={handleChange}
-              className="mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm focus:ring-blue-500 focus:border-blue-500 sm:text-sm"
-            >
-              <option value="">Select Price (if applicable)</option>
-              {fuelPrices
-                .filter(fp => fp.fuelTypeID === parseInt(formData.fuelTypeID)) // Filter by selected fuel type
-                .sort((a, b) => new Date(b.effectiveDate) - new Date(a.effectiveDate)) // Sort by latest date first
-                .map((fp) => (
-                  <option key={fp.fuelPriceID} value={fp.fuelPriceID}>
-                    {fp.effectiveDate} - {fp.price.toFixed(2)} MMK {fp.supplierName ? `(${fp.supplierName})` : ''}
-                  </option>
-                ))}
-            </select>
+              readOnly
+              value={effectivePrice
+                ? `${effectivePrice.effectiveDate} - ${effectivePrice.price.toFixed(2)} MMK`
+                : 'No price effective for this selection'}
+              className="mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm bg-gray-50 sm:text-sm"
+            />
           </div>
         </div>
 
@@ -805,6 +836,8 @@ function Reports({ showMessage }) {
   const [inventory, setInventory] = useState([]);
   const [transactions, setTransactions] = useState([]);
   const [priceFluctuations, setPriceFluctuations] = useState([]);
+  const [consumption, setConsumption] = useState([]);
+  const [consumptionPeriod, setConsumptionPeriod] = useState('month');
 
   useEffect(() => {
     // Fetch data for all reports when the component mounts
@@ -813,11 +846,34 @@ function Reports({ showMessage }) {
     fetchPriceFluctuations();
   }, []);
 
-  const fetchInventory = async () => {
+  // The last twelve months of movements, aggregated server-side
+  const consumptionQuery = () => {
+    const from = new Date();
+    from.setMonth(from.getMonth() - 11, 1);
+    return `${API_BASE_URL}/reports/consumption?period=${consumptionPeriod}&groupBy=fuelType&from=${from.toISOString().slice(0, 10)}`;
+  };
+
+  useEffect(() => {
+    if (activeReport === 'consumption') {
+      fetchConsumption();
+    }
+  }, [activeReport, consumptionPeriod]);
+
+  const fetchConsumption = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/fuelinventory`);
-      if (!response.ok) throw new Error('Failed to fetch inventory');
+      const response = await fetch(consumptionQuery());
+      if (!response.ok) throw new Error('Failed to fetch consumption report');
       const data = await response.json();
+      setConsumption(data.rows);
+    } catch (error) {
+      console.error('Error fetching consumption report:', error);
+      showMessage('Failed to load consumption report.', 'error');
+    }
+  };
+
+  const fetchInventory = async () => {
+    try {
+      const data = await fetchAllPages('/fuelinventory');
       setInventory(data);
     } catch (error) {
       console.error('Error fetching inventory:', error);
@@ -878,6 +934,14 @@ function Reports({ showMessage }) {
         >
           Price Fluctuations
         </button>
+        <button
+          onClick={() => setActiveReport('consumption')}
+          className={`px-4 py-2 rounded-lg transition-colors duration-200 ${
+            activeReport === 'consumption' ? 'bg-blue-600 text-white shadow-md' : 'bg-gray-200 hover:bg-gray-300'
+          }`}
+        >
+          Consumption &amp; Cost
+        </button>
         {/* Add more buttons for other reports as needed */}
       </div>
 
@@ -992,6 +1056,61 @@ function Reports({ showMessage }) {
           )}
         </div>
       )}
+
+      {activeReport === 'consumption' && (
+        <div>
+          <div className="flex flex-wrap items-center justify-between gap-4 mb-4">
+            <h3 className="text-xl font-semibold text-gray-800">Consumption and Landed Cost by Fuel Type</h3>
+            <div className="flex items-center gap-3">
+              <select
+                value={consumptionPeriod}
+                onChange={(e) => setConsumptionPeriod(e.target.value)}
+                className="p-2 border border-gray-300 rounded-md"
+              >
+                <option value="day">Daily</option>
+                <option value="week">Weekly</option>
+                <option value="month">Monthly</option>
+              </select>
+              <a href={`${consumptionQuery()}&format=csv`} className="text-blue-600 hover:underline">CSV</a>
+              <a href={`${consumptionQuery()}&format=parquet`} className="text-blue-600 hover:underline">Parquet</a>
+            </div>
+          </div>
+          {consumption.length > 0 ? (
+            <div className="overflow-x-auto rounded-lg border border-gray-200 shadow-sm">
+              <table className="min-w-full divide-y divide-gray-200">
+                <thead className="bg-gray-50">
+                  <tr>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Period</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Fuel Type</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Movements</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Qty (Liters)</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Transport</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Loading</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Other</th>
+                    <th className="px-4 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Landed Cost</th>
+                  </tr>
+                </thead>
+                <tbody className="bg-white divide-y divide-gray-200">
+                  {consumption.map((row) => (
+                    <tr key={`${row.period}-${row.fuelTypeID}`}>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.period}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.fuelTypeName}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.movements}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.quantity.toFixed(2)}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.transportationCost.toFixed(2)}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.loadingUnloadingCost.toFixed(2)}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.otherCost.toFixed(2)}</td>
+                      <td className="px-4 py-4 whitespace-nowrap text-sm text-gray-900">{row.landedCost.toFixed(2)}</td>
+                    </tr>
+                  ))}
+                </tbody>
+              </table>
+            </div>
+          ) : (
+            <p className="text-gray-600">No consumption data to display.</p>
+          )}
+        </div>
+      )}
     </div>
   );
 }
@@ -1,44 +1,51 @@
 # Flask Backend Application (app.py)
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from werkzeug.serving import is_running_from_reloader
 import pyodbc
-import os
-from datetime import datetime
-import uuid # For generating UsageTransitionID
+from datetime import date, datetime, timedelta
+
+from cache import MasterDataUnavailable, master_data
+from changes import (
+    CHANGES_LIMIT, REBUILDS_SQL, change_feed, current_cursor, event_stream, format_event, key_predicates, parse_since,
+    publish_movements, rebuild_notice, touched_keys,
+)
+from conditional import add_validators, conditional_get, not_modified, validators
+from dashboard import DashboardUnavailable, dashboard
+from db import db_connection, pool_stats
+from fluctuations import rebuild
+from forecast import FORECAST_LOW_STOCK_DAYS, forecaster, start_refresher
+from ingest import InsufficientStock, MovementError, add_movement, ingest_batch, parse_batch, parse_movement
+from journal import INGEST_WRITE_BEHIND, JournalUnavailable, ingest_journal
+from locations import LOCATION_LISTS, fuel_type_name, location_name, township_of
+from metrics import TEXT_CONTENT_TYPE, CallbackGauge, instrument_app, render
+from paging import (
+    NEXT_CURSOR_HEADER, QueryParamError, encode_cursor, fetch_page, page_response, parse_cursor,
+    parse_date_range, parse_datetime, parse_float, parse_int, parse_limit, where_clause,
+)
+from price_index import PriceIndexUnavailable, price_index
+from prices import PriceImportError, import_prices, prices_frame, read_prices_csv
+from reconcile import reconcile
+from reports import (
+    ReportError, consumption_report, invalidate_reports, label_report, parse_group_by,
+    report_csv, report_parquet, report_records,
+)
+from serialize import FLOAT, ISOFORMAT, Field, RowPlan
+from snapshots import inventory_as_of, start_scheduler, take_snapshot
+from streaming import stream_format, stream_response
+from tracing import trace_requests
+from valuation import rebuild as rebuild_valuation, stock_value_report
 
 # Initialize Flask app
 app = Flask(__name__)
 # Enable CORS for all origins, allowing frontend to connect
-CORS(app)
-
-# Database Configuration (replace with your actual SQL Server details)
-# It's recommended to use environment variables for sensitive information
-DB_CONFIG = {
-    'DRIVER': '{ODBC Driver 17 for SQL Server}', # Or '{SQL Server}'
-    'SERVER': os.getenv('DB_SERVER', 'localhost'), # e.g., 'your_server_name' or 'localhost'
-    'DATABASE': os.getenv('DB_NAME', 'FuelInventoryDB'),
-    'UID': os.getenv('DB_UID', 'your_username'), # Replace with your SQL Server username
-    'PWD': os.getenv('DB_PWD', 'your_password')  # Replace with your SQL Server password
-}
-
-def get_db_connection():
-    """Establishes and returns a database connection."""
-    try:
-        conn_str = (
-            f"DRIVER={DB_CONFIG['DRIVER']};"
-            f"SERVER={DB_CONFIG['SERVER']};"
-            f"DATABASE={DB_CONFIG['DATABASE']};"
-            f"UID={DB_CONFIG['UID']};"
-            f"PWD={DB_CONFIG['PWD']};"
-        )
-        conn = pyodbc.connect(conn_str)
-        conn.autocommit = True # Auto-commit changes to the database
-        return conn
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        print(f"Database connection error: {sqlstate} - {ex.args[1]}")
-        return None
+# (and to read the pagination headers on list responses)
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER, 'Link', 'ETag', 'Last-Modified'])
+# Request counts, latency and JSON encoding time for GET /metrics (metrics.py)
+instrument_app(app)
+# Per-request SQL tracing: Server-Timing header, slow-query log, query budget (tracing.py)
+trace_requests(app)
 
 # --- API Endpoints ---
 
@@ -47,136 +54,214 @@ def home():
     """Basic home route to confirm API is running."""
     return "Fuel Inventory API is running!"
 
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    """Reports database connection pool usage (in use, idle, waits, wait time)."""
+    return jsonify(pool_stats()), 200
+
+POOL_GAUGE = CallbackGauge(
+    'db_pool_connections', "Database pool connections by state.", ('state',),
+    lambda: {(state,): value for state, value in pool_stats().items() if state in ('size', 'inUse', 'idle', 'maxSize')}
+)
+POOL_WAITS = CallbackGauge(
+    'db_pool_checkout_waits', "Pool checkouts that had to wait, timeouts and deadlock retries since startup.", ('kind',),
+    lambda: {(kind,): value for kind, value in pool_stats().items() if kind in ('waits', 'timeouts', 'deadlockRetries')}
+)
+
+INGEST_QUEUE = CallbackGauge('ingest_queue', "Write-behind journal depth (transactions) and lag (seconds).", ('measure',),
+                             lambda: {('depth',): ingest_journal.stats()["depth"],
+                                      ('lagSeconds',): ingest_journal.stats()["lagSeconds"]})
+SSE_CLIENTS = CallbackGauge('sse_clients', "Connected change event-stream clients.", (),
+                            lambda: {(): change_feed.stats()["clients"]})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Exposes request, database and pool metrics in the Prometheus text format."""
+    return Response(render(), status=200, content_type=TEXT_CONTENT_TYPE)
+
 # --- Master Data Endpoints ---
+# Master data is served from the in-process cache (cache.py) as pre-serialized
+# JSON; the loaders below only run when a list is missing, expired or invalidated.
+
+def load_fuel_types(cursor):
+    cursor.execute("SELECT FuelTypeID, FuelTypeName, Description FROM FuelTypes")
+    fuel_types = []
+    for row in cursor.fetchall():
+        fuel_types.append({
+            "fuelTypeID": row.FuelTypeID,
+            "fuelTypeName": row.FuelTypeName,
+            "description": row.Description
+        })
+    return fuel_types
+
+def load_suppliers(cursor):
+    cursor.execute("SELECT SupplierID, SupplierName, ContactPerson, ContactEmail, ContactPhone, Address, City, Country FROM Suppliers")
+    suppliers = []
+    for row in cursor.fetchall():
+        suppliers.append({
+            "supplierID": row.SupplierID,
+            "supplierName": row.SupplierName,
+            "contactPerson": row.ContactPerson,
+            "contactEmail": row.ContactEmail,
+            "contactPhone": row.ContactPhone,
+            "address": row.Address,
+            "city": row.City,
+            "country": row.Country
+        })
+    return suppliers
+
+def load_townships(cursor):
+    cursor.execute("SELECT TownshipID, TownshipName, PostalCode, StateDivision FROM Townships")
+    townships = []
+    for row in cursor.fetchall():
+        townships.append({
+            "townshipID": row.TownshipID,
+            "townshipName": row.TownshipName,
+            "postalCode": row.PostalCode,
+            "stateDivision": row.StateDivision
+        })
+    return townships
+
+def load_sites(cursor):
+    cursor.execute("SELECT SiteID, SiteName, TownshipID, LocationDetails, Latitude, Longitude FROM Sites")
+    sites = []
+    for row in cursor.fetchall():
+        sites.append({
+            "siteID": row.SiteID,
+            "siteName": row.SiteName,
+            "townshipID": row.TownshipID,
+            "locationDetails": row.LocationDetails,
+            "latitude": str(row.Latitude) if row.Latitude is not None else None, # Convert Decimal to string
+            "longitude": str(row.Longitude) if row.Longitude is not None else None
+        })
+    return sites
+
+def load_warehouses(cursor):
+    cursor.execute("SELECT WarehouseID, WarehouseName, WarehouseType, GeneratedIDCode, LocationDetails, TownshipID, SiteID, SubOffice FROM Warehouses")
+    warehouses = []
+    for row in cursor.fetchall():
+        warehouses.append({
+            "warehouseID": row.WarehouseID,
+            "warehouseName": row.WarehouseName,
+            "warehouseType": row.WarehouseType,
+            "generatedIDCode": row.GeneratedIDCode,
+            "locationDetails": row.LocationDetails,
+            "townshipID": row.TownshipID,
+            "siteID": row.SiteID,
+            "subOffice": row.SubOffice
+        })
+    return warehouses
+
+master_data.register('fuelTypes', load_fuel_types)
+master_data.register('suppliers', load_suppliers)
+master_data.register('townships', load_townships)
+master_data.register('sites', load_sites)
+master_data.register('warehouses', load_warehouses)
+
+def master_data_response(name, label):
+    """Returns the cached JSON payload for one master-data list."""
+    try:
+        entry = master_data.get(name)
+    except MasterDataUnavailable:
+        return jsonify({"error": "Database connection failed"}), 500
+    except pyodbc.Error as ex:
+        print(f"Error fetching {label}: {ex}")
+        return jsonify({"error": f"Failed to fetch {label}"}), 500
+    # ETag from a hash of the cached payload: unchanged polls get a 304 without a body.
+    etag, last_modified = validators(name, (name,))
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    return add_validators(Response(entry.payload, status=200, mimetype='application/json'), etag, last_modified)
 
 @app.route('/api/fueltypes', methods=['GET'])
 def get_fuel_types():
     """Fetches all fuel types."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT FuelTypeID, FuelTypeName, Description FROM FuelTypes")
-        fuel_types = []
-        for row in cursor.fetchall():
-            fuel_types.append({
-                "fuelTypeID": row.FuelTypeID,
-                "fuelTypeName": row.FuelTypeName,
-                "description": row.Description
-            })
-        return jsonify(fuel_types), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching fuel types: {ex}")
-        return jsonify({"error": "Failed to fetch fuel types"}), 500
-    finally:
-        conn.close()
+    return master_data_response('fuelTypes', 'fuel types')
 
 @app.route('/api/suppliers', methods=['GET'])
 def get_suppliers():
     """Fetches all suppliers."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT SupplierID, SupplierName, ContactPerson, ContactEmail, ContactPhone, Address, City, Country FROM Suppliers")
-        suppliers = []
-        for row in cursor.fetchall():
-            suppliers.append({
-                "supplierID": row.SupplierID,
-                "supplierName": row.SupplierName,
-                "contactPerson": row.ContactPerson,
-                "contactEmail": row.ContactEmail,
-                "contactPhone": row.ContactPhone,
-                "address": row.Address,
-                "city": row.City,
-                "country": row.Country
-            })
-        return jsonify(suppliers), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching suppliers: {ex}")
-        return jsonify({"error": "Failed to fetch suppliers"}), 500
-    finally:
-        conn.close()
+    return master_data_response('suppliers', 'suppliers')
 
 @app.route('/api/townships', methods=['GET'])
 def get_townships():
     """Fetches all townships."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT TownshipID, TownshipName, PostalCode, StateDivision FROM Townships")
-        townships = []
-        for row in cursor.fetchall():
-            townships.append({
-                "townshipID": row.TownshipID,
-                "townshipName": row.TownshipName,
-                "postalCode": row.PostalCode,
-                "stateDivision": row.StateDivision
-            })
-        return jsonify(townships), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching townships: {ex}")
-        return jsonify({"error": "Failed to fetch townships"}), 500
-    finally:
-        conn.close()
+    return master_data_response('townships', 'townships')
 
 @app.route('/api/sites', methods=['GET'])
 def get_sites():
     """Fetches all sites."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT SiteID, SiteName, TownshipID, LocationDetails, Latitude, Longitude FROM Sites")
-        sites = []
-        for row in cursor.fetchall():
-            sites.append({
-                "siteID": row.SiteID,
-                "siteName": row.SiteName,
-                "townshipID": row.TownshipID,
-                "locationDetails": row.LocationDetails,
-                "latitude": str(row.Latitude) if row.Latitude else None, # Convert Decimal to string
-                "longitude": str(row.Longitude) if row.Longitude else None
-            })
-        return jsonify(sites), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching sites: {ex}")
-        return jsonify({"error": "Failed to fetch sites"}), 500
-    finally:
-        conn.close()
+    return master_data_response('sites', 'sites')
 
 @app.route('/api/warehouses', methods=['GET'])
 def get_warehouses():
     """Fetches all warehouses."""
-    conn = get_db_connection()
-    if conn is None:
+    return master_data_response('warehouses', 'warehouses')
+
+@app.route('/api/masterdata', methods=['GET'])
+def get_master_data_bundle():
+    """Fetches several master-data lists in one response.
+
+    Query parameter include: comma-separated list names (fuelTypes,
+    suppliers, townships, sites, warehouses); omit for all of them.
+    Returns {"<name>": [...], ...} built from the cached JSON payloads.
+    """
+    include = request.args.get('include')
+    names = master_data.names()
+    if include:
+        names = list(dict.fromkeys(name.strip() for name in include.split(',') if name.strip()))
+    try:
+        entries = master_data.get_many(names)
+    except KeyError as ex:
+        return jsonify({"error": f"Unknown master data list: {ex.args[0]}"}), 400
+    except MasterDataUnavailable:
         return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    except pyodbc.Error as ex:
+        print(f"Error fetching master data: {ex}")
+        return jsonify({"error": "Failed to fetch master data"}), 500
+    etag, last_modified = validators('masterData:' + ','.join(names), names)
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    payload = b'{' + b','.join(f'"{name}":'.encode('utf-8') + entries[name].payload for name in names) + b'}'
+    return add_validators(Response(payload, status=200, mimetype='application/json'), etag, last_modified)
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_master_data():
+    """Drops cached master data so the next request reloads it.
+
+    Body (optional): {"names": ["sites", "warehouses"]}; omit to drop everything.
+    """
+    data = request.get_json(silent=True) or {}
+    names = data.get('names') or []
     try:
-        cursor.execute("SELECT WarehouseID, WarehouseName, WarehouseType, GeneratedIDCode, LocationDetails, TownshipID, SiteID, SubOffice FROM Warehouses")
-        warehouses = []
-        for row in cursor.fetchall():
-            warehouses.append({
-                "warehouseID": row.WarehouseID,
-                "warehouseName": row.WarehouseName,
-                "warehouseType": row.WarehouseType,
-                "generatedIDCode": row.GeneratedIDCode,
-                "locationDetails": row.LocationDetails,
-                "townshipID": row.TownshipID,
-                "siteID": row.SiteID,
-                "subOffice": row.SubOffice
-            })
-        return jsonify(warehouses), 200
+        master_data.invalidate(*names)
+    except KeyError as ex:
+        return jsonify({"error": f"Unknown master data list: {ex.args[0]}"}), 400
+    return jsonify({"message": "Master data cache invalidated", "versions": master_data.versions()}), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Reports master data cache hits, misses, versions and entry sizes."""
+    return jsonify(master_data.stats()), 200
+
+# --- Dashboard Endpoint ---
+
+@app.route('/api/dashboard/summary', methods=['GET'])
+def get_dashboard_summary():
+    """Returns stock totals, latest prices and recent movement counts for the dashboard.
+
+    Served from in-memory aggregates (dashboard.py) that the write endpoints
+    keep up to date, so no inventory or ledger rows are scanned per request.
+    """
+    try:
+        return jsonify(dashboard.summary()), 200
+    except DashboardUnavailable:
+        return jsonify({"error": "Database connection failed"}), 500
     except pyodbc.Error as ex:
-        print(f"Error fetching warehouses: {ex}")
-        return jsonify({"error": "Failed to fetch warehouses"}), 500
-    finally:
-        conn.close()
+        print(f"Error loading dashboard summary: {ex}")
+        return jsonify({"error": "Failed to load dashboard summary"}), 500
 
 # --- Fuel Price Endpoints ---
 
@@ -203,317 +288,911 @@ def add_fuel_price():
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid data types for price or effectiveDate"}), 400
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    # The price and its fluctuation are written together in one transaction;
+    # the previous price is looked up the same way as for bulk imports.
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            summary = import_prices(conn, prices_frame([{
+                "fuelTypeID": fuel_type_id, "price": price, "effectiveDate": effective_date.isoformat(),
+                "supplierID": supplier_id, "townshipID": township_id, "siteID": site_id,
+            }]))
+            price_index.notify_written(conn.cursor())
+            dashboard.record_prices(summary["latestByFuelType"])
+            return jsonify({"message": "Fuel price added and fluctuation recorded successfully"}), 201
+        except PriceImportError as ex:
+            return jsonify({"error": ex.errors[0]["error"] if ex.errors else str(ex)}), 400
+        except pyodbc.Error as ex:
+            print(f"Error adding fuel price: {ex}")
+            return jsonify({"error": "Failed to add fuel price"}), 500
+
+@app.route('/api/fuelprices/import', methods=['POST'])
+def import_fuel_prices():
+    """Bulk-imports fuel prices and records their fluctuations in one transaction.
 
+    Accepts text/csv (header: fuelTypeID,price,effectiveDate,supplierID,
+    townshipID,siteID) or a JSON array of the same objects (also as
+    {"prices": [...]}). ?dryRun=1 validates and computes without writing.
+    Any invalid row rejects the import; errors are listed by row index.
+    """
+    dry_run = request.args.get('dryRun') in ('1', 'true')
     try:
-        # 1. Insert new fuel price
-        cursor.execute(
-            "INSERT INTO FuelPrices (FuelTypeID, Price, EffectiveDate, SupplierID, TownshipID, SiteID) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            fuel_type_id, price, effective_date, supplier_id, township_id, site_id
-        )
-        conn.commit() # Commit the price insertion
-
-        # 2. Calculate and record price fluctuation
-        previous_price = None
-        fluctuation_amount = None
-        fluctuation_type = '-'
-
-        # Find the most recent previous price for the same fuel type
-        cursor.execute(
-            "SELECT TOP 1 Price FROM FuelPrices "
-            "WHERE FuelTypeID = ? AND EffectiveDate < ? "
-            "ORDER BY EffectiveDate DESC",
-            fuel_type_id, effective_date
-        )
-        prev_row = cursor.fetchone()
-        if prev_row:
-            previous_price = prev_row.Price
-            fluctuation_amount = price - previous_price
-            if fluctuation_amount > 0:
-                fluctuation_type = 'Increase'
-            elif fluctuation_amount < 0:
-                fluctuation_type = 'Decrease'
-            else:
-                fluctuation_type = 'No Change'
-
-        cursor.execute(
-            "INSERT INTO PriceFluctuations (FuelTypeID, FluctuationDate, CurrentPrice, PreviousPrice, FluctuationAmount, FluctuationType) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            fuel_type_id, effective_date, price, previous_price, fluctuation_amount, fluctuation_type
+        if request.mimetype in ('text/csv', 'application/csv'):
+            frame = read_prices_csv(request.get_data(as_text=True))
+        else:
+            payload = request.get_json(silent=True)
+            if isinstance(payload, dict):
+                payload = payload.get('prices')
+            frame = prices_frame(payload)
+    except PriceImportError as ex:
+        return jsonify({"error": str(ex), "errors": ex.errors}), 400
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            summary = import_prices(conn, frame, dry_run=dry_run)
+            if not dry_run:
+                price_index.notify_written(conn.cursor())
+                dashboard.record_prices(summary["latestByFuelType"])
+        except PriceImportError as ex:
+            return jsonify({"error": str(ex), "errors": ex.errors}), 400
+        except pyodbc.Error as ex:
+            print(f"Error importing fuel prices: {ex}")
+            return jsonify({"error": "Failed to import fuel prices"}), 500
+    return jsonify(summary), 200 if dry_run else 201
+
+def price_context(source_type, source_id, destination_type, destination_id):
+    """Derives the (supplierID, townshipID, siteID) pricing context of a movement.
+
+    The supplier is the source when it is one; the site is the destination
+    (or source) site; the township is the destination's, else the source's.
+    """
+    supplier_id = source_id if source_type == 'Supplier' else None
+    if destination_type == 'Site':
+        site_id = destination_id
+    elif source_type == 'Site':
+        site_id = source_id
+    else:
+        site_id = None
+    try:
+        township_id = township_of(destination_type, destination_id) or township_of(source_type, source_id)
+    except MasterDataUnavailable:
+        township_id = None # Fall back to supplier/site/generic prices
+    return supplier_id, township_id, site_id
+
+def resolve_movement_price(movement, cursor):
+    """Returns the FuelPriceID effective for a movement, or None if no price applies."""
+    context = price_context(movement.source_location_type, movement.source_location_id,
+                            movement.destination_location_type, movement.destination_location_id)
+    match = price_index.resolve(movement.fuel_type_id, movement.transaction_date, *context, cursor=cursor)
+    return match.fuel_price_id if match else None
+
+@app.route('/api/fuelprices/effective', methods=['GET'])
+def get_effective_fuel_price():
+    """Resolves the fuel price that applies on a date.
+
+    Query parameters: fuelTypeID (required), date (YYYY-MM-DD or ISO
+    timestamp, default today) and the context either as supplierID /
+    townshipID / siteID or as a movement's sourceLocationType/ID and
+    destinationLocationType/ID. The most specific matching price wins.
+    """
+    try:
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        when = parse_datetime(request.args['date'], 'date') if request.args.get('date') else datetime.now()
+        source_id = parse_int(request.args, 'sourceLocationID')
+        destination_id = parse_int(request.args, 'destinationLocationID')
+        supplier_id = parse_int(request.args, 'supplierID')
+        township_id = parse_int(request.args, 'townshipID')
+        site_id = parse_int(request.args, 'siteID')
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+    if fuel_type_id is None:
+        return jsonify({"error": "fuelTypeID is required"}), 400
+
+    if source_id is not None or destination_id is not None:
+        derived = price_context(request.args.get('sourceLocationType'), source_id,
+                                request.args.get('destinationLocationType'), destination_id)
+        supplier_id, township_id, site_id = (
+            given if given is not None else value
+            for given, value in zip((supplier_id, township_id, site_id), derived)
         )
-        conn.commit() # Commit the fluctuation insertion
 
-        return jsonify({"message": "Fuel price added and fluctuation recorded successfully"}), 201
+    try:
+        match = price_index.resolve(fuel_type_id, when, supplier_id, township_id, site_id)
+    except PriceIndexUnavailable:
+        return jsonify({"error": "Database connection failed"}), 500
     except pyodbc.Error as ex:
-        print(f"Error adding fuel price: {ex}")
-        conn.rollback() # Rollback in case of error
-        return jsonify({"error": "Failed to add fuel price"}), 500
-    finally:
-        conn.close()
+        print(f"Error resolving fuel price: {ex}")
+        return jsonify({"error": "Failed to resolve fuel price"}), 500
+    if match is None:
+        return jsonify({"error": "No fuel price is effective for this fuel type, date and context"}), 404
+    return jsonify(match.to_dict()), 200
+
+PRICE_FLUCTUATIONS_QUERY = """
+    SELECT pf.FluctuationID, ft.FuelTypeName, pf.FluctuationDate, pf.CurrentPrice,
+           pf.PreviousPrice, pf.FluctuationAmount, pf.FluctuationType, pf.Notes
+    FROM PriceFluctuations pf
+    JOIN FuelTypes ft ON pf.FuelTypeID = ft.FuelTypeID
+"""
+
+PRICE_FLUCTUATION_PLAN = RowPlan('price_fluctuation', [
+    Field("fluctuationID", "FluctuationID"),
+    Field("fuelTypeName", "FuelTypeName"),
+    Field("fluctuationDate", "FluctuationDate", ISOFORMAT, nullable=False),
+    Field("currentPrice", "CurrentPrice", FLOAT, nullable=False),
+    Field("previousPrice", "PreviousPrice", FLOAT),
+    Field("fluctuationAmount", "FluctuationAmount", FLOAT),
+    Field("fluctuationType", "FluctuationType"),
+    Field("notes", "Notes"),
+])
 
 @app.route('/api/pricefluctuations', methods=['GET'])
+@conditional_get('priceFluctuations', 'fuelTypes')
 def get_price_fluctuations():
-    """Fetches price fluctuations."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    """Fetches price fluctuations, newest first, one page at a time.
+
+    Query parameters: fuelTypeID, from/to (FluctuationDate range), limit and
+    cursor (from the X-Next-Cursor header of the previous page). With
+    `Accept: application/x-ndjson` or `?stream=1` every matching row is
+    streamed instead of one page. Responses carry an ETag (conditional.py):
+    a poll with a matching If-None-Match gets a 304 before any list query.
+    """
     try:
-        cursor.execute("""
-            SELECT pf.FluctuationID, ft.FuelTypeName, pf.FluctuationDate, pf.CurrentPrice,
-                   pf.PreviousPrice, pf.FluctuationAmount, pf.FluctuationType, pf.Notes
-            FROM PriceFluctuations pf
-            JOIN FuelTypes ft ON pf.FuelTypeID = ft.FuelTypeID
-            ORDER BY pf.FluctuationDate DESC
-        """)
-        fluctuations = []
-        for row in cursor.fetchall():
-            fluctuations.append({
-                "fluctuationID": row.FluctuationID,
-                "fuelTypeName": row.FuelTypeName,
-                "fluctuationDate": row.FluctuationDate.isoformat(),
-                "currentPrice": float(row.CurrentPrice),
-                "previousPrice": float(row.PreviousPrice) if row.PreviousPrice else None,
-                "fluctuationAmount": float(row.FluctuationAmount) if row.FluctuationAmount else None,
-                "fluctuationType": row.FluctuationType,
-                "notes": row.Notes
-            })
-        return jsonify(fluctuations), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching price fluctuations: {ex}")
-        return jsonify({"error": "Failed to fetch price fluctuations"}), 500
-    finally:
-        conn.close()
+        limit = parse_limit(request.args)
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        start, end = parse_date_range(request.args, dates_only=True)
+        after = parse_cursor(request.args, (date.fromisoformat, int))
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
 
+    conditions, params = [], []
+    if fuel_type_id is not None:
+        conditions.append("pf.FuelTypeID = ?")
+        params.append(fuel_type_id)
+    if start is not None:
+        conditions.append("pf.FluctuationDate >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("pf.FluctuationDate < ?")
+        params.append(end)
+    if after is not None:
+        conditions.append("(pf.FluctuationDate < ? OR (pf.FluctuationDate = ? AND pf.FluctuationID < ?))")
+        params.extend([after[0], after[0], after[1]])
+    # Seeks IX_PriceFluctuations_FluctuationDate / IX_PriceFluctuations_FuelTypeID_FluctuationDate
+    query = f"""{PRICE_FLUCTUATIONS_QUERY}
+        {where_clause(conditions)}
+        ORDER BY pf.FluctuationDate DESC, pf.FluctuationID DESC
+    """
+
+    fmt = stream_format(request)
+    if fmt:
+        return stream_response(query, params, PRICE_FLUCTUATION_PLAN, "price fluctuations", fmt)
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+        try:
+            rows, next_key = fetch_page(cursor, query + "OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY", params, limit,
+                                        lambda row: [row.FluctuationDate, row.FluctuationID])
+            return page_response(PRICE_FLUCTUATION_PLAN.encode(cursor, rows), next_key), 200
+        except pyodbc.Error as ex:
+            print(f"Error fetching price fluctuations: {ex}")
+            return jsonify({"error": "Failed to fetch price fluctuations"}), 500
+
+@app.route('/api/pricefluctuations/rebuild', methods=['POST'])
+def rebuild_price_fluctuations():
+    """Recomputes price fluctuations after back-dated or corrected prices.
+
+    Body (all optional): {"fuelTypeID": 2, "from": "2024-03-01", "to": "2024-06-30"},
+    with from/to read like the list filters. `from` should be the earliest
+    changed date; without it the whole history is rebuilt.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON data"}), 400
+    try:
+        fuel_type_id = parse_int(data, 'fuelTypeID')
+        start, end = parse_date_range(data, dates_only=True)
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            return jsonify(rebuild(conn, fuel_type_id, start, end)), 200
+        except pyodbc.Error as ex:
+            print(f"Error rebuilding price fluctuations: {ex}")
+            return jsonify({"error": "Failed to rebuild price fluctuations"}), 500
 
 # --- Fuel Transaction Endpoints ---
 
 @app.route('/api/fueltransactions', methods=['POST'])
 def add_fuel_transaction():
-    """Adds a new fuel transaction (replenishment or transfer) and updates inventory."""
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Invalid JSON data"}), 400
+    """Adds a new fuel transaction (replenishment or transfer) and updates inventory.
 
-    # Required fields
-    transaction_type = data.get('transactionType')
-    source_location_type = data.get('sourceLocationType')
-    source_location_id = data.get('sourceLocationID')
-    destination_location_type = data.get('destinationLocationType')
-    destination_location_id = data.get('destinationLocationID')
-    fuel_type_id = data.get('fuelTypeID')
-    quantity = data.get('quantity')
-    transaction_date_str = data.get('transactionDate')
-    fuel_price_id = data.get('fuelPriceID') # This should come from frontend or be looked up
+    With `Prefer: respond-async` (or INGEST_WRITE_BEHIND=1) the validated
+    transaction is journaled and answered with 202; journal.py writes it to
+    the database in the background. It is also queued instead of failing
+    when no database connection is available.
+    """
+    data = request.get_json()
+    try:
+        movement = parse_movement(data)
+    except MovementError as ex:
+        return jsonify({"error": str(ex)}), 400
 
-    # Optional fields
-    transportation_cost = data.get('transportationCost', 0)
-    loading_unloading_cost = data.get('loadingUnloadingCost', 0)
-    other_cost = data.get('otherCost', 0)
-    notes = data.get('notes')
+    if INGEST_WRITE_BEHIND or 'respond-async' in request.headers.get('Prefer', ''):
+        return queue_movement(movement, data)
 
-    if not all([transaction_type, source_location_type, source_location_id,
-                destination_location_type, destination_location_id,
-                fuel_type_id, quantity, transaction_date_str]):
-        return jsonify({"error": "Missing required fields"}), 400
+    with db_connection() as conn:
+        if conn is None:
+            return queue_movement(movement, data)
+        try:
+            if movement.fuel_price_id is None:
+                movement.fuel_price_id = resolve_movement_price(movement, conn.cursor())
+            # Debit, credit and ledger insert commit together; deadlock victims are retried
+            source_stock = add_movement(conn, movement)
+            movements_committed(conn, [movement])
+            response = {"message": "Fuel transaction added and inventory updated successfully", "usageTransitionID": movement.usage_transition_id,
+                        "fuelPriceID": movement.fuel_price_id}
+            if source_stock is not None:
+                response["sourceStock"] = source_stock
+            return jsonify(response), 201
+        except InsufficientStock:
+            return jsonify({"error": "Insufficient stock at source location"}), 400
+        except pyodbc.Error as ex:
+            print(f"Error adding fuel transaction: {ex}")
+            return jsonify({"error": "Failed to add fuel transaction"}), 500
 
+def queue_movement(movement, data):
+    """Journals a validated movement for the write-behind worker (202 Accepted)."""
     try:
-        quantity = float(quantity)
-        transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%dT%H:%M:%S.%fZ') # ISO format from JS
-    except (ValueError, TypeError):
-        return jsonify({"error": "Invalid data types for quantity or transactionDate"}), 400
+        ingest_journal.enqueue(movement, data)
+    except JournalUnavailable as ex:
+        print(f"Error queueing fuel transaction: {ex}")
+        return jsonify({"error": "Failed to queue fuel transaction"}), 503
+    response = jsonify({"message": "Fuel transaction accepted and queued", "usageTransitionID": movement.usage_transition_id,
+                        "queueDepth": ingest_journal.stats()["depth"]})
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        response.headers['Preference-Applied'] = 'respond-async'
+    return response, 202
 
-    if quantity <= 0:
-        return jsonify({"error": "Quantity must be positive"}), 400
+def movements_committed(conn, movements):
+    """Updates the in-memory views after movements commit (request handlers and journal worker)."""
+    dashboard.record_movements(movements)
+    invalidate_reports(movements)
+    publish_movements(conn, movements)
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+ingest_journal.configure(db_connection, resolve_movement_price, movements_committed)
+
+@app.route('/api/fueltransactions/queue', methods=['GET'])
+def get_ingest_queue():
+    """Reports the write-behind journal: queue depth, lag of the oldest queued transaction, counters."""
+    return jsonify(ingest_journal.stats()), 200
 
+@app.route('/api/fueltransactions/batch', methods=['POST'])
+def add_fuel_transactions_batch():
+    """Adds many fuel transactions in one database transaction.
+
+    Body: a JSON array of transactions (same fields as POST /api/fueltransactions)
+    or {"mode": "atomic" | "partial", "transactions": [...]}. In atomic mode
+    (the default) any invalid item rejects the whole batch; in partial mode
+    valid items are written and the rest are reported back by index.
+    """
     try:
-        # Start a transaction for atomicity
-        conn.autocommit = False
+        items, mode = parse_batch(request.get_json(silent=True))
+    except MovementError as ex:
+        return jsonify({"error": str(ex)}), 400
 
-        # Generate unique UsageTransitionID
-        usage_transition_id = f"TRANS-{uuid.uuid4()}"
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            accepted, errors = ingest_batch(conn, items, mode, resolve_movement_price)
+            movements_committed(conn, [movement for _, movement in accepted])
+        except pyodbc.Error as ex:
+            print(f"Error adding fuel transaction batch: {ex}")
+            return jsonify({"error": "Failed to add fuel transactions"}), 500
 
-        # 1. Validate Source Stock (if source is a Warehouse or Site)
-        if source_location_type in ['Warehouse', 'Site']:
-            cursor.execute(
-                "SELECT CurrentStock FROM FuelInventory WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ?",
-                fuel_type_id, source_location_type, source_location_id
-            )
-            source_stock_row = cursor.fetchone()
-            if not source_stock_row or source_stock_row.CurrentStock < quantity:
-                conn.rollback()
-                return jsonify({"error": "Insufficient stock at source location"}), 400
-
-        # 2. Insert into FuelTransactions
-        cursor.execute(
-            "INSERT INTO FuelTransactions (UsageTransitionID, TransactionType, SourceLocationType, SourceLocationID, "
-            "DestinationLocationType, DestinationLocationID, FuelTypeID, Quantity, TransactionDate, FuelPriceID, "
-            "TransportationCost, LoadingUnloadingCost, OtherCost, Notes) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            usage_transition_id, transaction_type, source_location_type, source_location_id,
-            destination_location_type, destination_location_id, fuel_type_id, quantity, transaction_date, fuel_price_id,
-            transportation_cost, loading_unloading_cost, other_cost, notes
-        )
+    if not accepted:
+        return jsonify({"error": "No transactions were added", "mode": mode, "errors": errors}), 400
+    return jsonify({
+        "message": f"{len(accepted)} fuel transactions added and inventory updated successfully",
+        "mode": mode,
+        "accepted": [{"index": index, "usageTransitionID": movement.usage_transition_id, "fuelPriceID": movement.fuel_price_id}
+                     for index, movement in accepted],
+        "errors": errors,
+    }), 201
 
-        # 3. Update FuelInventory (Decrease Source Stock)
-        if source_location_type in ['Warehouse', 'Site']:
-            cursor.execute(
-                "UPDATE FuelInventory SET CurrentStock = CurrentStock - ?, LastUpdated = GETDATE() "
-                "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ?",
-                quantity, fuel_type_id, source_location_type, source_location_id
-            )
+def parse_location_filter(args, allowed):
+    """Reads the optional locationType/locationID filter pair."""
+    location_type = args.get('locationType') or None
+    location_id = parse_int(args, 'locationID')
+    if location_type is not None and location_type not in allowed:
+        raise QueryParamError(f"locationType must be one of: {', '.join(allowed)}")
+    if location_id is not None and location_type is None:
+        raise QueryParamError("locationID requires locationType")
+    return location_type, location_id
 
-        # 4. Update FuelInventory (Increase Destination Stock)
-        cursor.execute(
-            "MERGE FuelInventory AS target "
-            "USING (VALUES (?, ?, ?, ?)) AS source (FuelTypeID, LocationType, LocationID, Quantity) "
-            "ON (target.FuelTypeID = source.FuelTypeID AND target.LocationType = source.LocationType AND target.LocationID = source.LocationID) "
-            "WHEN MATCHED THEN "
-            "    UPDATE SET CurrentStock = target.CurrentStock + source.Quantity, LastUpdated = GETDATE() "
-            "WHEN NOT MATCHED THEN "
-            "    INSERT (FuelTypeID, LocationType, LocationID, CurrentStock, LastUpdated) VALUES (source.FuelTypeID, source.LocationType, source.LocationID, source.Quantity, GETDATE());",
-            fuel_type_id, destination_location_type, destination_location_id, quantity
-        )
+# Lean rows: fuel type and location names are resolved from the in-memory
+# lookups in locations.py instead of joining FuelTypes, Warehouses and Sites.
+FUEL_INVENTORY_QUERY = """
+    SELECT fi.InventoryID, fi.FuelTypeID, fi.LocationType, fi.LocationID, fi.CurrentStock, fi.LastUpdated
+    FROM FuelInventory fi
+"""
 
-        conn.commit() # Commit all changes if successful
-        return jsonify({"message": "Fuel transaction added and inventory updated successfully", "usageTransitionID": usage_transition_id}), 201
+def inventory_location_name(location_type, location_id):
+    return location_name(location_type, location_id) if location_type in ('Warehouse', 'Site') else 'Unknown'
 
-    except pyodbc.Error as ex:
-        print(f"Error adding fuel transaction: {ex}")
-        conn.rollback() # Rollback in case of error
-        return jsonify({"error": "Failed to add fuel transaction"}), 500
-    finally:
-        conn.autocommit = True # Reset autocommit
-        conn.close()
+FUEL_INVENTORY_PLAN = RowPlan('fuel_inventory', [
+    Field("inventoryID", "InventoryID"),
+    Field("fuelTypeID", "FuelTypeID"),
+    Field("fuelTypeName", "FuelTypeID", fuel_type_name),
+    Field("locationType", "LocationType"),
+    Field("locationID", "LocationID"),
+    Field("locationName", ("LocationType", "LocationID"), inventory_location_name),
+    Field("currentStock", "CurrentStock", FLOAT, nullable=False),
+    Field("lastUpdated", "LastUpdated", ISOFORMAT, nullable=False),
+])
 
 @app.route('/api/fuelinventory', methods=['GET'])
+@conditional_get('fuelInventory', 'fuelTypes', 'warehouses', 'sites')
 def get_fuel_inventory():
-    """Fetches current fuel inventory levels."""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    """Fetches current fuel inventory levels, one page at a time.
+
+    Pages follow the UQ_FuelInventory_LocationTypeID key (fuel type, location
+    type, location ID). Query parameters: fuelTypeID, locationType,
+    locationID, limit and cursor; streams like /api/pricefluctuations.
+    With asOf (YYYY-MM-DD for the end of that day, or an ISO timestamp) the
+    balances at that moment are returned instead, from inventory snapshots.
+    """
     try:
-        cursor.execute("""
-            SELECT fi.InventoryID, ft.FuelTypeName, fi.LocationType,
-                   CASE
-                       WHEN fi.LocationType = 'Warehouse' THEN w.WarehouseName
-                       WHEN fi.LocationType = 'Site' THEN s.SiteName
-                       ELSE 'Unknown'
-                   END AS LocationName,
-                   fi.CurrentStock, fi.LastUpdated
-            FROM FuelInventory fi
-            JOIN FuelTypes ft ON fi.FuelTypeID = ft.FuelTypeID
-            LEFT JOIN Warehouses w ON fi.LocationType = 'Warehouse' AND fi.LocationID = w.WarehouseID
-            LEFT JOIN Sites s ON fi.LocationType = 'Site' AND fi.LocationID = s.SiteID
-            ORDER BY ft.FuelTypeName, LocationName
-        """)
-        inventory = []
-        for row in cursor.fetchall():
-            inventory.append({
-                "inventoryID": row.InventoryID,
-                "fuelTypeName": row.FuelTypeName,
-                "locationType": row.LocationType,
-                "locationName": row.LocationName,
-                "currentStock": float(row.CurrentStock),
-                "lastUpdated": row.LastUpdated.isoformat()
-            })
-        return jsonify(inventory), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching fuel inventory: {ex}")
-        return jsonify({"error": "Failed to fetch fuel inventory"}), 500
-    finally:
-        conn.close()
+        limit = parse_limit(request.args)
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        location_type, location_id = parse_location_filter(request.args, ('Warehouse', 'Site'))
+        after = parse_cursor(request.args, (int, str, int))
+        as_of = None
+        if request.args.get('asOf'):
+            as_of = parse_datetime(request.args['asOf'], 'asOf')
+            if len(request.args['asOf']) == 10:
+                as_of += timedelta(days=1)
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    if as_of is not None:
+        return fuel_inventory_as_of(as_of, fuel_type_id, location_type, location_id, after, limit)
+
+    conditions, params = [], []
+    if fuel_type_id is not None:
+        conditions.append("fi.FuelTypeID = ?")
+        params.append(fuel_type_id)
+    if location_type is not None:
+        conditions.append("fi.LocationType = ?")
+        params.append(location_type)
+    if location_id is not None:
+        conditions.append("fi.LocationID = ?")
+        params.append(location_id)
+    if after is not None:
+        conditions.append(
+            "(fi.FuelTypeID > ? OR (fi.FuelTypeID = ? AND "
+            "(fi.LocationType > ? OR (fi.LocationType = ? AND fi.LocationID > ?))))"
+        )
+        params.extend([after[0], after[0], after[1], after[1], after[2]])
+    query = f"""{FUEL_INVENTORY_QUERY}
+        {where_clause(conditions)}
+        ORDER BY fi.FuelTypeID, fi.LocationType, fi.LocationID
+    """
+
+    fmt = stream_format(request)
+    if fmt:
+        return stream_response(query, params, FUEL_INVENTORY_PLAN, "fuel inventory", fmt)
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+        try:
+            rows, next_key = fetch_page(cursor, query + "OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY", params, limit,
+                                        lambda row: [row.FuelTypeID, row.LocationType, row.LocationID])
+            return page_response(FUEL_INVENTORY_PLAN.encode(cursor, rows), next_key), 200
+        except pyodbc.Error as ex:
+            print(f"Error fetching fuel inventory: {ex}")
+            return jsonify({"error": "Failed to fetch fuel inventory"}), 500
+
+def fuel_inventory_as_of(as_of, fuel_type_id, location_type, location_id, after, limit):
+    """Pages through the balances at `as_of` (nearest snapshot plus ledger replay)."""
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            balances, snapshot_at, replayed = inventory_as_of(conn.cursor(), as_of, fuel_type_id,
+                                                              location_type, location_id)
+        except pyodbc.Error as ex:
+            print(f"Error fetching fuel inventory as of {as_of}: {ex}")
+            return jsonify({"error": "Failed to fetch fuel inventory"}), 500
+
+    keys = sorted(key for key in balances if after is None or key > tuple(after))
+    next_key = list(keys[limit - 1]) if len(keys) > limit else None
+    inventory = [{
+        "fuelTypeID": key[0],
+        "fuelTypeName": fuel_type_name(key[0]),
+        "locationType": key[1],
+        "locationID": key[2],
+        "locationName": location_name(key[1], key[2]) or 'Unknown',
+        "currentStock": round(balances[key], 2),
+        "asOf": as_of.isoformat(),
+    } for key in keys[:limit]]
+    response = page_response(inventory, next_key)
+    response.headers['X-Snapshot-At'] = snapshot_at.isoformat() if snapshot_at else 'none'
+    response.headers['X-Replayed-Entries'] = str(replayed)
+    return response, 200
+
+@app.route('/api/fuelinventory/snapshots', methods=['POST'])
+def create_inventory_snapshot():
+    """Writes the inventory snapshot for the latest boundary (or {"at": timestamp}) if missing."""
+    data = request.get_json(silent=True) or {}
+    try:
+        at = parse_datetime(data['at'], 'at') if isinstance(data, dict) and data.get('at') else None
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            result = take_snapshot(conn, at)
+        except pyodbc.Error as ex:
+            print(f"Error taking inventory snapshot: {ex}")
+            return jsonify({"error": "Failed to take inventory snapshot"}), 500
+    return jsonify(result), 201 if result["rows"] else 200
+
+@app.route('/api/fuelinventory/reconcile', methods=['POST'])
+def reconcile_fuel_inventory():
+    """Compares every inventory balance with the net of the transaction ledger.
+
+    Body (optional): {"repair": true} sets drifted balances to the ledger's;
+    {"full": true} re-reads the whole ledger instead of resuming from the
+    last checkpoint. Inventory rows without ledger history (opening
+    balances) are reported as unledgered and left alone unless
+    {"repair": true, "zeroUnledgered": true}. Returns the discrepancies found.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON data"}), 400
+    repair = bool(data.get('repair'))
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            report = reconcile(conn, full=bool(data.get('full')), repair=repair,
+                               zero_unledgered=bool(data.get('zeroUnledgered')))
+            if report["repaired"] and dashboard.loaded:
+                dashboard.reload(conn.cursor())
+        except pyodbc.Error as ex:
+            print(f"Error reconciling fuel inventory: {ex}")
+            return jsonify({"error": "Failed to reconcile fuel inventory"}), 500
+    return jsonify(report), 200
+
+@app.route('/api/fuelinventory/valuation', methods=['GET'])
+def get_inventory_valuation():
+    """Returns stock value by location: CurrentStock x weighted-average unit cost.
+
+    Query parameters: locationType/locationID, fuelTypeID. Each location
+    lists its fuels with stock, average unit cost and value (valuation.py).
+    """
+    try:
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        location_type, location_id = parse_location_filter(request.args, ('Warehouse', 'Site'))
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            report = stock_value_report(conn.cursor(), fuel_type_id, location_type, location_id)
+        except pyodbc.Error as ex:
+            print(f"Error fetching inventory valuation: {ex}")
+            return jsonify({"error": "Failed to fetch inventory valuation"}), 500
+    return jsonify(report), 200
+
+@app.route('/api/fuelinventory/valuation/rebuild', methods=['POST'])
+def rebuild_inventory_valuation():
+    """Recomputes every average unit cost by replaying the transaction ledger."""
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            report = rebuild_valuation(conn)
+        except pyodbc.Error as ex:
+            print(f"Error rebuilding inventory valuation: {ex}")
+            return jsonify({"error": "Failed to rebuild inventory valuation"}), 500
+    return jsonify(report), 200
+
+def runs_out_on(computed_at, days_of_supply):
+    if days_of_supply is None:
+        return None
+    return (computed_at + timedelta(days=float(days_of_supply))).date().isoformat()
+
+LOW_STOCK_PLAN = RowPlan('low_stock', [
+    Field("fuelTypeID", "FuelTypeID"),
+    Field("fuelTypeName", "FuelTypeID", fuel_type_name),
+    Field("locationType", "LocationType"),
+    Field("locationID", "LocationID"),
+    Field("locationName", ("LocationType", "LocationID"), inventory_location_name),
+    Field("currentStock", "CurrentStock", FLOAT, nullable=False),
+    Field("outflow7Days", "Outflow7Days", FLOAT, nullable=False),
+    Field("outflow30Days", "Outflow30Days", FLOAT, nullable=False),
+    Field("outflow90Days", "Outflow90Days", FLOAT, nullable=False),
+    Field("dailyOutflow", "DailyOutflow", FLOAT, nullable=False),
+    Field("daysOfSupply", "DaysOfSupply", FLOAT),
+    Field("runsOutOn", ("ComputedAt", "DaysOfSupply"), runs_out_on),
+    Field("reorderQuantity", "ReorderQuantity", FLOAT, nullable=False),
+    Field("asOfDate", "AsOfDate", ISOFORMAT, nullable=False),
+])
+
+@app.route('/api/fuelinventory/lowstock', methods=['GET'])
+def get_low_stock():
+    """Lists locations with at most `days` days of supply left, soonest to run dry first.
+
+    Served from the SupplyForecasts table as last computed by the refresher
+    (forecast.py); X-Forecasts-Computed-At and X-Forecasts-Age-Seconds tell
+    how old the oldest row is. Query parameters:
+    days (default FORECAST_LOW_STOCK_DAYS), fuelTypeID, locationType,
+    locationID, limit and cursor.
+    """
+    try:
+        limit = parse_limit(request.args)
+        days = parse_float(request.args, 'days')
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        location_type, location_id = parse_location_filter(request.args, ('Warehouse', 'Site'))
+        after = parse_cursor(request.args, (float, int, str, int))
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    conditions, params = ["DaysOfSupply <= ?"], [FORECAST_LOW_STOCK_DAYS if days is None else days]
+    if fuel_type_id is not None:
+        conditions.append("FuelTypeID = ?")
+        params.append(fuel_type_id)
+    if location_type is not None:
+        conditions.append("LocationType = ?")
+        params.append(location_type)
+    if location_id is not None:
+        conditions.append("LocationID = ?")
+        params.append(location_id)
+    if after is not None:
+        conditions.append(
+            "(DaysOfSupply > ? OR (DaysOfSupply = ? AND (FuelTypeID > ? OR (FuelTypeID = ? AND "
+            "(LocationType > ? OR (LocationType = ? AND LocationID > ?))))))"
+        )
+        params.extend([after[0], after[0], after[1], after[1], after[2], after[2], after[3]])
+    query = f"""
+        SELECT FuelTypeID, LocationType, LocationID, CurrentStock, Outflow7Days, Outflow30Days, Outflow90Days,
+               DailyOutflow, DaysOfSupply, ReorderQuantity, AsOfDate, ComputedAt
+        FROM SupplyForecasts
+        {where_clause(conditions)}
+        ORDER BY DaysOfSupply, FuelTypeID, LocationType, LocationID
+        OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
+    """
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(ComputedAt) AS OldestComputedAt FROM SupplyForecasts")
+            computed_at = cursor.fetchone().OldestComputedAt
+            rows, next_key = fetch_page(cursor, query, params, limit,
+                                        lambda row: [float(row.DaysOfSupply), row.FuelTypeID, row.LocationType,
+                                                     row.LocationID])
+            response = page_response(LOW_STOCK_PLAN.encode(cursor, rows), next_key)
+            if computed_at is not None:
+                computed_at = datetime.fromisoformat(str(computed_at)) # The stand-in returns text
+                response.headers['X-Forecasts-Computed-At'] = computed_at.isoformat()
+                age = datetime.now() - computed_at
+                response.headers['X-Forecasts-Age-Seconds'] = str(round(age.total_seconds()))
+            return response, 200
+        except pyodbc.Error as ex:
+            print(f"Error fetching low stock forecasts: {ex}")
+            return jsonify({"error": "Failed to fetch low stock forecasts"}), 500
+
+@app.route('/api/fuelinventory/lowstock/rebuild', methods=['POST'])
+def rebuild_low_stock():
+    """Recomputes every days-of-supply and reorder forecast."""
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            report = forecaster.rebuild(conn)
+        except pyodbc.Error as ex:
+            print(f"Error rebuilding supply forecasts: {ex}")
+            return jsonify({"error": "Failed to rebuild supply forecasts"}), 500
+    return jsonify(report), 200
+
+# Lean rows keyed by IDs: source/destination and fuel type names come from
+# locations.py, so the only join left is the price lookup by primary key.
+FUEL_TRANSACTIONS_QUERY = """
+    SELECT
+        ftrans.TransactionID,
+        ftrans.UsageTransitionID,
+        ftrans.TransactionType,
+        ftrans.SourceLocationType,
+        ftrans.SourceLocationID,
+        ftrans.DestinationLocationType,
+        ftrans.DestinationLocationID,
+        ftrans.FuelTypeID,
+        ftrans.Quantity,
+        ftrans.TransactionDate,
+        fp.Price AS FuelPricePerUnit,
+        ftrans.TransportationCost,
+        ftrans.LoadingUnloadingCost,
+        ftrans.OtherCost,
+        ftrans.TotalCost,
+        ftrans.Notes
+    FROM FuelTransactions ftrans
+    LEFT JOIN FuelPrices fp ON ftrans.FuelPriceID = fp.FuelPriceID
+"""
+
+def source_location_name(location_type, location_id):
+    return location_name(location_type, location_id) if location_type in LOCATION_LISTS else 'N/A'
+
+def destination_location_name(location_type, location_id):
+    return location_name(location_type, location_id) if location_type in ('Warehouse', 'Site') else 'N/A'
+
+FUEL_TRANSACTION_PLAN = RowPlan('fuel_transaction', [
+    Field("transactionID", "TransactionID"),
+    Field("usageTransitionID", "UsageTransitionID"),
+    Field("transactionType", "TransactionType"),
+    Field("sourceLocationType", "SourceLocationType"),
+    Field("sourceLocationName", ("SourceLocationType", "SourceLocationID"), source_location_name),
+    Field("destinationLocationType", "DestinationLocationType"),
+    Field("destinationLocationName", ("DestinationLocationType", "DestinationLocationID"), destination_location_name),
+    Field("fuelTypeName", "FuelTypeID", fuel_type_name),
+    Field("quantity", "Quantity", FLOAT, nullable=False),
+    Field("transactionDate", "TransactionDate", ISOFORMAT, nullable=False),
+    Field("fuelPricePerUnit", "FuelPricePerUnit", FLOAT),
+    Field("transportationCost", "TransportationCost", FLOAT, nullable=False),
+    Field("loadingUnloadingCost", "LoadingUnloadingCost", FLOAT, nullable=False),
+    Field("otherCost", "OtherCost", FLOAT, nullable=False),
+    Field("totalCost", "TotalCost", FLOAT),
+    Field("notes", "Notes"),
+])
 
 @app.route('/api/fueltransactions', methods=['GET'])
+@conditional_get('fuelTransactions', 'fuelTypes', 'suppliers', 'warehouses', 'sites')
 def get_fuel_transactions():
-    """Fetches all fuel transactions."""
-    conn = get_db_connection()
-    if conn is None:
+    """Fetches fuel transactions, newest first, one page at a time.
+
+    Pages follow (TransactionDate, TransactionID). Query parameters:
+    fuelTypeID, transactionType, locationType/locationID (matches either end
+    of the movement), from/to (TransactionDate range), limit and cursor;
+    streams like /api/pricefluctuations.
+    """
+    try:
+        limit = parse_limit(request.args)
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        transaction_type = request.args.get('transactionType') or None
+        location_type, location_id = parse_location_filter(request.args, ('Supplier', 'Warehouse', 'Site'))
+        start, end = parse_date_range(request.args)
+        after = parse_cursor(request.args, (datetime.fromisoformat, int))
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    conditions, params = [], []
+    if fuel_type_id is not None:
+        conditions.append("ftrans.FuelTypeID = ?")
+        params.append(fuel_type_id)
+    if transaction_type is not None:
+        conditions.append("ftrans.TransactionType = ?")
+        params.append(transaction_type)
+    if location_id is not None:
+        conditions.append(
+            "((ftrans.SourceLocationType = ? AND ftrans.SourceLocationID = ?) OR "
+            "(ftrans.DestinationLocationType = ? AND ftrans.DestinationLocationID = ?))"
+        )
+        params.extend([location_type, location_id, location_type, location_id])
+    elif location_type is not None:
+        conditions.append("(ftrans.SourceLocationType = ? OR ftrans.DestinationLocationType = ?)")
+        params.extend([location_type, location_type])
+    if start is not None:
+        conditions.append("ftrans.TransactionDate >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("ftrans.TransactionDate < ?")
+        params.append(end)
+    if after is not None:
+        conditions.append(
+            "(ftrans.TransactionDate < ? OR (ftrans.TransactionDate = ? AND ftrans.TransactionID < ?))"
+        )
+        params.extend([after[0], after[0], after[1]])
+
+    # Seeks IX_FuelTransactions_TransactionDate, or the FuelTypeID / Source /
+    # Destination indexes when those filters are given; joins only touch one page.
+    query = f"""{FUEL_TRANSACTIONS_QUERY}
+        {where_clause(conditions)}
+        ORDER BY ftrans.TransactionDate DESC, ftrans.TransactionID DESC
+    """
+
+    fmt = stream_format(request)
+    if fmt:
+        return stream_response(query, params, FUEL_TRANSACTION_PLAN, "fuel transactions", fmt)
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+        try:
+            rows, next_key = fetch_page(cursor, query + "OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY", params, limit,
+                                        lambda row: [row.TransactionDate, row.TransactionID])
+            return page_response(FUEL_TRANSACTION_PLAN.encode(cursor, rows), next_key), 200
+        except pyodbc.Error as ex:
+            print(f"Error fetching fuel transactions: {ex}")
+            return jsonify({"error": "Failed to fetch fuel transactions"}), 500
+
+# --- Change Feed Endpoints ---
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Returns what changed after a change cursor (see changes.py).
+
+    Query parameters: since (the `cursor` of the previous response; omit it
+    to get the current cursor and no rows) and limit (rows per change type,
+    at most CHANGES_LIMIT). Returns new transactions, the current rows of
+    inventory they moved, new price fluctuations and the fluctuation
+    rebuilds that replaced rows the client may hold (priceFluctuationRebuilds,
+    see changes.py), oldest first; while hasMore is true, call again with
+    the returned cursor.
+    """
+    try:
+        since = parse_since(request.args['since']) if request.args.get('since') else None
+        limit = min(parse_limit(request.args), CHANGES_LIMIT)
+    except QueryParamError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+        try:
+            if since is None:
+                return jsonify({"cursor": encode_cursor(list(current_cursor(cursor))), "hasMore": False,
+                                "transactions": [], "inventory": [], "priceFluctuations": [],
+                                "priceFluctuationRebuilds": []}), 200
+            transactions, more_transactions = fetch_page(
+                cursor, FUEL_TRANSACTIONS_QUERY + " WHERE ftrans.TransactionID > ? "
+                "ORDER BY ftrans.TransactionID OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY",
+                [since[0]], limit, lambda row: row.TransactionID
+            )
+            last_transaction_id = transactions[-1].TransactionID if transactions else since[0]
+            transactions = FUEL_TRANSACTION_PLAN.dicts(cursor, transactions)
+            inventory = []
+            for predicate, params in key_predicates(touched_keys(cursor, since[0], last_transaction_id), 'fi.'):
+                cursor.execute(f"{FUEL_INVENTORY_QUERY} WHERE {predicate}", *params)
+                inventory.extend(FUEL_INVENTORY_PLAN.dicts(cursor, cursor.fetchall()))
+            fluctuations, more_fluctuations = fetch_page(
+                cursor, PRICE_FLUCTUATIONS_QUERY + " WHERE pf.FluctuationID > ? "
+                "ORDER BY pf.FluctuationID OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY",
+                [since[1]], limit, lambda row: row.FluctuationID
+            )
+            last_fluctuation_id = fluctuations[-1].FluctuationID if fluctuations else since[1]
+            fluctuations = PRICE_FLUCTUATION_PLAN.dicts(cursor, fluctuations)
+            rebuilds, more_rebuilds = fetch_page(cursor, REBUILDS_SQL, [since[2]], limit,
+                                                 lambda row: row.RebuildID)
+            last_rebuild_id = rebuilds[-1].RebuildID if rebuilds else since[2]
+            rebuilds = [rebuild_notice(row) for row in rebuilds]
+        except pyodbc.Error as ex:
+            print(f"Error fetching changes: {ex}")
+            return jsonify({"error": "Failed to fetch changes"}), 500
+
+    return jsonify({
+        "cursor": encode_cursor([last_transaction_id, last_fluctuation_id, last_rebuild_id]),
+        "hasMore": any(more is not None for more in (more_transactions, more_fluctuations, more_rebuilds)),
+        "transactions": transactions,
+        "inventory": inventory,
+        "priceFluctuations": fluctuations,
+        "priceFluctuationRebuilds": rebuilds,
+    }), 200
+
+@app.route('/api/changes/stream', methods=['GET'])
+def stream_changes():
+    """Server-sent events with inventory balance changes as movements commit.
+
+    The first event ("hello") carries the cursor the stream starts from;
+    every "inventory" event's id is a change cursor for GET /api/changes. A
+    "resync" event means the client fell behind and should catch up there.
+    """
+    subscription = change_feed.subscribe()
+    if subscription is None:
+        return jsonify({"error": "Too many event stream clients"}), 503
+    # Subscribed first, so nothing committed after this cursor can be missed.
+    with db_connection() as conn:
+        try:
+            position = encode_cursor(list(current_cursor(conn.cursor()))) if conn is not None else None
+        except pyodbc.Error as ex:
+            print(f"Error reading change cursor: {ex}")
+            position = None
+    if position is None:
+        change_feed.unsubscribe(subscription)
         return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
+    return Response(event_stream(change_feed, subscription, format_event('hello', {"cursor": position}, position)),
+                    mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Report Endpoints ---
+
+@app.route('/api/reports/consumption', methods=['GET'])
+def get_consumption_report():
+    """Aggregates fuel movements into time buckets with quantities and costs.
+
+    Query parameters: period (day, week or month; default month), groupBy
+    (comma-separated fuelType, site, warehouse, township, transactionType;
+    default fuelType), from (required) / to (default today), fuelTypeID and
+    format (json, csv or parquet). Buckets always cover whole periods.
+    """
+    period = request.args.get('period', 'month')
+    fmt = request.args.get('format', 'json')
     try:
-        cursor.execute("""
-            SELECT
-                ftrans.TransactionID,
-                ftrans.UsageTransitionID,
-                ftrans.TransactionType,
-                ftrans.SourceLocationType,
-                CASE
-                    WHEN ftrans.SourceLocationType = 'Supplier' THEN s.SupplierName
-                    WHEN ftrans.SourceLocationType = 'Warehouse' THEN w_src.WarehouseName
-                    WHEN ftrans.SourceLocationType = 'Site' THEN site_src.SiteName
-                    ELSE 'N/A'
-                END AS SourceLocationName,
-                ftrans.DestinationLocationType,
-                CASE
-                    WHEN ftrans.DestinationLocationType = 'Warehouse' THEN w_dest.WarehouseName
-                    WHEN ftrans.DestinationLocationType = 'Site' THEN site_dest.SiteName
-                    ELSE 'N/A'
-                END AS DestinationLocationName,
-                ftype.FuelTypeName,
-                ftrans.Quantity,
-                ftrans.TransactionDate,
-                fp.Price AS FuelPricePerUnit,
-                ftrans.TransportationCost,
-                ftrans.LoadingUnloadingCost,
-                ftrans.OtherCost,
-                ftrans.TotalCost,
-                ftrans.Notes
-            FROM FuelTransactions ftrans
-            JOIN FuelTypes ftype ON ftrans.FuelTypeID = ftype.FuelTypeID
-            LEFT JOIN Suppliers s ON ftrans.SourceLocationType = 'Supplier' AND ftrans.SourceLocationID = s.SupplierID
-            LEFT JOIN Warehouses w_src ON ftrans.SourceLocationType = 'Warehouse' AND ftrans.SourceLocationID = w_src.WarehouseID
-            LEFT JOIN Sites site_src ON ftrans.SourceLocationType = 'Site' AND ftrans.SourceLocationID = site_src.SiteID
-            LEFT JOIN Warehouses w_dest ON ftrans.DestinationLocationType = 'Warehouse' AND ftrans.DestinationLocationID = w_dest.WarehouseID
-            LEFT JOIN Sites site_dest ON ftrans.DestinationLocationType = 'Site' AND ftrans.DestinationLocationID = site_dest.SiteID
-            LEFT JOIN FuelPrices fp ON ftrans.FuelPriceID = fp.FuelPriceID
-            ORDER BY ftrans.TransactionDate DESC
-        """)
-        transactions = []
-        for row in cursor.fetchall():
-            transactions.append({
-                "transactionID": row.TransactionID,
-                "usageTransitionID": row.UsageTransitionID,
-                "transactionType": row.TransactionType,
-                "sourceLocationType": row.SourceLocationType,
-                "sourceLocationName": row.SourceLocationName,
-                "destinationLocationType": row.DestinationLocationType,
-                "destinationLocationName": row.DestinationLocationName,
-                "fuelTypeName": row.FuelTypeName,
-                "quantity": float(row.Quantity),
-                "transactionDate": row.TransactionDate.isoformat(),
-                "fuelPricePerUnit": float(row.FuelPricePerUnit) if row.FuelPricePerUnit else None,
-                "transportationCost": float(row.TransportationCost),
-                "loadingUnloadingCost": float(row.LoadingUnloadingCost),
-                "otherCost": float(row.OtherCost),
-                "totalCost": float(row.TotalCost) if row.TotalCost else None,
-                "notes": row.Notes
-            })
-        return jsonify(transactions), 200
-    except pyodbc.Error as ex:
-        print(f"Error fetching fuel transactions: {ex}")
-        return jsonify({"error": "Failed to fetch fuel transactions"}), 500
-    finally:
-        conn.close()
+        dimensions = parse_group_by(request.args.get('groupBy'))
+        fuel_type_id = parse_int(request.args, 'fuelTypeID')
+        start, end = parse_date_range(request.args, dates_only=True)
+    except (QueryParamError, ReportError) as ex:
+        return jsonify({"error": str(ex)}), 400
+    if start is None:
+        return jsonify({"error": "from is required"}), 400
+    if fmt not in ('json', 'csv', 'parquet'):
+        return jsonify({"error": "format must be json, csv or parquet"}), 400
+    end = end or date.today() + timedelta(days=1)
+
+    with db_connection() as conn:
+        if conn is None:
+            return jsonify({"error": "Database connection failed"}), 500
+        try:
+            report = label_report(consumption_report(conn, period, dimensions, start, end, fuel_type_id), dimensions)
+        except ReportError as ex:
+            return jsonify({"error": str(ex)}), 400
+        except pyodbc.Error as ex:
+            print(f"Error building consumption report: {ex}")
+            return jsonify({"error": "Failed to build consumption report"}), 500
 
+    filename = f"consumption-{period}-{start.isoformat()}"
+    if fmt == 'csv':
+        return Response(report_csv(report), status=200, mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'})
+    if fmt == 'parquet':
+        try:
+            payload = report_parquet(report)
+        except ImportError:
+            return jsonify({"error": "Parquet export is not available (pyarrow is not installed)"}), 501
+        return Response(payload, status=200, mimetype='application/vnd.apache.parquet',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}.parquet"'})
+    return jsonify({"period": period, "groupBy": list(dimensions), "rows": report_records(report)}), 200
 
 # --- Main execution block ---
 if __name__ == '__main__':
     # To run this Flask app:
-    # 1. Make sure you have Flask and pyodbc installed:
-    #    pip install Flask pyodbc
+    # 1. Install the dependencies (Flask, flask-cors, pyodbc, numpy and pandas; pyarrow
+    #    is optional and only needed for Parquet report exports):
+    #    pip install -r requirements.txt
     # 2. Set environment variables for DB_SERVER, DB_NAME, DB_UID, DB_PWD
-    #    (or hardcode them in DB_CONFIG for local testing, but not for production)
+    #    (or hardcode them in DB_CONFIG in db.py for local testing, but not for production)
+    #    Pool sizing can be tuned with DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+    #    DB_POOL_RECYCLE, DB_POOL_PING_AFTER and DB_POOL_IDLE_TIMEOUT; MASTER_DATA_TTL sets
+    #    how long master data stays cached (POST /api/cache/invalidate drops it early).
     # 3. Run from your terminal: python app.py
     # This will run on http://127.0.0.1:5000/ by default
-    app.run(debug=True) # debug=True for development, turn off for production
+    debug = True # For development, turn off for production
+    # With the reloader (debug) this block also runs in the parent process that only
+    # watches files; background workers start in the process that serves requests.
+    if not debug or is_running_from_reloader():
+        # Inventory snapshots are taken every SNAPSHOT_INTERVAL_HOURS (0 disables; see snapshots.py).
+        start_scheduler(db_connection)
+        # Supply forecasts are refreshed every FORECAST_REFRESH_SECONDS (see forecast.py).
+        start_refresher(db_connection)
+        # Transactions accepted with 202 (see journal.py) are written by a background worker;
+        # starting it here also replays anything left in INGEST_JOURNAL by the previous run.
+        ingest_journal.start()
+    app.run(debug=debug)
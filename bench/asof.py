@@ -0,0 +1,100 @@
+# Point-in-Time Inventory Benchmark (bench/asof.py)
+#
+# Compares as-of inventory queries answered by a full ledger replay with
+# queries answered from the nearest inventory snapshot plus the ledger since
+# then. As-of times are sampled from each quarter of the ledger's history:
+# full replay gets slower the later the as-of time, while the snapshot path
+# reads at most one snapshot interval of ledger rows wherever it lands.
+#
+# Usage:
+#   python -m bench.asof --db fuel_bench.db --interval-hours 168 --queries 40
+
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+from datetime import timedelta
+
+from bench import seed, standin
+from snapshots import backfill, inventory_as_of, ledger_deltas
+
+
+def _history(cursor):
+    cursor.execute("SELECT TOP 1 TransactionDate FROM FuelTransactions ORDER BY TransactionDate")
+    first = cursor.fetchval()
+    cursor.execute("SELECT TOP 1 TransactionDate FROM FuelTransactions ORDER BY TransactionDate DESC")
+    return first, cursor.fetchval()
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def run_benchmark(path, interval, queries, seed_value=5):
+    connection = standin.connect(path)
+    try:
+        cursor = connection.cursor()
+        first, last = _history(cursor)
+        cursor.execute("DELETE FROM InventorySnapshots")
+        elapsed, written = _timed(backfill, connection, first.date(), interval)
+        report = {"interval": str(interval), "history": f"{first.date()} .. {last.date()}",
+                  "snapshots": written["snapshots"], "snapshotRows": written["rows"],
+                  "backfillSeconds": round(elapsed, 2), "quarters": []}
+
+        rng = random.Random(seed_value)
+        span = (last - first).total_seconds()
+        for quarter in range(4):
+            replay_ms, snapshot_ms, replay_entries, snapshot_entries = [], [], [], []
+            for _ in range(queries):
+                as_of = first + timedelta(seconds=span * (quarter + rng.random()) / 4)
+                seconds, (_, entries) = _timed(ledger_deltas, cursor, None, as_of)
+                replay_ms.append(seconds * 1000)
+                replay_entries.append(entries)
+                seconds, (_, _, entries) = _timed(inventory_as_of, cursor, as_of)
+                snapshot_ms.append(seconds * 1000)
+                snapshot_entries.append(entries)
+            report["quarters"].append({
+                "quarter": quarter + 1,
+                "fullReplayMs": round(sum(replay_ms) / queries, 2),
+                "fullReplayEntries": round(sum(replay_entries) / queries),
+                "snapshotMs": round(sum(snapshot_ms) / queries, 2),
+                "snapshotEntries": round(sum(snapshot_entries) / queries),
+                "snapshotMaxEntries": max(snapshot_entries),
+            })
+        return report
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="As-of inventory: full replay vs snapshots.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file")
+    parser.add_argument('--scale', choices=sorted(seed.SCALES), default='small',
+                        help="Seed scale if the database does not exist yet")
+    parser.add_argument('--interval-hours', type=float, nargs='+', default=[168.0],
+                        help="Snapshot intervals to compare")
+    parser.add_argument('--queries', type=int, default=40, help="As-of queries per history quarter")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Seeding {args.db} at scale {args.scale}...")
+        seed.seed_database(args.db, *seed.SCALES[args.scale])
+
+    # Work on a copy so the benchmark's snapshots do not end up in the source database.
+    scratch = args.db + '.asof'
+    shutil.copyfile(args.db, scratch)
+    try:
+        for hours in args.interval_hours:
+            report = run_benchmark(scratch, timedelta(hours=hours), args.queries)
+            print(json.dumps(report, indent=2))
+    finally:
+        os.remove(scratch)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
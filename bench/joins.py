@@ -0,0 +1,149 @@
+# List Query Join Benchmark (bench/joins.py)
+#
+# Compares the transaction and inventory list queries as they used to be,
+# joining FuelTypes, Suppliers, Warehouses and Sites on the polymorphic
+# location columns, with the lean queries in app.py that select IDs and
+# resolve names from the in-memory lookups in locations.py. Both paths
+# fetch the same number of rows and build the same response dictionaries.
+#
+# Usage:
+#   python -m bench.joins --db fuel_bench.db --rows 5000 50000 --repeat 5
+
+import argparse
+import json
+import os
+import time
+
+import db
+from bench import seed, standin
+
+# The list queries before names were resolved in memory
+JOINED_INVENTORY_QUERY = """
+    SELECT fi.InventoryID, fi.FuelTypeID, ft.FuelTypeName, fi.LocationType, fi.LocationID,
+           CASE
+               WHEN fi.LocationType = 'Warehouse' THEN w.WarehouseName
+               WHEN fi.LocationType = 'Site' THEN s.SiteName
+               ELSE 'Unknown'
+           END AS LocationName,
+           fi.CurrentStock, fi.LastUpdated
+    FROM FuelInventory fi
+    JOIN FuelTypes ft ON fi.FuelTypeID = ft.FuelTypeID
+    LEFT JOIN Warehouses w ON fi.LocationType = 'Warehouse' AND fi.LocationID = w.WarehouseID
+    LEFT JOIN Sites s ON fi.LocationType = 'Site' AND fi.LocationID = s.SiteID
+"""
+
+JOINED_TRANSACTIONS_QUERY = """
+    SELECT
+        ftrans.TransactionID, ftrans.UsageTransitionID, ftrans.TransactionType, ftrans.SourceLocationType,
+        CASE
+            WHEN ftrans.SourceLocationType = 'Supplier' THEN s.SupplierName
+            WHEN ftrans.SourceLocationType = 'Warehouse' THEN w_src.WarehouseName
+            WHEN ftrans.SourceLocationType = 'Site' THEN site_src.SiteName
+            ELSE 'N/A'
+        END AS SourceLocationName,
+        ftrans.DestinationLocationType,
+        CASE
+            WHEN ftrans.DestinationLocationType = 'Warehouse' THEN w_dest.WarehouseName
+            WHEN ftrans.DestinationLocationType = 'Site' THEN site_dest.SiteName
+            ELSE 'N/A'
+        END AS DestinationLocationName,
+        ftype.FuelTypeName, ftrans.Quantity, ftrans.TransactionDate, fp.Price AS FuelPricePerUnit,
+        ftrans.TransportationCost, ftrans.LoadingUnloadingCost, ftrans.OtherCost, ftrans.TotalCost, ftrans.Notes
+    FROM FuelTransactions ftrans
+    JOIN FuelTypes ftype ON ftrans.FuelTypeID = ftype.FuelTypeID
+    LEFT JOIN Suppliers s ON ftrans.SourceLocationType = 'Supplier' AND ftrans.SourceLocationID = s.SupplierID
+    LEFT JOIN Warehouses w_src ON ftrans.SourceLocationType = 'Warehouse' AND ftrans.SourceLocationID = w_src.WarehouseID
+    LEFT JOIN Sites site_src ON ftrans.SourceLocationType = 'Site' AND ftrans.SourceLocationID = site_src.SiteID
+    LEFT JOIN Warehouses w_dest ON ftrans.DestinationLocationType = 'Warehouse' AND ftrans.DestinationLocationID = w_dest.WarehouseID
+    LEFT JOIN Sites site_dest ON ftrans.DestinationLocationType = 'Site' AND ftrans.DestinationLocationID = site_dest.SiteID
+    LEFT JOIN FuelPrices fp ON ftrans.FuelPriceID = fp.FuelPriceID
+"""
+
+
+def _joined_inventory_to_dict(row):
+    return {"inventoryID": row.InventoryID, "fuelTypeID": row.FuelTypeID, "fuelTypeName": row.FuelTypeName,
+            "locationType": row.LocationType, "locationID": row.LocationID, "locationName": row.LocationName,
+            "currentStock": float(row.CurrentStock), "lastUpdated": row.LastUpdated.isoformat()}
+
+
+def _joined_transaction_to_dict(row):
+    return {
+        "transactionID": row.TransactionID, "usageTransitionID": row.UsageTransitionID,
+        "transactionType": row.TransactionType, "sourceLocationType": row.SourceLocationType,
+        "sourceLocationName": row.SourceLocationName, "destinationLocationType": row.DestinationLocationType,
+        "destinationLocationName": row.DestinationLocationName, "fuelTypeName": row.FuelTypeName,
+        "quantity": float(row.Quantity), "transactionDate": row.TransactionDate.isoformat(),
+        "fuelPricePerUnit": float(row.FuelPricePerUnit) if row.FuelPricePerUnit is not None else None,
+        "transportationCost": float(row.TransportationCost), "loadingUnloadingCost": float(row.LoadingUnloadingCost),
+        "otherCost": float(row.OtherCost), "totalCost": float(row.TotalCost) if row.TotalCost is not None else None,
+        "notes": row.Notes,
+    }
+
+
+def _timed_list(cursor, sql, order_by, rows, to_dicts, repeat):
+    """Best-of-`repeat` seconds to fetch `rows` rows and build their dictionaries."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(f"SELECT TOP {rows} * FROM ({sql}) listed ORDER BY {order_by}")
+        items = to_dicts(cursor, cursor.fetchall())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(items)
+
+
+def run_benchmark(path, row_counts, repeat):
+    db.configure_pool(standin.connection_factory(path), min_size=1, max_size=2)
+    import app # Imported after the pool points at the stand-in
+
+    lists = [
+        ('fuelTransactions', JOINED_TRANSACTIONS_QUERY, _joined_transaction_to_dict,
+         app.FUEL_TRANSACTIONS_QUERY, app.FUEL_TRANSACTION_PLAN, 'TransactionID DESC'),
+        ('fuelInventory', JOINED_INVENTORY_QUERY, _joined_inventory_to_dict,
+         app.FUEL_INVENTORY_QUERY, app.FUEL_INVENTORY_PLAN, 'InventoryID'),
+    ]
+    connection = standin.connect(path)
+    try:
+        cursor = connection.cursor()
+        # Warm the lookups once, as a running server would have them
+        app.fuel_type_name(1)
+        app.location_name('Site', 1)
+        report = []
+        for name, joined_sql, joined_to_dict, lean_sql, lean_plan, order_by in lists:
+            for rows in row_counts:
+                joined_seconds, fetched = _timed_list(cursor, joined_sql, order_by, rows,
+                                                      lambda _, fetched: [joined_to_dict(row) for row in fetched], repeat)
+                lean_seconds, _ = _timed_list(cursor, lean_sql, order_by, rows, lean_plan.dicts, repeat)
+                report.append({
+                    "list": name,
+                    "rows": fetched,
+                    "joinedMs": round(joined_seconds * 1000, 1),
+                    "leanMs": round(lean_seconds * 1000, 1),
+                    "joinedRowsPerSecond": round(fetched / joined_seconds),
+                    "leanRowsPerSecond": round(fetched / lean_seconds),
+                    "speedup": round(joined_seconds / lean_seconds, 2),
+                })
+        return report
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List queries: SQL joins vs in-memory name resolution.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file")
+    parser.add_argument('--scale', choices=sorted(seed.SCALES), default='small',
+                        help="Seed scale if the database does not exist yet")
+    parser.add_argument('--rows', type=int, nargs='+', default=[5000, 50000], help="Rows fetched per query")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per query; the best is reported")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Seeding {args.db} at scale {args.scale}...")
+        seed.seed_database(args.db, *seed.SCALES[args.scale])
+
+    print(json.dumps(run_benchmark(args.db, args.rows, args.repeat), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
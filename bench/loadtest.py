@@ -0,0 +1,267 @@
+# Endpoint Benchmark / Load Test (bench/loadtest.py)
+#
+# Drives every API route against the SQLite stand-in at fixed concurrency
+# levels and reports p50/p95/p99 latency and throughput. Results can be
+# saved as a baseline and later runs compared against it, failing (exit
+# code 1) when a route's p95 regresses beyond the allowed tolerance.
+#
+# Usage:
+#   python -m bench.loadtest --db fuel_bench.db --seed-scale small --save baseline.json
+#   python -m bench.loadtest --db fuel_bench.db --compare baseline.json --tolerance 0.25
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import db
+from bench import seed, standin
+
+DEFAULT_CONCURRENCY = (1, 4, 16)
+
+
+class _Payloads:
+    """Generates request bodies that will not collide with seeded data."""
+
+    def __init__(self, fuel_type_ids, supplier_ids, warehouse_ids, site_ids):
+        self._fuel_type_ids = fuel_type_ids
+        self._supplier_ids = supplier_ids
+        self._warehouse_ids = warehouse_ids
+        self._site_ids = site_ids
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._rng = random.Random(7)
+
+    def _next(self):
+        with self._lock:
+            return next(self._counter), self._rng.random()
+
+    def fuel_price(self):
+        n, r = self._next()
+        # Far-future, per-request dates keep the unique price constraint satisfied.
+        effective = date(2100, 1, 1) + timedelta(days=n)
+        return {
+            "fuelTypeID": self._fuel_type_ids[n % len(self._fuel_type_ids)],
+            "price": round(1000 + 500 * r, 2),
+            "effectiveDate": effective.isoformat(),
+            "siteID": self._site_ids[n % len(self._site_ids)],
+        }
+
+    def fuel_transaction(self):
+        n, r = self._next()
+        return {
+            "transactionType": "Replenishment Process 1",
+            "sourceLocationType": "Supplier",
+            "sourceLocationID": self._supplier_ids[n % len(self._supplier_ids)],
+            "destinationLocationType": "Warehouse",
+            "destinationLocationID": self._warehouse_ids[int(r * len(self._warehouse_ids))],
+            "fuelTypeID": self._fuel_type_ids[n % len(self._fuel_type_ids)],
+            "quantity": 100 + n % 900,
+            "transactionDate": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            "transportationCost": 25,
+        }
+
+    def fuel_transaction_batch(self, size=100):
+        return [self.fuel_transaction() for _ in range(size)]
+
+
+def _ids(path, table, column):
+    connection = standin.connect(path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT {column} FROM {table} ORDER BY {column}")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def build_routes(path):
+    """Returns {name: (method, path, body_factory)} for every benchmarked route."""
+    payloads = _Payloads(
+        _ids(path, 'FuelTypes', 'FuelTypeID'),
+        _ids(path, 'Suppliers', 'SupplierID'),
+        _ids(path, 'Warehouses', 'WarehouseID'),
+        _ids(path, 'Sites', 'SiteID'),
+    )
+    return {
+        'GET /api/fueltypes': ('GET', '/api/fueltypes', None),
+        'GET /api/suppliers': ('GET', '/api/suppliers', None),
+        'GET /api/townships': ('GET', '/api/townships', None),
+        'GET /api/sites': ('GET', '/api/sites', None),
+        'GET /api/warehouses': ('GET', '/api/warehouses', None),
+        'GET /api/fuelinventory': ('GET', '/api/fuelinventory', None),
+        'GET /api/fueltransactions': ('GET', '/api/fueltransactions', None),
+        'GET /api/pricefluctuations': ('GET', '/api/pricefluctuations', None),
+        'POST /api/fuelprices': ('POST', '/api/fuelprices', payloads.fuel_price),
+        'POST /api/fueltransactions': ('POST', '/api/fueltransactions', payloads.fuel_transaction),
+        'POST /api/fueltransactions/batch': ('POST', '/api/fueltransactions/batch', payloads.fuel_transaction_batch),
+    }
+
+
+def _request(base_url, method, path, body_factory):
+    data = None
+    headers = {}
+    if body_factory is not None:
+        data = json.dumps(body_factory()).encode()
+        headers['Content-Type'] = 'application/json'
+    req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as ex:
+        ex.read()
+        status = ex.code
+    return time.perf_counter() - started, status
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def run_level(base_url, method, path, body_factory, concurrency, requests):
+    """Runs `requests` calls with `concurrency` workers; returns a result dict."""
+    def worker(_):
+        return _request(base_url, method, path, body_factory)
+
+    # Warm-up so connection setup and first-hit compilation are not measured.
+    for _ in range(min(2, requests)):
+        worker(None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "p50Ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95Ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99Ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "throughput": round(requests / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass # Per-request access logging would dominate the measurements
+
+
+class _ServerThread(threading.Thread):
+    def __init__(self, app):
+        super().__init__(daemon=True)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietRequestHandler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def run_benchmark(path, routes, selected, concurrency_levels, requests, pool_size):
+    """Benchmarks the `selected` routes against the stand-in at `path`; returns result rows."""
+    db.configure_pool(standin.connection_factory(path), min_size=1, max_size=pool_size)
+    from app import app # Imported after the pool points at the stand-in
+
+    server = _ServerThread(app)
+    server.start()
+    rows = []
+    try:
+        for name in selected:
+            method, route_path, body_factory = routes[name]
+            for concurrency in concurrency_levels:
+                result = run_level(server.base_url, method, route_path, body_factory, concurrency, requests)
+                result["route"] = name
+                rows.append(result)
+                print(f"{name:<32} c={concurrency:<3} n={result['requests']:<5} err={result['errors']:<4} "
+                      f"p50={result['p50Ms']:>9.2f}ms p95={result['p95Ms']:>9.2f}ms "
+                      f"p99={result['p99Ms']:>9.2f}ms {result['throughput']:>9.2f} req/s", flush=True)
+    finally:
+        server.stop()
+    return rows
+
+
+def compare(rows, baseline_rows, tolerance):
+    """Returns descriptions of (route, concurrency) pairs whose p95 regressed."""
+    baseline = {(row["route"], row["concurrency"]): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        reference = baseline.get((row["route"], row["concurrency"]))
+        if not reference or not reference["p95Ms"]:
+            continue
+        limit = reference["p95Ms"] * (1 + tolerance)
+        if row["p95Ms"] > limit:
+            regressions.append(f"{row['route']} c={row['concurrency']}: p95 {row['p95Ms']}ms "
+                               f"> {limit:.2f}ms (baseline {reference['p95Ms']}ms)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark API routes against the SQLite stand-in.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file")
+    parser.add_argument('--seed-scale', choices=sorted(seed.SCALES),
+                        help="(Re)seed the database at this scale before running")
+    parser.add_argument('--concurrency', default=','.join(map(str, DEFAULT_CONCURRENCY)),
+                        help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per route and level")
+    parser.add_argument('--routes', help="Comma-separated route names (default: all)")
+    parser.add_argument('--save', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare p95 latencies against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed p95 regression as a fraction of the baseline")
+    args = parser.parse_args(argv)
+
+    if args.seed_scale or not os.path.exists(args.db):
+        volumes = seed.SCALES[args.seed_scale or 'small']
+        print(f"Seeding {args.db} at scale {args.seed_scale or 'small'}...")
+        seed.seed_database(args.db, *volumes)
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(',') if level]
+    routes = build_routes(args.db)
+    selected = [name.strip() for name in args.routes.split(',')] if args.routes else list(routes)
+    unknown = [name for name in selected if name not in routes]
+    if unknown:
+        parser.error(f"Unknown routes: {', '.join(unknown)} (choose from: {', '.join(routes)})")
+
+    rows = run_benchmark(args.db, routes, selected, concurrency_levels, args.requests, max(concurrency_levels))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as handle:
+            json.dump({"database": os.path.abspath(args.db), "results": rows}, handle, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            regressions = compare(rows, json.load(handle)["results"], args.tolerance)
+        if regressions:
+            print("Latency regressions detected:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No p95 regressions beyond tolerance.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,255 @@
+# Stand-in Data Generator (bench/seed.py)
+#
+# Seeds a stand-in database with realistic volumes: thousands of sites and
+# warehouses, and up to millions of FuelPrices / FuelTransactions rows.
+# Inventory balances are derived from the generated ledger, so FuelInventory
+# always equals the net of all transaction debits and credits; average unit
+# costs are then rebuilt from the same ledger (valuation.py).
+#
+# Usage:
+#   python -m bench.seed --db fuel_bench.db --scale medium
+#   python -m bench.seed --db fuel_bench.db --transactions 2000000 --prices 1000000
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import valuation
+from bench import standin
+
+SCALES = {
+    # name: (townships, suppliers, sites, warehouses, prices, transactions)
+    'small': (50, 10, 300, 200, 20000, 50000),
+    'medium': (300, 40, 3000, 2000, 200000, 500000),
+    'large': (500, 80, 5000, 4000, 1000000, 3000000),
+}
+
+FUEL_TYPES = [
+    ('Diesel', 'Standard Diesel Fuel', 1200.0),
+    ('Petrol', 'Unleaded Petrol', 1500.0),
+    ('Octane 95', 'Premium Petrol', 1650.0),
+    ('Kerosene', 'Heating and Lamp Kerosene', 1100.0),
+]
+
+STATE_DIVISIONS = ['Yangon Region', 'Mandalay Region', 'Sagaing Region', 'Kachin State',
+                   'Shan State', 'Bago Region', 'Magway Region', 'Ayeyarwady Region']
+
+START_DATE = date(2019, 1, 1)
+BATCH_SIZE = 50000
+
+
+def _insert_many(raw, sql, rows):
+    for offset in range(0, len(rows), BATCH_SIZE):
+        raw.executemany(sql, rows[offset:offset + BATCH_SIZE])
+
+
+def seed_master_data(raw, rng, townships, suppliers, sites, warehouses):
+    """Inserts fuel types, townships, suppliers, sites and warehouses."""
+    raw.executemany("INSERT INTO FuelTypes (FuelTypeName, Description) VALUES (?, ?)",
+                    [(name, description) for name, description, _ in FUEL_TYPES])
+    raw.executemany(
+        "INSERT INTO Townships (TownshipName, PostalCode, StateDivision) VALUES (?, ?, ?)",
+        [(f"Township {i:04d}", f"{10000 + i:05d}", rng.choice(STATE_DIVISIONS))
+         for i in range(1, townships + 1)])
+    raw.executemany(
+        "INSERT INTO Suppliers (SupplierName, ContactPerson, City, Country) VALUES (?, ?, ?, ?)",
+        [(f"Supplier {i:03d}", f"Contact {i:03d}", f"City {rng.randint(1, 40)}", 'Myanmar')
+         for i in range(1, suppliers + 1)])
+    raw.executemany(
+        "INSERT INTO Sites (SiteName, TownshipID, LocationDetails, Latitude, Longitude) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(f"Site {i:05d}", rng.randint(1, townships), None,
+          round(rng.uniform(10.0, 28.0), 6), round(rng.uniform(92.0, 101.0), 6))
+         for i in range(1, sites + 1)])
+    rows = []
+    for i in range(1, warehouses + 1):
+        warehouse_type = ('WH1', 'WH2', 'WH3', 'WH4')[i % 4]
+        site_id = rng.randint(1, sites) if warehouse_type == 'WH4' else None
+        rows.append((f"Warehouse {i:05d}", warehouse_type, f"{warehouse_type}-{i:06d}",
+                     rng.randint(1, townships), site_id,
+                     f"SubOffice {rng.randint(1, 50)}" if warehouse_type != 'WH1' else None))
+    raw.executemany(
+        "INSERT INTO Warehouses (WarehouseName, WarehouseType, GeneratedIDCode, TownshipID, SiteID, SubOffice) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def seed_prices(raw, rng, prices, townships, suppliers, sites):
+    """Inserts FuelPrices plus the matching PriceFluctuations history.
+
+    Returns {fuel_type_id: [(effective_date, fuel_price_id, price), ...]}.
+    """
+    contexts = ([(s, None, None) for s in range(1, suppliers + 1)]
+                + [(None, t, None) for t in range(1, townships + 1)]
+                + [(None, None, s) for s in range(1, sites + 1)])
+    per_fuel = max(1, prices // len(FUEL_TYPES))
+    per_context = max(1, per_fuel // len(contexts))
+    max_step = max(1, 2 * (date.today() - START_DATE).days // per_context)
+    price_rows = []
+    for fuel_type_id, (_, _, base) in enumerate(FUEL_TYPES, start=1):
+        produced = 0
+        for supplier_id, township_id, site_id in contexts:
+            if produced >= per_fuel:
+                break
+            day = rng.randint(0, 3)
+            level = base * rng.uniform(0.9, 1.1)
+            for _ in range(per_context):
+                level = max(100.0, level * rng.uniform(0.97, 1.03))
+                price_rows.append((fuel_type_id, round(level, 2), START_DATE + timedelta(days=day),
+                                   supplier_id, township_id, site_id))
+                day += rng.randint(1, max_step)
+                produced += 1
+    _insert_many(raw, "INSERT INTO FuelPrices (FuelTypeID, Price, EffectiveDate, SupplierID, TownshipID, SiteID) "
+                      "VALUES (?, ?, ?, ?, ?, ?)", price_rows)
+
+    by_fuel = {}
+    for fuel_price_id, (fuel_type_id, price, effective_date, *_rest) in enumerate(price_rows, start=1):
+        by_fuel.setdefault(fuel_type_id, []).append((effective_date, fuel_price_id, price))
+
+    # Fluctuations: previous price is the latest price of the same fuel type on an earlier date.
+    fluctuation_rows = []
+    for fuel_type_id, history in by_fuel.items():
+        history.sort()
+        previous = None
+        day_close = None
+        current_day = None
+        for effective_date, _, price in history:
+            if effective_date != current_day:
+                previous, current_day = day_close, effective_date
+            day_close = price
+            if previous is None:
+                fluctuation_rows.append((fuel_type_id, effective_date, price, None, None, '-'))
+            else:
+                amount = round(price - previous, 4)
+                kind = 'Increase' if amount > 0 else 'Decrease' if amount < 0 else 'No Change'
+                fluctuation_rows.append((fuel_type_id, effective_date, price, previous, amount, kind))
+    fluctuation_rows.sort(key=lambda row: row[1])
+    _insert_many(raw, "INSERT INTO PriceFluctuations (FuelTypeID, FluctuationDate, CurrentPrice, PreviousPrice, "
+                      "FluctuationAmount, FluctuationType) VALUES (?, ?, ?, ?, ?, ?)", fluctuation_rows)
+    return by_fuel
+
+
+def seed_transactions(raw, rng, transactions, suppliers, sites, warehouses, prices_by_fuel):
+    """Inserts a chronologically ordered ledger and the FuelInventory it implies."""
+    balances = {}
+    fuel_type_ids = list(prices_by_fuel)
+    span_seconds = (date.today() - START_DATE).days * 86400
+    step = span_seconds / max(transactions, 1)
+    start = datetime.combine(START_DATE, datetime.min.time())
+    rows = []
+    sql = ("INSERT INTO FuelTransactions (UsageTransitionID, TransactionType, SourceLocationType, SourceLocationID, "
+           "DestinationLocationType, DestinationLocationID, FuelTypeID, Quantity, TransactionDate, FuelPriceID, "
+           "TransportationCost, LoadingUnloadingCost, OtherCost, TotalCost, Notes) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    for n in range(transactions):
+        fuel_type_id = rng.choice(fuel_type_ids)
+        when = start + timedelta(seconds=int(n * step))
+        roll = rng.random()
+        source = None
+        if roll < 0.55:
+            # Warehouse -> Site / Warehouse transfer, only if the source has stock
+            source = ('Warehouse', rng.randint(1, warehouses))
+            available = balances.get((fuel_type_id,) + source, 0.0)
+            if available < 50:
+                source = None
+        if source is None:
+            transaction_type = 'Replenishment Process 1'
+            source = ('Supplier', rng.randint(1, suppliers))
+            destination = ('Warehouse', rng.randint(1, warehouses))
+            quantity = float(rng.randint(500, 20000))
+        else:
+            if rng.random() < 0.8:
+                transaction_type = 'Fuel Transfer Process'
+                destination = ('Site', rng.randint(1, sites))
+            else:
+                transaction_type = 'Replenishment Process 2'
+                destination = ('Warehouse', rng.randint(1, warehouses))
+            quantity = float(min(available, rng.randint(20, 2000)))
+            balances[(fuel_type_id,) + source] = available - quantity
+        key = (fuel_type_id,) + destination
+        balances[key] = balances.get(key, 0.0) + quantity
+
+        history = prices_by_fuel[fuel_type_id]
+        _, fuel_price_id, unit_price = history[rng.randrange(len(history))]
+        transport = float(rng.choice((0, 0, 50, 150, 300)))
+        loading = float(rng.choice((0, 0, 20, 40)))
+        other = 0.0
+        total = round(quantity * unit_price + transport + loading + other, 2)
+        rows.append((f"TRANS-{n + 1:09d}", transaction_type, source[0], source[1], destination[0], destination[1],
+                     fuel_type_id, quantity, when, fuel_price_id, transport, loading, other, total, None))
+        if len(rows) >= BATCH_SIZE:
+            raw.executemany(sql, rows)
+            rows = []
+    if rows:
+        raw.executemany(sql, rows)
+
+    _insert_many(raw, "INSERT INTO FuelInventory (FuelTypeID, LocationType, LocationID, CurrentStock) "
+                      "VALUES (?, ?, ?, ?)",
+                 [(fuel_type_id, location_type, location_id, round(stock, 2))
+                  for (fuel_type_id, location_type, location_id), stock in balances.items()
+                  if location_type != 'Supplier'])
+
+
+def seed_database(path, townships, suppliers, sites, warehouses, prices, transactions, seed=42):
+    """Creates a fresh stand-in database at `path` and fills it."""
+    rng = random.Random(seed)
+    standin.create_database(path)
+    raw = sqlite3.connect(path)
+    try:
+        raw.execute('PRAGMA synchronous=OFF')
+        raw.execute('BEGIN')
+        started = time.perf_counter()
+        seed_master_data(raw, rng, townships, suppliers, sites, warehouses)
+        prices_by_fuel = seed_prices(raw, rng, prices, townships, suppliers, sites)
+        print(f"  master data + {sum(len(h) for h in prices_by_fuel.values()):,} prices "
+              f"in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        seed_transactions(raw, rng, transactions, suppliers, sites, warehouses, prices_by_fuel)
+        print(f"  {transactions:,} transactions in {time.perf_counter() - started:.1f}s")
+        raw.execute('COMMIT')
+        raw.execute('ANALYZE')
+    finally:
+        raw.close()
+
+    started = time.perf_counter()
+    connection = standin.connect(path)
+    try:
+        valuation.rebuild(connection)
+    finally:
+        connection.close()
+    print(f"  average unit costs in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed a SQLite stand-in database for benchmarks.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file to (re)create")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--townships', type=int)
+    parser.add_argument('--suppliers', type=int)
+    parser.add_argument('--sites', type=int)
+    parser.add_argument('--warehouses', type=int)
+    parser.add_argument('--prices', type=int)
+    parser.add_argument('--transactions', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    townships, suppliers, sites, warehouses, prices, transactions = SCALES[args.scale]
+    volumes = dict(
+        townships=args.townships or townships,
+        suppliers=args.suppliers or suppliers,
+        sites=args.sites or sites,
+        warehouses=args.warehouses or warehouses,
+        prices=args.prices or prices,
+        transactions=args.transactions or transactions,
+    )
+    print(f"Seeding {os.path.abspath(args.db)}: " + ", ".join(f"{k}={v:,}" for k, v in volumes.items()))
+    started = time.perf_counter()
+    seed_database(args.db, seed=args.seed, **volumes)
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
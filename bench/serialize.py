@@ -0,0 +1,145 @@
+# Row Serialization Microbenchmark (bench/serialize.py)
+#
+# Times turning one page of fetched rows into a JSON response body for the
+# transaction, inventory and price fluctuation lists: the per-row dict
+# functions the handlers used before (attribute access by column name,
+# then jsonify through Flask's JSON provider) against the compiled RowPlans
+# in app.py, encoded with the json module and, if installed, with orjson.
+# Rows are fetched once up front, so only serialization is measured.
+#
+# Usage:
+#   python -m bench.serialize --db fuel_bench.db --rows 500 5000 --repeat 5
+
+import argparse
+import json
+import os
+import time
+
+import db
+import serialize
+from bench import seed, standin
+
+
+def _handler_dicts(app):
+    """The handlers' per-row functions before RowPlans (0 -> null bugs included)."""
+    def fuel_transaction_to_dict(row):
+        return {
+            "transactionID": row.TransactionID,
+            "usageTransitionID": row.UsageTransitionID,
+            "transactionType": row.TransactionType,
+            "sourceLocationType": row.SourceLocationType,
+            "sourceLocationName": app.source_location_name(row.SourceLocationType, row.SourceLocationID),
+            "destinationLocationType": row.DestinationLocationType,
+            "destinationLocationName": app.destination_location_name(row.DestinationLocationType,
+                                                                     row.DestinationLocationID),
+            "fuelTypeName": app.fuel_type_name(row.FuelTypeID),
+            "quantity": float(row.Quantity),
+            "transactionDate": row.TransactionDate.isoformat(),
+            "fuelPricePerUnit": float(row.FuelPricePerUnit) if row.FuelPricePerUnit else None,
+            "transportationCost": float(row.TransportationCost),
+            "loadingUnloadingCost": float(row.LoadingUnloadingCost),
+            "otherCost": float(row.OtherCost),
+            "totalCost": float(row.TotalCost) if row.TotalCost else None,
+            "notes": row.Notes
+        }
+
+    def fuel_inventory_to_dict(row):
+        return {
+            "inventoryID": row.InventoryID,
+            "fuelTypeID": row.FuelTypeID,
+            "fuelTypeName": app.fuel_type_name(row.FuelTypeID),
+            "locationType": row.LocationType,
+            "locationID": row.LocationID,
+            "locationName": app.inventory_location_name(row.LocationType, row.LocationID),
+            "currentStock": float(row.CurrentStock),
+            "lastUpdated": row.LastUpdated.isoformat()
+        }
+
+    def price_fluctuation_to_dict(row):
+        return {
+            "fluctuationID": row.FluctuationID,
+            "fuelTypeName": row.FuelTypeName,
+            "fluctuationDate": row.FluctuationDate.isoformat(),
+            "currentPrice": float(row.CurrentPrice),
+            "previousPrice": float(row.PreviousPrice) if row.PreviousPrice else None,
+            "fluctuationAmount": float(row.FluctuationAmount) if row.FluctuationAmount else None,
+            "fluctuationType": row.FluctuationType,
+            "notes": row.Notes
+        }
+
+    return {"fuelTransactions": fuel_transaction_to_dict, "fuelInventory": fuel_inventory_to_dict,
+            "priceFluctuations": price_fluctuation_to_dict}
+
+
+def _best(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(path, row_counts, repeat):
+    db.configure_pool(standin.connection_factory(path), min_size=1, max_size=2)
+    import app # Imported after the pool points at the stand-in
+
+    handlers = _handler_dicts(app)
+    lists = [
+        ('fuelTransactions', app.FUEL_TRANSACTIONS_QUERY, app.FUEL_TRANSACTION_PLAN, 'TransactionID DESC'),
+        ('fuelInventory', app.FUEL_INVENTORY_QUERY, app.FUEL_INVENTORY_PLAN, 'InventoryID'),
+        ('priceFluctuations', app.PRICE_FLUCTUATIONS_QUERY, app.PRICE_FLUCTUATION_PLAN, 'FluctuationID DESC'),
+    ]
+    fast_encoder = serialize.orjson
+    connection = standin.connect(path)
+    report = []
+    try:
+        cursor = connection.cursor()
+        app.fuel_type_name(1) # Warm the name lookups, as a running server would have them
+        app.location_name('Site', 1)
+        with app.app.app_context():
+            for name, sql, plan, order_by in lists:
+                for rows in row_counts:
+                    cursor.execute(f"SELECT TOP {rows} * FROM ({sql}) listed ORDER BY {order_by}")
+                    fetched = cursor.fetchall()
+                    to_dict = handlers[name]
+                    handler_seconds, expected = _best(
+                        lambda: app.app.json.dumps([to_dict(row) for row in fetched]), repeat)
+                    result = {"list": name, "rows": len(fetched),
+                              "handlerMs": round(handler_seconds * 1000, 2)}
+                    encoders = [('json', None)] + ([('orjson', fast_encoder)] if fast_encoder else [])
+                    for label, encoder in encoders:
+                        serialize.orjson = encoder
+                        seconds, payload = _best(lambda: plan.encode(cursor, fetched), repeat)
+                        result[f"plan{label.capitalize()}Ms"] = round(seconds * 1000, 2)
+                        result[f"plan{label.capitalize()}Speedup"] = round(handler_seconds / seconds, 2)
+                        # Same items apart from key order and 0 vs null
+                        result[f"plan{label.capitalize()}Matches"] = json.loads(payload) == json.loads(expected)
+                    serialize.orjson = fast_encoder
+                    report.append(result)
+        return report
+    finally:
+        serialize.orjson = fast_encoder
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Row serialization: per-row handlers vs compiled RowPlans.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file")
+    parser.add_argument('--scale', choices=sorted(seed.SCALES), default='small',
+                        help="Seed scale if the database does not exist yet")
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000], help="Rows per serialized page")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the best is reported")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Seeding {args.db} at scale {args.scale}...")
+        seed.seed_database(args.db, *seed.SCALES[args.scale])
+
+    print(json.dumps(run_benchmark(args.db, args.rows, args.repeat), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,495 @@
+# SQLite Stand-in Database (bench/standin.py)
+#
+# Runs the application's SQL Server queries against a local SQLite file so
+# endpoints can be exercised and benchmarked without a live SQL Server.
+# The stand-in is built from schema.sql and exposes a pyodbc-compatible
+# surface: `cursor.execute(sql, *params)`, attribute access on rows,
+# settable `autocommit`, and driver errors raised as pyodbc.Error with an
+# SQLSTATE in args[0].
+#
+# Only the T-SQL constructs the application uses are translated (TOP n,
+# OFFSET/FETCH, GETDATE(), GETUTCDATE(), ISNULL, N'' literals, CAST(x AS
+# DATE), table hints, OUTPUT inserted.*, and single-target MERGE upserts);
+# CHECKSUM() and CHECKSUM_AGG() are registered as SQLite functions. UPDLOCK/XLOCK
+# reads inside a transaction take SQLite's write lock so they block writers
+# as on SQL Server.
+
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+import pyodbc
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')
+
+BUSY_TIMEOUT_SECONDS = 5.0
+
+
+# --- Type adapters / converters (mirror what pyodbc returns) ---
+
+def _adapt_datetime(value):
+    return value.isoformat(sep=' ')
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, _adapt_datetime)
+
+def _convert_date(raw):
+    return date.fromisoformat(raw.decode()[:10])
+
+def _convert_datetime(raw):
+    return datetime.fromisoformat(raw.decode())
+
+def _convert_decimal(raw):
+    return Decimal(raw.decode())
+
+sqlite3.register_converter('DATE', _convert_date)
+sqlite3.register_converter('DATETIME', _convert_datetime)
+sqlite3.register_converter('DECIMAL', _convert_decimal)
+
+
+# --- Schema translation ---
+
+_COMPUTED_COLUMN = re.compile(r'^\s*(\w+)\s+AS\s+\((.*)\)\s+PERSISTED\s*,?\s*$', re.IGNORECASE)
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(\w+)', re.IGNORECASE)
+
+
+def _strip_comments(sql):
+    sql = re.sub(r'/\*.*?\*/', '', sql, flags=re.DOTALL)
+    return re.sub(r'--[^\n]*', '', sql)
+
+
+def _translate_create_table(statement):
+    """Translates one CREATE TABLE batch; returns (create_sql, trigger_sqls)."""
+    table = _CREATE_TABLE.search(statement).group(1)
+    lines = []
+    triggers = []
+    for line in statement.splitlines():
+        computed = _COMPUTED_COLUMN.match(line)
+        if computed:
+            # SQLite cannot persist a computed column with a subquery, so keep a
+            # plain column and fill it from a trigger (bulk loaders may pre-fill it).
+            column, expression = computed.group(1), computed.group(2)
+            lines.append(f"    {column} DECIMAL(18,2),")
+            triggers.append(
+                f"CREATE TRIGGER TR_{table}_{column} AFTER INSERT ON {table} "
+                f"WHEN NEW.{column} IS NULL BEGIN "
+                f"UPDATE {table} SET {column} = ({expression}) WHERE rowid = NEW.rowid; END"
+            )
+            continue
+        line = re.sub(r'\bINT\s+PRIMARY\s+KEY\s+IDENTITY\s*\(\s*1\s*,\s*1\s*\)',
+                      'INTEGER PRIMARY KEY AUTOINCREMENT', line, flags=re.IGNORECASE)
+        line = re.sub(r'\bN?VARCHAR\s*\(\s*(\d+|MAX)\s*\)', 'TEXT', line, flags=re.IGNORECASE)
+        line = re.sub(r'\bROWVERSION\b', 'INTEGER', line, flags=re.IGNORECASE)
+        line = re.sub(r'\bBIT\b', 'INTEGER', line)
+        line = re.sub(r'DEFAULT\s+GETDATE\(\)', 'DEFAULT CURRENT_TIMESTAMP', line, flags=re.IGNORECASE)
+        line = re.sub(r'DEFAULT\s+SYSUTCDATETIME\(\)', 'DEFAULT CURRENT_TIMESTAMP', line, flags=re.IGNORECASE)
+        lines.append(line)
+    create = '\n'.join(lines)
+    # A computed column may have been the last column; drop a dangling comma.
+    create = re.sub(r',\s*\)\s*;?\s*$', '\n)', create.strip())
+    return create, triggers
+
+
+def _translate_create_index(statement):
+    statement = re.sub(r'\bNONCLUSTERED\b|\bCLUSTERED\b', '', statement, flags=re.IGNORECASE)
+    # Covering columns have no SQLite equivalent; the key columns still apply.
+    statement = re.sub(r'\s+INCLUDE\s*\([^)]*\)', '', statement, flags=re.IGNORECASE)
+    statement = re.sub(r'\s+WHERE\s+.*$', '', statement, flags=re.IGNORECASE | re.DOTALL)
+    return statement.strip().rstrip(';')
+
+
+def schema_statements(schema_path=SCHEMA_PATH):
+    """Returns SQLite DDL for every table, trigger and index in schema.sql."""
+    with open(schema_path, encoding='utf-8') as handle:
+        script = _strip_comments(handle.read())
+    tables, triggers, indexes = [], [], []
+    for batch in re.split(r'^\s*GO\s*$', script, flags=re.MULTILINE | re.IGNORECASE):
+        for statement in re.split(r';\s*(?=CREATE\s)', batch, flags=re.IGNORECASE):
+            statement = statement.strip()
+            upper = statement.upper()
+            if upper.startswith('CREATE TABLE'):
+                create, table_triggers = _translate_create_table(statement)
+                tables.append(create)
+                triggers.extend(table_triggers)
+            elif re.match(r'CREATE\s+(UNIQUE\s+)?(NON)?(CLUSTERED\s+)?INDEX', upper):
+                for index in re.split(r';\s*', statement):
+                    if index.strip():
+                        indexes.append(_translate_create_index(index))
+    return tables + triggers + indexes
+
+
+def create_database(path, schema_path=SCHEMA_PATH):
+    """Creates (or recreates) a stand-in database file from schema.sql."""
+    if os.path.exists(path):
+        os.remove(path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    raw = sqlite3.connect(path)
+    try:
+        raw.execute('PRAGMA journal_mode=WAL')
+        for statement in schema_statements(schema_path):
+            raw.execute(statement)
+        raw.commit()
+    finally:
+        raw.close()
+    return path
+
+
+# --- Query translation ---
+
+_TOP = re.compile(r'\bSELECT\s+(DISTINCT\s+)?TOP\s*\(?\s*(\d+)\s*\)?\s', re.IGNORECASE)
+_OFFSET_FETCH = re.compile(
+    r'\bOFFSET\s+(\?|\d+)\s+ROWS?\s+FETCH\s+(?:NEXT|FIRST)\s+(\?|\d+)\s+ROWS?\s+ONLY', re.IGNORECASE)
+_TABLE_HINT = re.compile(
+    r'\s+WITH\s*\(\s*(?:UPDLOCK|ROWLOCK|HOLDLOCK|NOLOCK|READPAST|READCOMMITTEDLOCK|SERIALIZABLE)'
+    r'(?:\s*,\s*\w+)*\s*\)', re.IGNORECASE)
+# CAST(x AS DATE) -> DATE(x); aliased results are converted back to dates by the cursor.
+_CAST_DATE_ALIAS = re.compile(r'\bCAST\(\s*([\w.]+)\s+AS\s+DATE\s*\)\s+AS\s+(\w+)', re.IGNORECASE)
+_CAST_DATE = re.compile(r'\bCAST\(\s*([\w.]+)\s+AS\s+DATE\s*\)', re.IGNORECASE)
+_OUTPUT = re.compile(r'\s+OUTPUT\s+((?:INSERTED\.\w+(?:\s+AS\s+\w+)?\s*,?\s*)+)', re.IGNORECASE)
+_MERGE = re.compile(
+    r'^\s*MERGE\s+(?:INTO\s+)?(?P<table>\w+)(?:\s+WITH\s*\([^)]*\))?\s+AS\s+target\s+'
+    r'USING\s+\(\s*VALUES\s*(?P<values>.*?)\)\s+AS\s+source\s*\((?P<columns>[^)]*)\)\s+'
+    r'ON\s*\(?(?P<on>.*?)\)?\s+'
+    r'WHEN\s+MATCHED\s+THEN\s+UPDATE\s+SET\s+(?P<update>.*?)\s+'
+    r'WHEN\s+NOT\s+MATCHED(?:\s+BY\s+TARGET)?\s+THEN\s+INSERT\s*\((?P<insert_cols>[^)]*)\)\s*'
+    r'VALUES\s*\((?P<insert_vals>.*)\)\s*(?P<output>OUTPUT\s+.*?)?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL)
+
+
+def _split_top_level(text, separator=','):
+    """Splits on separators that are not nested inside parentheses."""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+def _translate_merge(match):
+    """Rewrites `MERGE ... USING (VALUES ...)` as INSERT ... ON CONFLICT DO UPDATE."""
+    table = match.group('table')
+    source_columns = [c.strip() for c in match.group('columns').split(',')]
+    positional = {name.lower(): f'column{i + 1}' for i, name in enumerate(source_columns)}
+    insert_columns = [c.strip() for c in match.group('insert_cols').split(',')]
+    insert_values = _split_top_level(match.group('insert_vals'))
+
+    def from_source(expression):
+        return re.sub(r'\bsource\.(\w+)', lambda m: positional[m.group(1).lower()], expression,
+                      flags=re.IGNORECASE)
+
+    # Which inserted column carries each source column, for use in DO UPDATE.
+    excluded = {}
+    for column, value in zip(insert_columns, insert_values):
+        direct = re.fullmatch(r'\s*source\.(\w+)\s*', value, flags=re.IGNORECASE)
+        if direct:
+            excluded[direct.group(1).lower()] = f'excluded.{column}'
+
+    conflict_columns = re.findall(r'target\.(\w+)\s*=\s*source\.\w+', match.group('on'), flags=re.IGNORECASE)
+    updates = re.sub(r'\btarget\.', f'{table}.', match.group('update'), flags=re.IGNORECASE)
+    updates = re.sub(r'\bsource\.(\w+)', lambda m: excluded[m.group(1).lower()], updates,
+                     flags=re.IGNORECASE)
+
+    select_list = ', '.join(from_source(value) for value in insert_values)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+        f"SELECT {select_list} FROM (VALUES {match.group('values')}) WHERE true "
+        f"ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates}"
+    )
+    if match.group('output'):
+        columns = re.findall(r'INSERTED\.(\w+)', match.group('output'), flags=re.IGNORECASE)
+        sql += ' RETURNING ' + ', '.join(columns)
+    return sql
+
+
+@lru_cache(maxsize=512)
+def _date_columns(sql):
+    """Names of the result columns a statement produces with CAST(x AS DATE)."""
+    return tuple(sorted(set(alias for _, alias in _CAST_DATE_ALIAS.findall(sql))))
+
+
+@lru_cache(maxsize=512)
+def translate(sql):
+    """Translates a T-SQL statement used by the application to SQLite."""
+    sql = sql.strip().rstrip(';')
+    sql = re.sub(r'\bGETDATE\(\)|\bGETUTCDATE\(\)|\bSYSDATETIME\(\)|\bSYSUTCDATETIME\(\)', 'CURRENT_TIMESTAMP', sql,
+                 flags=re.IGNORECASE)
+    sql = re.sub(r'\bISNULL\(', 'IFNULL(', sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bN'", "'", sql)
+    sql = _CAST_DATE.sub(r'DATE(\1)', sql)
+
+    merge = _MERGE.match(sql)
+    if merge:
+        return _translate_merge(merge)
+
+    sql = _TABLE_HINT.sub('', sql)
+
+    returning = None
+    output = _OUTPUT.search(sql)
+    if output:
+        returning = ', '.join(re.findall(r'INSERTED\.(\w+(?:\s+AS\s+\w+)?)', output.group(1),
+                                         flags=re.IGNORECASE))
+        sql = sql[:output.start()] + ' ' + sql[output.end():]
+
+    limit = None
+    top = _TOP.search(sql)
+    if top:
+        limit = top.group(2)
+        sql = sql[:top.start()] + 'SELECT ' + (top.group(1) or '') + sql[top.end():]
+
+    # SQLite's `LIMIT offset, count` keeps the parameter order of OFFSET/FETCH.
+    sql = _OFFSET_FETCH.sub(lambda m: f'LIMIT {m.group(1)}, {m.group(2)}', sql)
+
+    if limit is not None:
+        sql += f' LIMIT {limit}'
+    if returning:
+        sql += f' RETURNING {returning}'
+    return sql
+
+
+# --- pyodbc-compatible wrappers ---
+
+_row_classes = {}
+_row_classes_lock = threading.Lock()
+
+
+class Row(tuple):
+    """Tuple row with pyodbc-style attribute access by column name."""
+
+    __slots__ = ()
+    _index = {}
+
+    def __getattr__(self, name):
+        try:
+            return self[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def _date_row_new(positions):
+    def __new__(cls, values):
+        values = list(values)
+        for position in positions:
+            if isinstance(values[position], str):
+                values[position] = date.fromisoformat(values[position])
+        return tuple.__new__(cls, values)
+    return __new__
+
+
+def _row_class(description, date_columns=()):
+    if description is None:
+        return None
+    names = tuple(column[0] for column in description)
+    key = (names, date_columns)
+    row_class = _row_classes.get(key)
+    if row_class is None:
+        with _row_classes_lock:
+            row_class = _row_classes.get(key)
+            if row_class is None:
+                index = {name: position for position, name in enumerate(names)}
+                namespace = {'__slots__': (), '_index': index}
+                positions = tuple(index[name] for name in date_columns if name in index)
+                if positions:
+                    # SQLite's DATE() yields text; SQL Server's CAST(x AS DATE) a date.
+                    namespace['__new__'] = _date_row_new(positions)
+                row_class = type('Row', (Row,), namespace)
+                _row_classes[key] = row_class
+    return row_class
+
+
+def _to_driver_error(ex):
+    """Maps a sqlite3 error to the pyodbc exception SQL Server would raise."""
+    message = str(ex)
+    if isinstance(ex, sqlite3.IntegrityError):
+        return pyodbc.IntegrityError('23000', message)
+    if isinstance(ex, sqlite3.OperationalError) and 'locked' in message:
+        # Treat lock timeouts like SQL Server deadlock victims (SQLSTATE 40001).
+        return pyodbc.OperationalError('40001', message)
+    if isinstance(ex, sqlite3.OperationalError):
+        return pyodbc.OperationalError('HY000', message)
+    return pyodbc.ProgrammingError('42000', message)
+
+
+_LOCKING_READ = re.compile(r'\bWITH\s*\([^)]*\b(?:UPDLOCK|XLOCK)\b', re.IGNORECASE)
+
+
+def _params(params):
+    if len(params) == 1 and isinstance(params[0], (list, tuple)):
+        return tuple(params[0])
+    return params
+
+
+class StandinCursor:
+    """Cursor wrapper that translates SQL and returns attribute-accessible rows."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._raw.cursor()
+        self._row_class = None
+        self.fast_executemany = False # Accepted for pyodbc compatibility
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, *params):
+        raw = self.connection._raw
+        try:
+            if raw.isolation_level is not None and not raw.in_transaction and _LOCKING_READ.search(sql):
+                # SQLite has no row locks; take the write lock up front so an
+                # UPDLOCK read keeps other writers out until commit, as on SQL Server.
+                raw.execute('BEGIN IMMEDIATE')
+            self._cursor.execute(translate(sql), _params(params))
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+        self._row_class = _row_class(self._cursor.description, _date_columns(sql))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        try:
+            self._cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+        self._row_class = None
+        return self
+
+    def fetchone(self):
+        try:
+            row = self._cursor.fetchone()
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+        return None if row is None else self._row_class(row)
+
+    def fetchmany(self, size=None):
+        try:
+            rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+        row_class = self._row_class
+        return [row_class(row) for row in rows]
+
+    def fetchall(self):
+        try:
+            rows = self._cursor.fetchall()
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+        row_class = self._row_class
+        return [row_class(row) for row in rows]
+
+    def fetchval(self):
+        row = self.fetchone()
+        return None if row is None else row[0]
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+def _checksum(*values):
+    """CHECKSUM(...): a signed 32-bit hash of the values (not SQL Server's algorithm)."""
+    return zlib.crc32(repr(values).encode('utf-8')) - 2 ** 31
+
+
+class _ChecksumAgg:
+    """CHECKSUM_AGG(x): XOR of the non-NULL values, as on SQL Server."""
+
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= value
+
+    def finalize(self):
+        return self.value
+
+
+class StandinConnection:
+    """Connection wrapper exposing pyodbc's autocommit/commit/rollback API."""
+
+    def __init__(self, path):
+        self._raw = sqlite3.connect(
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False, # The pool hands connections between threads
+            isolation_level=None,
+            timeout=BUSY_TIMEOUT_SECONDS,
+        )
+        self._raw.execute('PRAGMA journal_mode=WAL')
+        self._raw.execute('PRAGMA synchronous=NORMAL')
+        self._raw.execute('PRAGMA foreign_keys=ON')
+        self._raw.create_function('CHECKSUM', -1, _checksum, deterministic=True)
+        self._raw.create_aggregate('CHECKSUM_AGG', 1, _ChecksumAgg)
+
+    @property
+    def autocommit(self):
+        return self._raw.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        if value and self._raw.in_transaction:
+            self._raw.commit() # ODBC commits the open transaction when autocommit is switched on
+        self._raw.isolation_level = None if value else 'DEFERRED'
+
+    def cursor(self):
+        return StandinCursor(self)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+
+    def rollback(self):
+        try:
+            self._raw.rollback()
+        except sqlite3.Error as ex:
+            raise _to_driver_error(ex) from ex
+
+    def close(self):
+        self._raw.close()
+
+
+def connect(path):
+    """Opens a pyodbc-compatible connection to a stand-in database file."""
+    if not os.path.exists(path):
+        raise pyodbc.OperationalError('08001', f"Stand-in database not found: {path}")
+    return StandinConnection(path)
+
+
+def connection_factory(path):
+    """Returns a zero-argument connect callable for db.configure_pool()."""
+    path = os.path.abspath(path)
+    return lambda: connect(path)
@@ -0,0 +1,184 @@
+# Hot-Warehouse Concurrency Stress Test (bench/stress.py)
+#
+# Fires concurrent transfers out of (and deliveries into) a single warehouse
+# through POST /api/fueltransactions and then checks the books: the final
+# stock must never be negative and must equal the starting stock plus the
+# accepted deliveries minus the accepted transfers, and the ledger must hold
+# exactly one row per accepted request. Reports throughput, latency and how
+# many deadlock retries were needed. Exits with code 1 if any check fails.
+#
+# Usage:
+#   python -m bench.stress --db fuel_bench.db --threads 16 --requests 2000
+
+import argparse
+import json
+import os
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+from bench import seed, standin
+from bench.loadtest import _ServerThread, _request, percentile
+
+
+def _hot_location(path):
+    connection = standin.connect(path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT FuelTypeID, LocationID FROM FuelInventory WHERE LocationType = 'Warehouse' "
+                       "ORDER BY FuelTypeID, LocationID")
+        fuel_type_id, warehouse_id = cursor.fetchone()
+        cursor.execute("SELECT SiteID FROM Sites ORDER BY SiteID")
+        site_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT SupplierID FROM Suppliers ORDER BY SupplierID")
+        supplier_id = cursor.fetchone()[0]
+        return fuel_type_id, warehouse_id, site_ids, supplier_id
+    finally:
+        connection.close()
+
+
+def _stock_and_ledger(path, fuel_type_id, warehouse_id):
+    connection = standin.connect(path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT CurrentStock FROM FuelInventory WHERE FuelTypeID = ? AND LocationType = 'Warehouse' "
+                       "AND LocationID = ?", fuel_type_id, warehouse_id)
+        stock = float(cursor.fetchval())
+        cursor.execute("SELECT COUNT(*) FROM FuelTransactions WHERE FuelTypeID = ? AND "
+                       "((SourceLocationType = 'Warehouse' AND SourceLocationID = ?) OR "
+                       "(DestinationLocationType = 'Warehouse' AND DestinationLocationID = ?))",
+                       fuel_type_id, warehouse_id, warehouse_id)
+        return stock, cursor.fetchval()
+    finally:
+        connection.close()
+
+
+def _set_stock(path, fuel_type_id, warehouse_id, stock):
+    connection = standin.connect(path)
+    try:
+        connection.execute("UPDATE FuelInventory SET CurrentStock = ? WHERE FuelTypeID = ? AND "
+                           "LocationType = 'Warehouse' AND LocationID = ?", stock, fuel_type_id, warehouse_id)
+    finally:
+        connection.close()
+
+
+def run_stress(path, threads, requests, quantity, initial_stock, delivery_every, pool_size):
+    """Runs the stress test against the stand-in at `path`; returns (report, failures)."""
+    fuel_type_id, warehouse_id, site_ids, supplier_id = _hot_location(path)
+    _set_stock(path, fuel_type_id, warehouse_id, initial_stock)
+    _, ledger_before = _stock_and_ledger(path, fuel_type_id, warehouse_id)
+
+    rng = random.Random(11)
+    kinds = ['delivery' if delivery_every and n % delivery_every == delivery_every - 1 else 'transfer'
+             for n in range(requests)]
+    sites = [rng.choice(site_ids) for _ in range(requests)]
+
+    def body(n):
+        stamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        if kinds[n] == 'delivery':
+            return {"transactionType": "Replenishment Process 1", "sourceLocationType": "Supplier",
+                    "sourceLocationID": supplier_id, "destinationLocationType": "Warehouse",
+                    "destinationLocationID": warehouse_id, "fuelTypeID": fuel_type_id,
+                    "quantity": quantity, "transactionDate": stamp}
+        return {"transactionType": "Fuel Transfer Process", "sourceLocationType": "Warehouse",
+                "sourceLocationID": warehouse_id, "destinationLocationType": "Site",
+                "destinationLocationID": sites[n], "fuelTypeID": fuel_type_id,
+                "quantity": quantity, "transactionDate": stamp}
+
+    db.configure_pool(standin.connection_factory(path), min_size=1, max_size=pool_size)
+    from app import app # Imported after the pool points at the stand-in
+
+    server = _ServerThread(app)
+    server.start()
+
+    def worker(n):
+        latency, status = _request(server.base_url, 'POST', '/api/fueltransactions', lambda: body(n))
+        return kinds[n], latency, status
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(worker, range(requests)))
+        elapsed = time.perf_counter() - started
+        with urllib.request.urlopen(server.base_url + '/api/pool/stats') as response:
+            retries = json.load(response).get("deadlockRetries", 0)
+    finally:
+        server.stop()
+
+    stock_after, ledger_after = _stock_and_ledger(path, fuel_type_id, warehouse_id)
+    accepted = {"transfer": 0, "delivery": 0}
+    rejected = errors = 0
+    for kind, _, status in results:
+        if status == 201:
+            accepted[kind] += 1
+        elif status == 400:
+            rejected += 1
+        else:
+            errors += 1
+    expected = initial_stock + quantity * (accepted["delivery"] - accepted["transfer"])
+    latencies = sorted(latency for _, latency, _ in results)
+
+    report = {
+        "fuelTypeID": fuel_type_id,
+        "warehouseID": warehouse_id,
+        "threads": threads,
+        "requests": requests,
+        "acceptedTransfers": accepted["transfer"],
+        "acceptedDeliveries": accepted["delivery"],
+        "rejectedInsufficient": rejected,
+        "errors": errors,
+        "deadlockRetries": retries,
+        "initialStock": initial_stock,
+        "finalStock": stock_after,
+        "expectedStock": expected,
+        "ledgerRowsAdded": ledger_after - ledger_before,
+        "throughput": round(requests / elapsed, 2),
+        "p50Ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95Ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+    failures = []
+    if stock_after < 0:
+        failures.append(f"overdraft: final stock {stock_after}")
+    if abs(stock_after - expected) > 1e-6:
+        failures.append(f"final stock {stock_after} != expected {expected}")
+    if ledger_after - ledger_before != accepted["transfer"] + accepted["delivery"]:
+        failures.append(f"ledger rows added {ledger_after - ledger_before} != accepted "
+                        f"{accepted['transfer'] + accepted['delivery']}")
+    if errors:
+        failures.append(f"{errors} requests failed with a server error")
+    return report, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent transfers against one hot warehouse.")
+    parser.add_argument('--db', default='fuel_bench.db', help="Stand-in database file")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--quantity', type=float, default=10.0, help="Litres per movement")
+    parser.add_argument('--initial-stock', type=float, default=5000.0,
+                        help="Stock the hot warehouse starts with (small enough to run dry)")
+    parser.add_argument('--delivery-every', type=int, default=4,
+                        help="Every Nth request is a supplier delivery into the warehouse (0: none)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Seeding {args.db} at scale small...")
+        seed.seed_database(args.db, *seed.SCALES['small'])
+
+    report, failures = run_stress(args.db, args.threads, args.requests, args.quantity,
+                                  args.initial_stock, args.delivery_every, args.threads)
+    print(json.dumps(report, indent=2))
+    if failures:
+        print("Consistency checks FAILED:")
+        for line in failures:
+            print(f"  {line}")
+        return 1
+    print("No overdraft; stock and ledger are consistent.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+# Master Data Cache (cache.py)
+#
+# Fuel types, suppliers, townships, sites and warehouses change rarely but
+# are requested by every form. This module keeps each list in memory as
+# both Python rows and pre-serialized JSON bytes, so a hot request is
+# answered without touching the database or re-encoding anything.
+#
+# get_many() serves several lists at once (GET /api/masterdata): the ones
+# that have to be loaded are loaded concurrently, each on its own pooled
+# connection, so a cold bundle costs about as much as its slowest query.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import db_connection
+
+MASTER_DATA_TTL = float(os.getenv('MASTER_DATA_TTL', '300')) # Seconds before a list is reloaded
+MASTER_DATA_LOAD_WORKERS = int(os.getenv('MASTER_DATA_LOAD_WORKERS', '5')) # Concurrent loads in get_many()
+
+
+class MasterDataUnavailable(Exception):
+    """Raised when a list has to be loaded but no database connection is available."""
+
+
+class CacheEntry:
+    """One cached list: the rows, their JSON encoding and when they were loaded.
+
+    `digest` hashes the payload, so it is the same in every process that
+    loaded the same rows; `version` is a local counter.
+    """
+
+    __slots__ = ('rows', 'payload', 'digest', 'loaded_at', 'version')
+
+    def __init__(self, rows, payload, loaded_at, version):
+        self.rows = rows
+        self.payload = payload
+        self.digest = hashlib.sha1(payload).hexdigest()
+        self.loaded_at = loaded_at
+        self.version = version
+
+
+class MasterDataCache:
+    """TTL cache with explicit invalidation and single-flight refreshes.
+
+    Each named list has its own refresh lock. When an entry expires, one
+    caller reloads it while concurrent callers keep getting the previous
+    rows; callers only block when there is nothing cached at all. Every
+    name carries a version counter that increases whenever its contents
+    change or it is invalidated.
+    """
+
+    def __init__(self, ttl=MASTER_DATA_TTL, load_workers=MASTER_DATA_LOAD_WORKERS):
+        self.ttl = ttl
+        self.load_workers = load_workers
+        self._executor = None
+        self._loaders = {}
+        self._entries = {}
+        self._versions = {}
+        self._refresh_locks = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+
+    def register(self, name, loader):
+        """Registers `loader(cursor) -> list of dicts` under `name`."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._versions.setdefault(name, 0)
+            self._refresh_locks.setdefault(name, threading.Lock())
+
+    def names(self):
+        return list(self._loaders)
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.monotonic() - entry.loaded_at < self.ttl
+
+    def _load(self, name):
+        loader = self._loaders[name]
+        with db_connection() as conn:
+            if conn is None:
+                raise MasterDataUnavailable(f"Database connection failed while loading {name}")
+            rows = loader(conn.cursor())
+        payload = json.dumps(rows, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            previous = self._entries.get(name)
+            if previous is None or previous.payload != payload:
+                self._versions[name] += 1
+            entry = CacheEntry(rows, payload, time.monotonic(), self._versions[name])
+            self._entries[name] = entry
+            self._refreshes += 1
+        return entry
+
+    def get(self, name):
+        """Returns the CacheEntry for `name`, loading or refreshing it if needed."""
+        entry = self._entries.get(name)
+        if self._is_fresh(entry):
+            self._hits += 1
+            return entry
+
+        refresh_lock = self._refresh_locks[name]
+        if entry is not None:
+            # Stale: one caller refreshes, everyone else keeps serving the old copy.
+            if not refresh_lock.acquire(blocking=False):
+                self._hits += 1
+                return entry
+        else:
+            refresh_lock.acquire()
+        try:
+            entry = self._entries.get(name)
+            if self._is_fresh(entry):
+                self._hits += 1
+                return entry
+            self._misses += 1
+            return self._load(name)
+        finally:
+            refresh_lock.release()
+
+    def get_many(self, names):
+        """Returns {name: CacheEntry} for `names`, loading the lists that need it concurrently.
+
+        Raises the first loader error (e.g. MasterDataUnavailable) after all
+        loads have finished.
+        """
+        entries = {}
+        pending = []
+        for name in names:
+            entry = self._entries.get(name)
+            if entry is not None:
+                if not self._is_fresh(entry):
+                    pending.append(name) # get() refreshes it, or serves it while another caller does
+                    continue
+                self._hits += 1
+                entries[name] = entry
+            elif name in self._loaders:
+                pending.append(name)
+            else:
+                raise KeyError(name)
+        if len(pending) == 1 or self.load_workers <= 1:
+            for name in pending:
+                entries[name] = self.get(name)
+            return entries
+
+        futures = [(name, self._load_executor().submit(self.get, name)) for name in pending]
+        error = None
+        for name, future in futures:
+            try:
+                entries[name] = future.result()
+            except Exception as ex:
+                error = error or ex
+        if error is not None:
+            raise error
+        return entries
+
+    def _load_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.load_workers, thread_name_prefix='master-data-load')
+        return self._executor
+
+    def invalidate(self, *names):
+        """Drops cached lists (all of them when no names are given) and bumps their versions."""
+        with self._lock:
+            for name in names or list(self._loaders):
+                if name not in self._loaders:
+                    raise KeyError(name)
+                self._entries.pop(name, None)
+                self._versions[name] += 1
+
+    def version(self, name):
+        return self._versions[name]
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttlSeconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "refreshes": self._refreshes,
+                "entries": {
+                    name: {
+                        "version": self._versions[name],
+                        "rows": len(entry.rows),
+                        "bytes": len(entry.payload),
+                        "ageSeconds": round(time.monotonic() - entry.loaded_at, 3),
+                    }
+                    for name, entry in self._entries.items()
+                },
+            }
+
+
+# Process-wide cache shared by the master-data endpoints
+master_data = MasterDataCache()
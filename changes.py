@@ -0,0 +1,220 @@
+# Change Feed (changes.py)
+#
+# Lets clients sync incrementally instead of re-downloading lists. A change
+# cursor is (last TransactionID, last FluctuationID, last RebuildID) seen by
+# the client, encoded like the paging cursors. All are identity columns, so
+# "everything after the cursor" is an index seek; updated inventory rows are
+# the ones touched by the new ledger rows (every balance change is a ledger
+# row, except repairs made by reconcile.py, after which clients resync).
+#
+# PriceFluctuations is not append-only: a rebuild (fluctuations.py) deletes a
+# fuel type's rows from a date on and re-inserts them under new IDs. The new
+# rows arrive as ordinary changes; each rebuild also comes back as a notice
+# {fuelTypeID, from, to, replacedThroughFluctuationID}, and the client drops
+# its fluctuations of that fuel type (all of them when null) dated in
+# [from, to) whose ID is at most replacedThroughFluctuationID. The rule does
+# not depend on the order notices and rows are applied in.
+#
+# GET /api/changes/stream pushes inventory balance changes as movements
+# commit, over server-sent events. Each event's id is a change cursor, so a
+# client that reconnects catches up with GET /api/changes?since=<id>. The
+# balances are only read back when someone is listening.
+
+import json
+import os
+import queue
+import threading
+
+import pyodbc
+
+from ingest import net_inventory_deltas
+from paging import QueryParamError, decode_cursor, encode_cursor
+
+CHANGES_LIMIT = int(os.getenv('CHANGES_LIMIT', '1000'))          # Rows per change type per call
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_CLIENTS = int(os.getenv('SSE_MAX_CLIENTS', '100'))
+SSE_QUEUE_SIZE = 256 # Events buffered per client before it is told to resync
+
+ROWS_PER_STATEMENT = 500
+
+CHANGE_CURSOR_SQL = (
+    "SELECT (SELECT MAX(TransactionID) FROM FuelTransactions) AS LastTransactionID, "
+    "(SELECT MAX(FluctuationID) FROM PriceFluctuations) AS LastFluctuationID, "
+    "(SELECT MAX(RebuildID) FROM PriceFluctuationRebuilds) AS LastRebuildID"
+)
+
+REBUILDS_SQL = (
+    "SELECT RebuildID, FuelTypeID, FromDate, ToDate, ReplacedThroughID FROM PriceFluctuationRebuilds "
+    "WHERE RebuildID > ? ORDER BY RebuildID OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY"
+)
+
+# Inventory keys moved by ledger rows in (after, through]
+TOUCHED_KEYS_SQL = """
+    SELECT FuelTypeID, DestinationLocationType AS LocationType, DestinationLocationID AS LocationID
+    FROM FuelTransactions WHERE TransactionID > ? AND TransactionID <= ?
+    UNION
+    SELECT FuelTypeID, SourceLocationType, SourceLocationID
+    FROM FuelTransactions WHERE TransactionID > ? AND TransactionID <= ? AND SourceLocationType IN ('Warehouse', 'Site')
+"""
+
+
+def current_cursor(cursor):
+    """The change cursor as of now: (last TransactionID, last FluctuationID, last RebuildID)."""
+    cursor.execute(CHANGE_CURSOR_SQL)
+    row = cursor.fetchone()
+    return row.LastTransactionID or 0, row.LastFluctuationID or 0, row.LastRebuildID or 0
+
+
+def parse_since(token):
+    """Decodes a change cursor from ?since= or Last-Event-ID."""
+    try:
+        values = decode_cursor(token, 3)
+    except QueryParamError:
+        # Cursors issued before rebuilds were tracked; every recorded rebuild is newer.
+        values = decode_cursor(token, 2) + [0]
+    if not all(isinstance(value, int) and value >= 0 for value in values):
+        raise QueryParamError("Invalid change cursor")
+    return tuple(values)
+
+
+def rebuild_notice(row):
+    """The client-facing form of a PriceFluctuationRebuilds row."""
+    return {
+        "fuelTypeID": row.FuelTypeID,
+        "from": str(row.FromDate) if row.FromDate is not None else None,
+        "to": str(row.ToDate) if row.ToDate is not None else None,
+        "replacedThroughFluctuationID": row.ReplacedThroughID,
+    }
+
+
+def touched_keys(cursor, after_transaction_id, through_transaction_id):
+    cursor.execute(TOUCHED_KEYS_SQL, after_transaction_id, through_transaction_id,
+                   after_transaction_id, through_transaction_id)
+    return sorted((row.FuelTypeID, row.LocationType, row.LocationID) for row in cursor.fetchall())
+
+
+def key_predicates(keys, prefix=''):
+    """Yields (OR-ed key predicate, params) per ROWS_PER_STATEMENT keys."""
+    for start in range(0, len(keys), ROWS_PER_STATEMENT):
+        chunk = keys[start:start + ROWS_PER_STATEMENT]
+        predicate = " OR ".join(
+            [f"({prefix}FuelTypeID = ? AND {prefix}LocationType = ? AND {prefix}LocationID = ?)"] * len(chunk)
+        )
+        yield predicate, [value for key in chunk for value in key]
+
+
+# --- Server-sent events ---
+
+class Subscription:
+    """One connected event-stream client."""
+
+    __slots__ = ('events', 'dropped')
+
+    def __init__(self, size):
+        self.events = queue.Queue(size)
+        self.dropped = False
+
+
+class ChangeFeed:
+    """Fans committed inventory changes out to event-stream clients.
+
+    Publishing never blocks: a client whose buffer is full is dropped and
+    told to resync from its last event id.
+    """
+
+    def __init__(self, max_clients=SSE_MAX_CLIENTS, queue_size=SSE_QUEUE_SIZE):
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self):
+        """Returns a Subscription, or None when max_clients are already connected."""
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, data, event_id=None):
+        message = format_event(event, data, event_id)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self._published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.events.put_nowait(message)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._subscriptions), "published": self._published}
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(',', ':')))
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+def event_stream(feed, subscription, first_event):
+    """Generator for a text/event-stream response; unsubscribes when the client goes away."""
+    try:
+        yield first_event
+        while True:
+            if subscription.dropped and subscription.events.empty():
+                yield format_event('resync', {"reason": "Client fell behind; fetch /api/changes?since=<last id>"})
+                return
+            try:
+                yield subscription.events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield b": keepalive\n\n"
+    finally:
+        feed.unsubscribe(subscription)
+
+
+def publish_movements(conn, movements, feed=None):
+    """Pushes the new balances of the locations `movements` touched (after commit)."""
+    feed = feed or change_feed
+    if not movements or not feed.has_subscribers():
+        return
+    deltas = net_inventory_deltas(movements)
+    keys = sorted(deltas)
+    try:
+        cursor = conn.cursor()
+        balances = {}
+        for predicate, params in key_predicates(keys):
+            cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory "
+                           f"WHERE {predicate}", *params)
+            for row in cursor.fetchall():
+                balances[(row.FuelTypeID, row.LocationType, row.LocationID)] = float(row.CurrentStock)
+        position = current_cursor(cursor)
+    except pyodbc.Error as ex:
+        print(f"Error publishing inventory changes: {ex}")
+        return
+    feed.publish('inventory', {
+        "changes": [{
+            "fuelTypeID": key[0],
+            "locationType": key[1],
+            "locationID": key[2],
+            "delta": round(deltas[key], 2),
+            "currentStock": balances.get(key),
+        } for key in keys],
+    }, encode_cursor(list(position)))
+
+
+# Process-wide feed shared by the write endpoints and the event stream
+change_feed = ChangeFeed()
@@ -0,0 +1,155 @@
+# Conditional GET (conditional.py)
+#
+# The frontend polls the inventory, transaction and price fluctuation lists
+# although they rarely change between polls. Each of those resources has a
+# change token: high-water marks read with one small aggregate query (e.g.
+# MAX(TransactionID) on the append-only ledger) plus a hash of the cached
+# JSON payload of each master-data list its rows are joined with. Both come
+# from the database, so every worker process computes the same weak ETag for
+# the same data, and a request whose If-None-Match still matches gets a 304
+# before the handler runs its list query.
+#
+# Last-Modified is read from the database too, from the timestamp columns of
+# the newest rows, and is left out where the tables keep none (price
+# fluctuations, the master-data lists). Those columns hold the server's local
+# GETDATE(), so the same query reads GETDATE() and GETUTCDATE() and the
+# difference converts them to UTC. Renaming a site changes the ETag of
+# the inventory list but not its timestamps, so the 304 decision is made on
+# the ETag alone and If-Modified-Since is ignored.
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+from functools import wraps
+
+import pyodbc
+from flask import make_response, request
+from werkzeug.http import is_resource_modified
+
+from cache import MasterDataUnavailable, master_data
+from db import db_connection
+
+# Stands in for a list's payload hash when the list could not be loaded, so
+# a tag built from a local version counter never matches another process's.
+_PROCESS_NONCE = os.urandom(8).hex()
+
+# Server clock columns read with the timestamps; not part of the token
+CLOCK_COLUMNS = "GETDATE() AS ServerNow, GETUTCDATE() AS ServerUtcNow"
+
+# resource -> (query, timestamp columns). One row per resource; any insert,
+# update or delete moves at least one value.
+HIGH_WATER_MARKS = {
+    # Inventory rows are updated in place, and two updates can land in the same
+    # DATETIME tick, so MAX(LastUpdated) alone can miss the second one; the
+    # checksum covers every listed column. A scan of FuelInventory (one row
+    # per location and fuel type) is still far cheaper than the joined list query.
+    'fuelInventory': ("SELECT COUNT(*) AS Items, CHECKSUM_AGG(CHECKSUM(InventoryID, FuelTypeID, LocationType, "
+                      "LocationID, CurrentStock, LastUpdated)) AS RowsChecksum, MAX(LastUpdated) AS LastUpdated, "
+                      f"{CLOCK_COLUMNS} FROM FuelInventory",
+                      ('LastUpdated',)),
+    # Transactions are never updated or deleted; listed prices come from
+    # FuelPrices. The newest rows' CreatedAt are primary-key seeks.
+    'fuelTransactions': ("SELECT (SELECT MAX(TransactionID) FROM FuelTransactions) AS LastTransactionID, "
+                         "(SELECT MAX(FuelPriceID) FROM FuelPrices) AS LastFuelPriceID, "
+                         "(SELECT CreatedAt FROM FuelTransactions WHERE TransactionID = "
+                         "(SELECT MAX(TransactionID) FROM FuelTransactions)) AS LastTransactionAt, "
+                         "(SELECT CreatedAt FROM FuelPrices WHERE FuelPriceID = "
+                         "(SELECT MAX(FuelPriceID) FROM FuelPrices)) AS LastFuelPriceAt, "
+                         f"{CLOCK_COLUMNS}",
+                         ('LastTransactionAt', 'LastFuelPriceAt')),
+    # Rebuilds delete and re-insert ranges, so the count catches pure deletions.
+    'priceFluctuations': ("SELECT COUNT(*) AS Items, MAX(FluctuationID) AS LastFluctuationID FROM PriceFluctuations",
+                          ()),
+}
+
+
+def _as_datetime(value):
+    """A datetime from a DATETIME value (some drivers return text), else None."""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def change_token(cursor, resource):
+    """Returns (token, last_modified): the resource's high-water marks as a
+    string and the newest of its timestamp columns in UTC (None if it has none)."""
+    query, timestamp_columns = HIGH_WATER_MARKS[resource]
+    cursor.execute(query)
+    row = cursor.fetchone()
+    names = [column[0] for column in cursor.description]
+    token = '|'.join(str(value) for name, value in zip(names, row) if name not in ('ServerNow', 'ServerUtcNow'))
+    timestamps = [_as_datetime(getattr(row, column)) for column in timestamp_columns]
+    timestamps = [value for value in timestamps if value is not None]
+    if not timestamps:
+        return token, None
+    server_now, server_utc_now = _as_datetime(row.ServerNow), _as_datetime(row.ServerUtcNow)
+    if server_now is None or server_utc_now is None:
+        return token, None
+    # The server's UTC offset, rounded to whole minutes
+    offset = timedelta(minutes=round((server_utc_now - server_now).total_seconds() / 60))
+    return token, max(timestamps) + offset
+
+
+def master_digest(name):
+    """Hash of a master-data list's cached payload."""
+    try:
+        return master_data.get(name).digest
+    except (MasterDataUnavailable, pyodbc.Error) as ex:
+        print(f"Error loading {name} for its ETag: {ex}")
+        return f'{_PROCESS_NONCE}:{master_data.version(name)}'
+
+
+def validators(resource, master_lists=(), token=None, last_modified=None):
+    """Returns (etag, last_modified) for the resource's current state."""
+    digests = ','.join(f'{name}:{master_digest(name)}' for name in master_lists)
+    etag = hashlib.sha1(f'{resource}|{token}|{digests}'.encode('utf-8')).hexdigest()[:24]
+    return etag, last_modified
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache' # Cache, but revalidate on every poll
+    return response
+
+
+def not_modified(etag, last_modified):
+    """An empty 304 response if the request's If-None-Match matches, else None."""
+    if is_resource_modified(request.environ, etag=etag):
+        return None
+    return add_validators(make_response('', 304), etag, last_modified)
+
+
+def conditional_get(resource, *master_lists):
+    """Decorates a list endpoint so unchanged polls are answered with 304.
+
+    Validators are read before the handler runs, so a change that lands in
+    between only makes the next poll fetch the list again.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = None
+            with db_connection() as conn:
+                if conn is not None:
+                    try:
+                        token, last_modified = change_token(conn.cursor(), resource)
+                        current = validators(resource, master_lists, token, last_modified)
+                    except pyodbc.Error as ex:
+                        print(f"Error reading change token for {resource}: {ex}")
+            if current is None:
+                return view(*args, **kwargs)
+
+            unchanged = not_modified(*current)
+            if unchanged is not None:
+                return unchanged
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                add_validators(response, *current)
+            return response
+        return wrapper
+    return decorator
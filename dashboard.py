@@ -0,0 +1,221 @@
+# Dashboard Aggregates (dashboard.py)
+#
+# The dashboard shows stock totals (by fuel type, location type and
+# township), the latest price of each fuel type and how many movements
+# happened recently. Instead of shipping every inventory row to the browser,
+# the totals are loaded once and then kept up to date in memory: the
+# transaction and price write paths report what they committed and the
+# aggregates are adjusted by the same deltas. A full reload every
+# DASHBOARD_RELOAD seconds picks up writes made by other processes.
+
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from cache import MasterDataUnavailable, master_data
+from db import db_connection
+from ingest import net_inventory_deltas
+from locations import township_of
+
+DASHBOARD_RELOAD = float(os.getenv('DASHBOARD_RELOAD', '300')) # Seconds between full reloads
+MOVEMENT_WINDOW_DAYS = 30 # Days of movement counts kept in memory
+
+LATEST_PRICES_QUERY = """
+    SELECT FuelTypeID, Price, EffectiveDate
+    FROM (
+        SELECT FuelTypeID, Price, EffectiveDate,
+               ROW_NUMBER() OVER (PARTITION BY FuelTypeID ORDER BY EffectiveDate DESC, FuelPriceID DESC) AS PriceRank
+        FROM FuelPrices
+    ) ranked
+    WHERE PriceRank = 1
+"""
+
+MOVEMENT_COUNTS_QUERY = """
+    SELECT CAST(TransactionDate AS DATE) AS Day, TransactionType, COUNT(*) AS Movements, SUM(Quantity) AS Quantity
+    FROM FuelTransactions
+    WHERE TransactionDate >= ?
+    GROUP BY CAST(TransactionDate AS DATE), TransactionType
+"""
+
+
+class DashboardUnavailable(Exception):
+    """Raised when the aggregates have to be loaded but no database connection is available."""
+
+
+def _township(location_type, location_id):
+    try:
+        return township_of(location_type, location_id)
+    except MasterDataUnavailable:
+        return None
+
+
+def _names(name, key, label):
+    try:
+        return {row[key]: row[label] for row in master_data.get(name).rows}
+    except MasterDataUnavailable:
+        return {}
+
+
+def _add(totals, key, amount):
+    totals[key] = totals.get(key, 0.0) + amount
+
+
+class DashboardAggregates:
+    """Stock, latest price and movement totals maintained from write deltas."""
+
+    def __init__(self, reload_interval=DASHBOARD_RELOAD):
+        self.reload_interval = reload_interval
+        self._stock = {}            # (FuelTypeID, LocationType, LocationID) -> stock
+        self._by_fuel_type = {}     # FuelTypeID -> stock
+        self._by_location_type = {} # (LocationType, FuelTypeID) -> stock
+        self._by_township = {}      # (TownshipID, FuelTypeID) -> stock
+        self._latest_prices = {}    # FuelTypeID -> (EffectiveDate, Price)
+        self._movements = {}        # (day, TransactionType) -> [count, quantity]
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _apply_stock(self, key, delta):
+        fuel_type_id, location_type, location_id = key
+        _add(self._stock, key, delta)
+        _add(self._by_fuel_type, fuel_type_id, delta)
+        _add(self._by_location_type, (location_type, fuel_type_id), delta)
+        _add(self._by_township, (_township(location_type, location_id), fuel_type_id), delta)
+
+    def _apply_price(self, fuel_type_id, effective_date, price):
+        current = self._latest_prices.get(fuel_type_id)
+        if current is None or effective_date >= current[0]:
+            self._latest_prices[fuel_type_id] = (effective_date, price)
+
+    def _apply_movement(self, day, transaction_type, count, quantity):
+        if day < date.today() - timedelta(days=MOVEMENT_WINDOW_DAYS - 1):
+            return
+        bucket = self._movements.setdefault((day, transaction_type), [0, 0.0])
+        bucket[0] += count
+        bucket[1] += quantity
+
+    def reload(self, cursor=None):
+        """Recomputes every aggregate from the database."""
+        if cursor is None:
+            with db_connection() as conn:
+                if conn is None:
+                    raise DashboardUnavailable("Database connection failed while loading dashboard totals")
+                return self.reload(conn.cursor())
+        cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory")
+        inventory = cursor.fetchall()
+        cursor.execute(LATEST_PRICES_QUERY)
+        prices = cursor.fetchall()
+        since = datetime.combine(date.today() - timedelta(days=MOVEMENT_WINDOW_DAYS - 1), datetime.min.time())
+        cursor.execute(MOVEMENT_COUNTS_QUERY, since)
+        movements = cursor.fetchall()
+
+        with self._lock:
+            self._stock, self._by_fuel_type, self._by_location_type, self._by_township = {}, {}, {}, {}
+            self._latest_prices, self._movements = {}, {}
+            for row in inventory:
+                self._apply_stock((row.FuelTypeID, row.LocationType, row.LocationID), float(row.CurrentStock))
+            for row in prices:
+                self._apply_price(row.FuelTypeID, row.EffectiveDate, float(row.Price))
+            for row in movements:
+                self._apply_movement(row.Day, row.TransactionType, row.Movements, float(row.Quantity or 0))
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self.loaded and time.monotonic() - self._loaded_at < self.reload_interval:
+            return
+        # One caller reloads; the others keep reading the previous totals.
+        if not self._reload_lock.acquire(blocking=not self.loaded):
+            return
+        try:
+            if not self.loaded or time.monotonic() - self._loaded_at >= self.reload_interval:
+                self.reload()
+        finally:
+            self._reload_lock.release()
+
+    def record_movements(self, movements):
+        """Adjusts the totals for committed movements (no-op until first use)."""
+        if not self.loaded:
+            return
+        deltas = net_inventory_deltas(movements)
+        with self._lock:
+            for key, delta in deltas.items():
+                self._apply_stock(key, delta)
+            for movement in movements:
+                self._apply_movement(movement.transaction_date.date(), movement.transaction_type, 1,
+                                     movement.quantity)
+
+    def record_prices(self, latest_by_fuel_type):
+        """Takes the "latestByFuelType" entry of an import_prices() summary (no-op until first use)."""
+        if not self.loaded:
+            return
+        with self._lock:
+            for fuel_type_id, latest in latest_by_fuel_type.items():
+                self._apply_price(int(fuel_type_id), date.fromisoformat(latest["effectiveDate"]), latest["price"])
+
+    def _movement_windows(self):
+        today = date.today()
+        windows = {"today": 1, "last7Days": 7, "last30Days": MOVEMENT_WINDOW_DAYS}
+        summary = {name: {"count": 0, "quantity": 0.0, "byType": {}} for name in windows}
+        for (day, transaction_type), (count, quantity) in self._movements.items():
+            age = (today - day).days
+            for name, days in windows.items():
+                if 0 <= age < days:
+                    window = summary[name]
+                    window["count"] += count
+                    window["quantity"] += quantity
+                    by_type = window["byType"].setdefault(transaction_type, {"count": 0, "quantity": 0.0})
+                    by_type["count"] += count
+                    by_type["quantity"] += quantity
+        for window in summary.values():
+            window["quantity"] = round(window["quantity"], 2)
+            for by_type in window["byType"].values():
+                by_type["quantity"] = round(by_type["quantity"], 2)
+        return summary
+
+    def summary(self):
+        """Returns the dashboard totals as a JSON-ready dict, loading them if needed."""
+        self._ensure_fresh()
+        fuel_types = _names('fuelTypes', 'fuelTypeID', 'fuelTypeName')
+        townships = _names('townships', 'townshipID', 'townshipName')
+        with self._lock:
+            by_fuel_type = sorted(self._by_fuel_type.items(), key=lambda item: item[0])
+            by_location_type = sorted(self._by_location_type.items(), key=lambda item: item[0])
+            by_township = sorted(self._by_township.items(),
+                                 key=lambda item: (item[0][0] is None, item[0][0] or 0, item[0][1]))
+            latest_prices = sorted(self._latest_prices.items())
+            movements = self._movement_windows()
+            age = time.monotonic() - self._loaded_at
+        return {
+            "stockByFuelType": [
+                {"fuelTypeID": fuel_type_id, "fuelTypeName": fuel_types.get(fuel_type_id),
+                 "currentStock": round(stock, 2)}
+                for fuel_type_id, stock in by_fuel_type
+            ],
+            "stockByLocationType": [
+                {"locationType": location_type, "fuelTypeID": fuel_type_id,
+                 "fuelTypeName": fuel_types.get(fuel_type_id), "currentStock": round(stock, 2)}
+                for (location_type, fuel_type_id), stock in by_location_type
+            ],
+            "stockByTownship": [
+                {"townshipID": township_id, "townshipName": townships.get(township_id),
+                 "fuelTypeID": fuel_type_id, "fuelTypeName": fuel_types.get(fuel_type_id),
+                 "currentStock": round(stock, 2)}
+                for (township_id, fuel_type_id), stock in by_township
+            ],
+            "latestPrices": [
+                {"fuelTypeID": fuel_type_id, "fuelTypeName": fuel_types.get(fuel_type_id),
+                 "price": price, "effectiveDate": effective_date.isoformat()}
+                for fuel_type_id, (effective_date, price) in latest_prices
+            ],
+            "movements": movements,
+            "ageSeconds": round(age, 3),
+        }
+
+
+# Process-wide aggregates shared by the dashboard and the write endpoints
+dashboard = DashboardAggregates()
@@ -0,0 +1,415 @@
+# Database Access Layer (db.py)
+#
+# Owns the SQL Server configuration and a process-wide connection pool so
+# request handlers reuse open connections instead of paying the ODBC
+# connect/login handshake on every call. Pooled connections are wrapped by
+# metrics.instrumented_connect, which times connects, statements and fetches.
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pyodbc
+
+from metrics import instrumented_connect
+
+# Database Configuration (replace with your actual SQL Server details)
+# It's recommended to use environment variables for sensitive information
+DB_CONFIG = {
+    'DRIVER': '{ODBC Driver 17 for SQL Server}', # Or '{SQL Server}'
+    'SERVER': os.getenv('DB_SERVER', 'localhost'), # e.g., 'your_server_name' or 'localhost'
+    'DATABASE': os.getenv('DB_NAME', 'FuelInventoryDB'),
+    'UID': os.getenv('DB_UID', 'your_username'), # Replace with your SQL Server username
+    'PWD': os.getenv('DB_PWD', 'your_password')  # Replace with your SQL Server password
+}
+
+# Pool sizing and lifetime settings (seconds where applicable)
+POOL_CONFIG = {
+    'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', '2')),     # Idle connections kept warm
+    'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', '10')),    # Hard cap on open connections
+    'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '5')),     # Max wait for a free connection
+    'RECYCLE': float(os.getenv('DB_POOL_RECYCLE', '1800')),  # Reopen connections older than this
+    'PING_AFTER': float(os.getenv('DB_POOL_PING_AFTER', '5')),    # Health-check if idle longer than this
+    'IDLE_TIMEOUT': float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300')),  # Close surplus idle connections
+}
+
+# Retries for transactions chosen as deadlock victims (SQLSTATE 40001 / error 1205)
+DEADLOCK_RETRIES = int(os.getenv('DB_DEADLOCK_RETRIES', '3'))
+DEADLOCK_BACKOFF = float(os.getenv('DB_DEADLOCK_BACKOFF', '0.05')) # Seconds before the first retry
+
+
+def build_connection_string(config=None):
+    """Builds the ODBC connection string from DB_CONFIG."""
+    config = config or DB_CONFIG
+    return (
+        f"DRIVER={config['DRIVER']};"
+        f"SERVER={config['SERVER']};"
+        f"DATABASE={config['DATABASE']};"
+        f"UID={config['UID']};"
+        f"PWD={config['PWD']};"
+    )
+
+
+def connect_sql_server():
+    """Opens a raw pyodbc connection to SQL Server."""
+    return pyodbc.connect(build_connection_string())
+
+
+def default_connect():
+    """Returns the connect callable for the configured backend.
+
+    Setting DB_STANDIN_PATH runs the application against the SQLite stand-in
+    from bench/standin.py instead of SQL Server (local development and
+    benchmarks only).
+    """
+    standin_path = os.getenv('DB_STANDIN_PATH')
+    if standin_path:
+        from bench import standin
+        return standin.connection_factory(standin_path)
+    return connect_sql_server
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class _PooledConnection:
+    """A raw connection plus the bookkeeping the pool needs."""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections.
+
+    Connections are handed out LIFO so the most recently used (and therefore
+    warmest) connection is reused first. A connection is health-checked with
+    `SELECT 1` if it sat idle longer than `ping_after`, reopened once it is
+    older than `recycle`, and returned to autocommit mode on release.
+    """
+
+    def __init__(self, connect, min_size=2, max_size=10, timeout=5.0,
+                 recycle=1800.0, ping_after=5.0, idle_timeout=300.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._connect = connect
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.idle_timeout = idle_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0          # Open connections, idle + in use
+        self._in_use = 0
+        self._closed = False
+
+        # Counters reported by stats()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._connect_errors = 0
+
+    # --- Connection lifecycle ---
+
+    def _open(self):
+        conn = self._connect()
+        conn.autocommit = True # Auto-commit changes to the database
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    @staticmethod
+    def _close_quietly(pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, pooled):
+        try:
+            cursor = pooled.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _validate(self, pooled):
+        """Returns a usable connection, replacing `pooled` if it is stale or dead."""
+        now = time.monotonic()
+        if self.recycle and now - pooled.created_at > self.recycle:
+            self._close_quietly(pooled)
+            with self._cond:
+                self._recycled += 1
+            return self._open()
+        if self.ping_after is not None and now - pooled.last_used > self.ping_after:
+            if not self._is_alive(pooled):
+                self._close_quietly(pooled)
+                with self._cond:
+                    self._ping_failures += 1
+                return self._open()
+        return pooled
+
+    # --- Checkout / return ---
+
+    def acquire(self):
+        """Checks out a connection, waiting up to `timeout` seconds for one."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        pooled = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1 # Reserve a slot; the connect happens outside the lock
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available within {self.timeout}s "
+                        f"({self._in_use} in use, max {self.max_size})"
+                    )
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._wait_time += time.monotonic() - start
+
+        try:
+            pooled = self._open() if pooled is None else self._validate(pooled)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._connect_errors += 1
+                self._cond.notify()
+            raise
+        return pooled
+
+    def release(self, pooled, discard=False):
+        """Returns a connection to the pool, rolling back and restoring autocommit."""
+        if not discard:
+            try:
+                if not pooled.conn.autocommit:
+                    pooled.conn.rollback() # Drop anything the handler left uncommitted
+                    pooled.conn.autocommit = True
+            except pyodbc.Error:
+                discard = True
+
+        now = time.monotonic()
+        pooled.last_used = now
+        to_close = []
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+                to_close.append(pooled)
+            else:
+                self._idle.append(pooled)
+                # Trim surplus connections that have been idle too long (oldest first)
+                while (len(self._idle) > 1 and self._size > self.min_size
+                       and now - self._idle[0].last_used > self.idle_timeout):
+                    to_close.append(self._idle.popleft())
+                    self._size -= 1
+            self._cond.notify()
+        for stale in to_close:
+            self._close_quietly(stale)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always returns it."""
+        pooled = self.acquire()
+        try:
+            yield pooled.conn
+        finally:
+            self.release(pooled)
+
+    def prefill(self):
+        """Opens connections until `min_size` are available (e.g. at startup)."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._connect_errors += 1
+                raise
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def close(self):
+        """Closes idle connections; in-use connections are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "inUse": self._in_use,
+                "idle": len(self._idle),
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "waitTimeTotal": round(self._wait_time, 6),
+                "waitTimeAvg": round(self._wait_time / self._waits, 6) if self._waits else 0.0,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "pingFailures": self._ping_failures,
+                "connectErrors": self._connect_errors,
+            }
+
+
+# --- Process-wide pool ---
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _default_pool_options():
+    return {
+        'min_size': POOL_CONFIG['MIN_SIZE'],
+        'max_size': POOL_CONFIG['MAX_SIZE'],
+        'timeout': POOL_CONFIG['TIMEOUT'],
+        'recycle': POOL_CONFIG['RECYCLE'],
+        'ping_after': POOL_CONFIG['PING_AFTER'],
+        'idle_timeout': POOL_CONFIG['IDLE_TIMEOUT'],
+    }
+
+
+def configure_pool(connect=None, **options):
+    """Replaces the process-wide pool, e.g. to point it at another backend.
+
+    `options` override the POOL_CONFIG defaults using ConnectionPool's
+    keyword names (min_size, max_size, timeout, recycle, ping_after,
+    idle_timeout).
+    """
+    global _pool
+    settings = _default_pool_options()
+    settings.update(options)
+    new_pool = ConnectionPool(instrumented_connect(connect or default_connect()), **settings)
+    with _pool_lock:
+        old, _pool = _pool, new_pool
+    if old is not None:
+        old.close()
+    return new_pool
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(instrumented_connect(default_connect()), **_default_pool_options())
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Checks a pooled connection out for the duration of a `with` block.
+
+    Yields None when no connection can be obtained (driver error or pool
+    timeout), so handlers can keep answering with a 500 as before.
+    """
+    pool = get_pool()
+    try:
+        pooled = pool.acquire()
+    except (pyodbc.Error, PoolTimeout) as ex:
+        print(f"Database connection error: {ex}")
+        yield None
+        return
+    try:
+        yield pooled.conn
+    finally:
+        pool.release(pooled)
+
+
+def pool_stats():
+    """Returns usage counters for the process-wide pool (plus deadlock retries)."""
+    return dict(get_pool().stats(), deadlockRetries=_deadlock_retries)
+
+
+# --- Deadlock retry ---
+
+_retry_lock = threading.Lock()
+_deadlock_retries = 0
+
+
+def is_deadlock(ex):
+    """True if `ex` is a driver error for a deadlock victim / serialization failure."""
+    return isinstance(ex, pyodbc.Error) and bool(ex.args) and (
+        ex.args[0] == '40001' or '(1205)' in str(ex)
+    )
+
+
+def run_in_transaction(conn, work, retries=None, backoff=None):
+    """Runs `work(cursor)` in a transaction on `conn` and commits it.
+
+    A deadlock victim is rolled back and re-run up to `retries` times with
+    jittered exponential backoff; any other exception rolls back and
+    propagates. Returns whatever `work` returns.
+    """
+    global _deadlock_retries
+    retries = DEADLOCK_RETRIES if retries is None else retries
+    backoff = DEADLOCK_BACKOFF if backoff is None else backoff
+    attempt = 0
+    while True:
+        conn.autocommit = False
+        try:
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        except Exception as ex:
+            conn.rollback()
+            if attempt >= retries or not is_deadlock(ex):
+                raise
+        attempt += 1
+        with _retry_lock:
+            _deadlock_retries += 1
+        time.sleep(backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+
+def deadlock_retries():
+    """Number of transaction retries caused by deadlocks since startup."""
+    return _deadlock_retries
@@ -0,0 +1,140 @@
+# Price Fluctuation Rebuild (fluctuations.py)
+#
+# PriceFluctuations rows are derived data: each FuelPrices row gets one
+# fluctuation comparing it with the closing price (last price recorded) of
+# the same fuel type on the latest earlier date. When a price is back-dated
+# or corrected, every later fluctuation of that fuel type goes stale.
+#
+# The rebuild recomputes a fuel type (or all of them) from a given date with
+# one windowed (LAG) pass over FuelPrices and swaps the results in with a
+# range DELETE plus INSERT ... SELECT in a single transaction. Only the
+# dates from the earliest changed one onwards are touched. The re-inserted
+# rows get new FluctuationIDs, so each rebuild is also recorded in
+# PriceFluctuationRebuilds with the highest ID it could have replaced; the
+# change feed (changes.py) passes that on to syncing clients.
+#
+# Usage (CLI):
+#   python -m fluctuations --fuel-type 2 --from 2024-03-01
+#   python -m fluctuations            # full rebuild of every fuel type
+
+import argparse
+import json
+import time
+from datetime import date
+
+# LAG over prices ordered by (date, ID) gives the first price of each day the
+# previous day's closing price; FIRST_VALUE spreads it to the rest of the day.
+REBUILD_SQL = """
+    INSERT INTO PriceFluctuations (FuelTypeID, FluctuationDate, CurrentPrice, PreviousPrice, FluctuationAmount, FluctuationType)
+    SELECT FuelTypeID, EffectiveDate, Price, PreviousPrice, ROUND(Price - PreviousPrice, 4),
+           CASE
+               WHEN PreviousPrice IS NULL THEN '-'
+               WHEN Price > PreviousPrice THEN 'Increase'
+               WHEN Price < PreviousPrice THEN 'Decrease'
+               ELSE 'No Change'
+           END
+    FROM (
+        SELECT FuelPriceID, FuelTypeID, EffectiveDate, Price,
+               FIRST_VALUE(PriorPrice) OVER (PARTITION BY FuelTypeID, EffectiveDate ORDER BY FuelPriceID) AS PreviousPrice
+        FROM (
+            SELECT p.FuelPriceID, p.FuelTypeID, p.EffectiveDate, p.Price,
+                   LAG(p.Price) OVER (PARTITION BY p.FuelTypeID ORDER BY p.EffectiveDate, p.FuelPriceID) AS PriorPrice
+            FROM FuelPrices p
+            {where}
+        ) ordered
+    ) priced
+    {output_where}
+    ORDER BY EffectiveDate, FuelPriceID
+"""
+
+
+def rebuild_fluctuations(cursor, fuel_type_id=None, start=None, end=None):
+    """Recomputes PriceFluctuations for prices dated in [start, end).
+
+    Runs on the caller's cursor and transaction, so it can be combined with
+    the price writes that made the rebuild necessary. `start` None means the
+    beginning of history and `end` None the latest price; fluctuations after
+    `end` are left as they are. Records the rebuild in
+    PriceFluctuationRebuilds. Returns (deleted, inserted) row counts.
+    """
+    price_conditions, price_params = [], []
+    delete_conditions, delete_params = [], []
+    if fuel_type_id is not None:
+        price_conditions.append("p.FuelTypeID = ?")
+        price_params.append(fuel_type_id)
+        delete_conditions.append("FuelTypeID = ?")
+        delete_params.append(fuel_type_id)
+    if start is not None:
+        # Reach back to the previous price date so LAG has a value for `start`.
+        price_conditions.append(
+            "p.EffectiveDate >= COALESCE((SELECT MAX(x.EffectiveDate) FROM FuelPrices x "
+            "WHERE x.FuelTypeID = p.FuelTypeID AND x.EffectiveDate < ?), ?)"
+        )
+        price_params.extend([start, start])
+        delete_conditions.append("FluctuationDate >= ?")
+        delete_params.append(start)
+    if end is not None:
+        price_conditions.append("p.EffectiveDate < ?")
+        price_params.append(end)
+        delete_conditions.append("FluctuationDate < ?")
+        delete_params.append(end)
+
+    # Locked so no fluctuation inserted meanwhile falls between the recorded ID and the delete.
+    cursor.execute("SELECT MAX(FluctuationID) AS LastFluctuationID FROM PriceFluctuations WITH (UPDLOCK, HOLDLOCK)")
+    replaced_through = cursor.fetchone().LastFluctuationID or 0
+    cursor.execute("INSERT INTO PriceFluctuationRebuilds (FuelTypeID, FromDate, ToDate, ReplacedThroughID) "
+                   "VALUES (?, ?, ?, ?)", fuel_type_id, start, end, replaced_through)
+
+    delete_where = ("WHERE " + " AND ".join(delete_conditions)) if delete_conditions else ""
+    cursor.execute(f"DELETE FROM PriceFluctuations {delete_where}", *delete_params)
+    deleted = cursor.rowcount
+
+    sql = REBUILD_SQL.format(
+        where=("WHERE " + " AND ".join(price_conditions)) if price_conditions else "",
+        output_where="WHERE EffectiveDate >= ?" if start is not None else "",
+    )
+    cursor.execute(sql, *price_params, *([start] if start is not None else []))
+    return deleted, cursor.rowcount
+
+
+def rebuild(conn, fuel_type_id=None, start=None, end=None):
+    """Runs rebuild_fluctuations() in its own transaction; returns a summary dict."""
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    conn.autocommit = False
+    try:
+        deleted, inserted = rebuild_fluctuations(cursor, fuel_type_id, start, end)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {
+        "fuelTypeID": fuel_type_id,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "deleted": deleted,
+        "inserted": inserted,
+        "elapsedSeconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild PriceFluctuations from FuelPrices.")
+    parser.add_argument('--fuel-type', type=int, help="Only rebuild this FuelTypeID")
+    parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                        help="Earliest changed date (YYYY-MM-DD); default: all history")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat, help="Exclusive end date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        print(json.dumps(rebuild(conn, args.fuel_type, args.start, args.end), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
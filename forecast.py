@@ -0,0 +1,287 @@
+# Supply Forecasts (forecast.py)
+#
+# Estimates how long the stock at each (fuel type, location) lasts at its
+# recent outflow and how much to order. Outflow is the quantity that left a
+# stocked location (it was the transaction's source), averaged per day over
+# rolling windows of 7, 30 and 90 whole days ending yesterday. The forecast
+# uses the highest of the three rates, so a recent surge is not averaged
+# away by a quiet quarter:
+#   DaysOfSupply    = CurrentStock / rate (NULL without outflow)
+#   ReorderQuantity = rate x (FORECAST_LEAD_DAYS + FORECAST_COVER_DAYS) - CurrentStock, if positive
+#
+# Daily outflow is read grouped by (fuel type, location, day) through
+# IX_FuelTransactions_Source and laid out as a location x day NumPy matrix;
+# one cumulative sum along the day axis gives every window's total. The
+# results are stored in SupplyForecasts, which the low-stock endpoint reads
+# in DaysOfSupply order.
+#
+# The first refresh of a day rebuilds every row (the windows moved). Each
+# row stores the MAX(TransactionID) it reflects (ThroughTransactionID);
+# later refreshes read the ledger past the highest stored mark through the
+# primary key and recompute just the sources and destinations of those
+# transactions, whichever process wrote them. The mark is read with an
+# update lock, so refreshers in several processes take turns instead of
+# recomputing the same rows. A transaction that commits after a higher
+# TransactionID was already covered is picked up by the next day's rebuild.
+#
+# Usage (CLI):
+#   python -m forecast                  # rebuild every forecast
+#   python -m forecast --low-stock 14   # also list locations with under 14 days of supply
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from db import run_in_transaction
+
+FORECAST_LEAD_DAYS = float(os.getenv('FORECAST_LEAD_DAYS', '7'))         # Days between ordering and delivery
+FORECAST_COVER_DAYS = float(os.getenv('FORECAST_COVER_DAYS', '30'))      # Days of supply an order should add
+FORECAST_LOW_STOCK_DAYS = float(os.getenv('FORECAST_LOW_STOCK_DAYS', '14')) # Default low-stock threshold
+FORECAST_REFRESH_SECONDS = float(os.getenv('FORECAST_REFRESH_SECONDS', '60')) # Refresher polling, 0 disables
+
+WINDOWS = (7, 30, 90) # Outflow windows in days
+ROWS_PER_STATEMENT = 500
+
+DAILY_OUTFLOW_SQL = """
+    SELECT FuelTypeID, SourceLocationType AS LocationType, SourceLocationID AS LocationID,
+           CAST(TransactionDate AS DATE) AS Day, SUM(Quantity) AS Quantity
+    FROM FuelTransactions
+    WHERE SourceLocationType IN ('Warehouse', 'Site') AND TransactionDate >= ? AND TransactionDate < ? {keys}
+    GROUP BY FuelTypeID, SourceLocationType, SourceLocationID, CAST(TransactionDate AS DATE)
+"""
+
+# Stocked locations on either side of the transactions in (covered, latest]
+CHANGED_KEYS_SQL = """
+    SELECT FuelTypeID, SourceLocationType AS LocationType, SourceLocationID AS LocationID
+    FROM FuelTransactions
+    WHERE TransactionID > ? AND TransactionID <= ? AND SourceLocationType IN ('Warehouse', 'Site')
+    UNION
+    SELECT FuelTypeID, DestinationLocationType, DestinationLocationID
+    FROM FuelTransactions
+    WHERE TransactionID > ? AND TransactionID <= ?
+"""
+
+INSERT_SQL = (
+    "INSERT INTO SupplyForecasts (FuelTypeID, LocationType, LocationID, CurrentStock, Outflow7Days, "
+    "Outflow30Days, Outflow90Days, DailyOutflow, DaysOfSupply, ReorderQuantity, AsOfDate, ComputedAt, "
+    "ThroughTransactionID) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _chunks(items, size=ROWS_PER_STATEMENT):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _key_predicate(chunk, prefix=''):
+    return " OR ".join([f"(FuelTypeID = ? AND {prefix}LocationType = ? AND {prefix}LocationID = ?)"] * len(chunk))
+
+
+def _fetch_stock(cursor, keys=None):
+    """[(key, CurrentStock)] for every inventory row, or for `keys`."""
+    if keys is None:
+        cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory")
+        rows = cursor.fetchall()
+    else:
+        rows = []
+        for chunk in _chunks(keys):
+            cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory "
+                           f"WHERE {_key_predicate(chunk)}", *[value for key in chunk for value in key])
+            rows.extend(cursor.fetchall())
+    return [((row.FuelTypeID, row.LocationType, row.LocationID), float(row.CurrentStock)) for row in rows]
+
+
+def _fetch_outflow(cursor, as_of, keys=None):
+    """Daily outflow rows in the longest window before `as_of`, for every key or for `keys`."""
+    since = datetime.combine(as_of - timedelta(days=max(WINDOWS)), datetime.min.time())
+    until = datetime.combine(as_of, datetime.min.time())
+    if keys is None:
+        cursor.execute(DAILY_OUTFLOW_SQL.format(keys=''), since, until)
+        return cursor.fetchall()
+    rows = []
+    for chunk in _chunks(keys):
+        cursor.execute(DAILY_OUTFLOW_SQL.format(keys=f"AND ({_key_predicate(chunk, 'Source')})"),
+                       since, until, *[value for key in chunk for value in key])
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def window_rates(keys, outflow, as_of):
+    """Per-day outflow over each of WINDOWS, as a len(keys) x len(WINDOWS) array.
+
+    `outflow` holds (FuelTypeID, LocationType, LocationID, Day, Quantity)
+    rows; day d before `as_of` lands in column d - 1 of the daily matrix.
+    """
+    daily = np.zeros((len(keys), max(WINDOWS)))
+    positions = {key: index for index, key in enumerate(keys)}
+    if outflow:
+        rows = np.fromiter((positions.get((row[0], row[1], row[2]), -1) for row in outflow), dtype=np.int64,
+                           count=len(outflow))
+        days = np.fromiter(((as_of - row[3]).days - 1 for row in outflow), dtype=np.int64, count=len(outflow))
+        quantities = np.fromiter((float(row[4]) for row in outflow), dtype=np.float64, count=len(outflow))
+        kept = (rows >= 0) & (days >= 0) & (days < max(WINDOWS))
+        np.add.at(daily, (rows[kept], days[kept]), quantities[kept])
+    totals = daily.cumsum(axis=1)[:, [window - 1 for window in WINDOWS]]
+    return totals / np.array(WINDOWS, dtype=np.float64)
+
+
+def _latest_transaction_id(cursor):
+    cursor.execute("SELECT MAX(TransactionID) AS LastTransactionID FROM FuelTransactions")
+    return cursor.fetchone().LastTransactionID or 0
+
+
+def _changed_keys(cursor, covered, latest):
+    """Sorted keys of the stocked locations that transactions in (covered, latest] touched."""
+    cursor.execute(CHANGED_KEYS_SQL, covered, latest, covered, latest)
+    return sorted({(row.FuelTypeID, row.LocationType, row.LocationID) for row in cursor.fetchall()})
+
+
+def forecast_rows(stock, outflow, as_of, computed_at, through=0):
+    """SupplyForecasts rows for `stock` ([(key, CurrentStock)]) and its daily outflow,
+    stamped as reflecting the ledger up to TransactionID `through`."""
+    if not stock:
+        return []
+    keys = [key for key, _ in stock]
+    current = np.array([value for _, value in stock], dtype=np.float64)
+    rates = window_rates(keys, outflow, as_of)
+    rate = rates.max(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_supply = np.where(rate > 0, np.maximum(current, 0) / rate, np.nan)
+    reorder = np.maximum(rate * (FORECAST_LEAD_DAYS + FORECAST_COVER_DAYS) - current, 0)
+    rates, rate = rates.round(4), rate.round(4)
+    days_of_supply, reorder = days_of_supply.round(2), np.ceil(reorder * 100) / 100
+    return [
+        (*key, round(float(current[index]), 2), *(float(value) for value in rates[index]), float(rate[index]),
+         None if np.isnan(days_of_supply[index]) else float(days_of_supply[index]), float(reorder[index]),
+         as_of, computed_at, through)
+        for index, key in enumerate(keys)
+    ]
+
+
+def _insert(cursor, rows):
+    cursor.fast_executemany = True
+    for chunk in _chunks(rows):
+        cursor.executemany(INSERT_SQL, chunk)
+    return len(rows)
+
+
+def _rebuild(cursor, today):
+    """Replaces every row with forecasts for `today`; returns the number written."""
+    latest = _latest_transaction_id(cursor) # Before the reads, so later commits stay past the mark
+    stock = _fetch_stock(cursor)
+    rows = forecast_rows(stock, _fetch_outflow(cursor, today), today, datetime.now(), latest)
+    cursor.execute("DELETE FROM SupplyForecasts")
+    return _insert(cursor, rows)
+
+
+class SupplyForecaster:
+    """Keeps SupplyForecasts current: a rebuild per day plus the locations the ledger moved since."""
+
+    def __init__(self):
+        self._run_lock = threading.Lock()
+
+    def rebuild(self, conn, today=None):
+        """Recomputes every row for `today`; returns a report dict."""
+        today = today or date.today()
+        with self._run_lock:
+            started = time.perf_counter()
+            written = run_in_transaction(conn, lambda cursor: _rebuild(cursor, today))
+        return {"rebuilt": True, "asOfDate": today.isoformat(), "forecasts": written,
+                "elapsedSeconds": round(time.perf_counter() - started, 3)}
+
+    def refresh(self, conn, today=None):
+        """Rebuilds if the stored rows are from an earlier day, else recomputes the
+        locations of transactions past the stored ThroughTransactionID."""
+        today = today or date.today()
+        with self._run_lock:
+            started = time.perf_counter()
+
+            def work(cursor):
+                # Update locks make a concurrent refresh in another process wait for this one.
+                cursor.execute("SELECT TOP 1 AsOfDate FROM SupplyForecasts WITH (UPDLOCK, HOLDLOCK) "
+                               "ORDER BY AsOfDate")
+                oldest = cursor.fetchone()
+                if oldest is None or oldest.AsOfDate < today:
+                    return True, _rebuild(cursor, today)
+                cursor.execute("SELECT MAX(ThroughTransactionID) AS Covered FROM SupplyForecasts "
+                               "WITH (UPDLOCK, HOLDLOCK)")
+                covered = cursor.fetchone().Covered or 0
+                latest = _latest_transaction_id(cursor)
+                keys = _changed_keys(cursor, covered, latest) if latest > covered else []
+                if not keys:
+                    return False, 0
+                stock = _fetch_stock(cursor, keys)
+                rows = forecast_rows(stock, _fetch_outflow(cursor, today, keys), today, datetime.now(), latest)
+                for chunk in _chunks(keys):
+                    cursor.execute(f"DELETE FROM SupplyForecasts WHERE {_key_predicate(chunk)}",
+                                   *[value for key in chunk for value in key])
+                return False, _insert(cursor, rows)
+
+            rebuilt, written = run_in_transaction(conn, work)
+        return {"rebuilt": rebuilt, "asOfDate": today.isoformat(), "forecasts": written,
+                "elapsedSeconds": round(time.perf_counter() - started, 3)}
+
+
+def start_refresher(connect, check_every=FORECAST_REFRESH_SECONDS):
+    """Starts a daemon thread that refreshes the forecasts every `check_every` seconds.
+
+    `connect` is a context manager factory such as db.db_connection. Does
+    nothing when FORECAST_REFRESH_SECONDS is 0; the rows then change only on
+    a rebuild (POST /api/fuelinventory/lowstock/rebuild or the CLI).
+    """
+    if check_every <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                with connect() as conn:
+                    if conn is not None:
+                        forecaster.refresh(conn)
+            except Exception as ex:
+                print(f"Error refreshing supply forecasts: {ex}")
+            time.sleep(check_every)
+
+    thread = threading.Thread(target=run, name='supply-forecasts', daemon=True)
+    thread.start()
+    return thread
+
+
+forecaster = SupplyForecaster()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild days-of-supply and reorder forecasts.")
+    parser.add_argument('--low-stock', type=float, metavar='DAYS',
+                        help="Also print the locations with at most DAYS days of supply")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        result = forecaster.rebuild(conn)
+        if args.low_stock is not None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock, DailyOutflow, DaysOfSupply, "
+                           "ReorderQuantity FROM SupplyForecasts WHERE DaysOfSupply <= ? "
+                           "ORDER BY DaysOfSupply, FuelTypeID, LocationType, LocationID", args.low_stock)
+            result["lowStock"] = [
+                {"fuelTypeID": row.FuelTypeID, "locationType": row.LocationType, "locationID": row.LocationID,
+                 "currentStock": float(row.CurrentStock), "dailyOutflow": float(row.DailyOutflow),
+                 "daysOfSupply": float(row.DaysOfSupply), "reorderQuantity": float(row.ReorderQuantity)}
+                for row in cursor.fetchall()
+            ]
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
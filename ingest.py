@@ -0,0 +1,388 @@
+# Fuel Transaction Ingest (ingest.py)
+#
+# Validation and set-based write helpers for fuel movements. A batch of
+# movements is validated up front, inserted with one executemany() call and
+# its inventory effect is netted per (FuelTypeID, LocationType, LocationID)
+# and applied with a single multi-row MERGE, all inside one transaction.
+#
+# Single movements debit their source with one conditional, row-locked
+# UPDATE that returns the new balance, so two concurrent transfers can never
+# both pass the stock check. Inventory rows are always touched in key order
+# and deadlock victims are retried (db.run_in_transaction). Back-dated
+# movements also correct the inventory snapshots taken after them, and every
+# write keeps the weighted-average unit costs current (valuation.py).
+
+import os
+import uuid
+from datetime import datetime
+
+import pyodbc
+
+from db import run_in_transaction
+from locations import fuel_type_known, location_known
+from snapshots import adjust_snapshots
+from valuation import extra_cost, fetch_price, receive, revalue
+
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '10000'))
+
+# SQL Server accepts at most 2100 parameters per statement; stay well below it.
+ROWS_PER_STATEMENT = 500
+
+STOCKED_LOCATION_TYPES = ('Warehouse', 'Site') # Locations that hold inventory
+SOURCE_LOCATION_TYPES = ('Supplier',) + STOCKED_LOCATION_TYPES
+
+BATCH_MODES = ('atomic', 'partial')
+
+# Column limits of FuelTransactions: checked up front so a queued movement
+# cannot fail on them when the journal replays it.
+MAX_AMOUNT = 10 ** 16 # DECIMAL(18,2)
+MAX_TRANSACTION_TYPE_LENGTH = 50
+MAX_NOTES_LENGTH = 500
+COST_FIELDS = ('transportationCost', 'loadingUnloadingCost', 'otherCost')
+
+INSERT_TRANSACTION_SQL = (
+    "INSERT INTO FuelTransactions (UsageTransitionID, TransactionType, SourceLocationType, SourceLocationID, "
+    "DestinationLocationType, DestinationLocationID, FuelTypeID, Quantity, TransactionDate, FuelPriceID, "
+    "TransportationCost, LoadingUnloadingCost, OtherCost, Notes) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class MovementError(ValueError):
+    """Raised when a movement payload is incomplete or malformed (answered with a 400)."""
+
+
+class InsufficientStock(Exception):
+    """Raised when a source location cannot cover a movement; rolls the transaction back."""
+
+
+class Movement:
+    """One validated fuel movement, ready to insert."""
+
+    __slots__ = ('usage_transition_id', 'transaction_type', 'source_location_type', 'source_location_id',
+                 'destination_location_type', 'destination_location_id', 'fuel_type_id', 'quantity',
+                 'transaction_date', 'fuel_price_id', 'transportation_cost', 'loading_unloading_cost',
+                 'other_cost', 'notes')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @property
+    def source_key(self):
+        return (self.fuel_type_id, self.source_location_type, self.source_location_id)
+
+    @property
+    def destination_key(self):
+        return (self.fuel_type_id, self.destination_location_type, self.destination_location_id)
+
+    def insert_params(self):
+        return (self.usage_transition_id, self.transaction_type, self.source_location_type,
+                self.source_location_id, self.destination_location_type, self.destination_location_id,
+                self.fuel_type_id, self.quantity, self.transaction_date, self.fuel_price_id,
+                self.transportation_cost, self.loading_unloading_cost, self.other_cost, self.notes)
+
+
+def parse_movement(data):
+    """Validates one transaction payload (as posted by the frontend) into a Movement."""
+    if not isinstance(data, dict) or not data:
+        raise MovementError("Invalid JSON data")
+
+    required = [data.get('transactionType'), data.get('sourceLocationType'), data.get('sourceLocationID'),
+                data.get('destinationLocationType'), data.get('destinationLocationID'),
+                data.get('fuelTypeID'), data.get('quantity'), data.get('transactionDate')]
+    if not all(required):
+        raise MovementError("Missing required fields")
+
+    try:
+        quantity = float(data['quantity'])
+        transaction_date = datetime.strptime(data['transactionDate'], '%Y-%m-%dT%H:%M:%S.%fZ') # ISO format from JS
+    except (ValueError, TypeError):
+        raise MovementError("Invalid data types for quantity or transactionDate") from None
+
+    if quantity <= 0:
+        raise MovementError("Quantity must be positive")
+    if quantity >= MAX_AMOUNT:
+        raise MovementError("Quantity is too large")
+
+    costs = {}
+    for field in COST_FIELDS:
+        value = data.get(field, 0)
+        if value is not None:
+            try:
+                value = float(value)
+            except (ValueError, TypeError):
+                raise MovementError(f"Invalid data type for {field}") from None
+            if not 0 <= value < MAX_AMOUNT:
+                raise MovementError(f"{field} must be between 0 and {MAX_AMOUNT}")
+        costs[field] = value
+
+    transaction_type, notes = data['transactionType'], data.get('notes')
+    if not isinstance(transaction_type, str) or len(transaction_type) > MAX_TRANSACTION_TYPE_LENGTH:
+        raise MovementError(f"transactionType must be a string of at most {MAX_TRANSACTION_TYPE_LENGTH} characters")
+    if notes is not None and (not isinstance(notes, str) or len(notes) > MAX_NOTES_LENGTH):
+        raise MovementError(f"notes must be a string of at most {MAX_NOTES_LENGTH} characters")
+
+    source_type, destination_type = data['sourceLocationType'], data['destinationLocationType']
+    if source_type not in SOURCE_LOCATION_TYPES:
+        raise MovementError(f"sourceLocationType must be one of: {', '.join(SOURCE_LOCATION_TYPES)}")
+    if destination_type not in STOCKED_LOCATION_TYPES:
+        raise MovementError(f"destinationLocationType must be one of: {', '.join(STOCKED_LOCATION_TYPES)}")
+
+    try:
+        # Numeric IDs keep inventory keys comparable, which fixes the lock order.
+        fuel_type_id = int(data['fuelTypeID'])
+        source_location_id = int(data['sourceLocationID'])
+        destination_location_id = int(data['destinationLocationID'])
+        fuel_price_id = None if data.get('fuelPriceID') is None else int(data['fuelPriceID'])
+    except (ValueError, TypeError):
+        raise MovementError("Invalid data types for fuelTypeID, fuelPriceID or location IDs") from None
+
+    # False only when the master data says the ID does not exist; None (cannot tell) is accepted.
+    if fuel_type_known(fuel_type_id) is False:
+        raise MovementError(f"Unknown fuelTypeID: {fuel_type_id}")
+    if location_known(source_type, source_location_id) is False:
+        raise MovementError(f"Unknown sourceLocationID for {source_type}: {source_location_id}")
+    if location_known(destination_type, destination_location_id) is False:
+        raise MovementError(f"Unknown destinationLocationID for {destination_type}: {destination_location_id}")
+
+    return Movement(
+        usage_transition_id=f"TRANS-{uuid.uuid4()}",
+        transaction_type=transaction_type,
+        source_location_type=source_type,
+        source_location_id=source_location_id,
+        destination_location_type=destination_type,
+        destination_location_id=destination_location_id,
+        fuel_type_id=fuel_type_id,
+        quantity=quantity,
+        transaction_date=transaction_date,
+        fuel_price_id=fuel_price_id,
+        transportation_cost=costs['transportationCost'],
+        loading_unloading_cost=costs['loadingUnloadingCost'],
+        other_cost=costs['otherCost'],
+        notes=notes,
+    )
+
+
+def parse_batch(payload):
+    """Returns (items, mode) from a batch body.
+
+    The body is either a JSON array of transactions or an object
+    `{"mode": "atomic" | "partial", "transactions": [...]}`.
+    """
+    mode = 'atomic'
+    items = payload
+    if isinstance(payload, dict):
+        mode = payload.get('mode') or mode
+        items = payload.get('transactions')
+    if mode not in BATCH_MODES:
+        raise MovementError(f"mode must be one of: {', '.join(BATCH_MODES)}")
+    if not isinstance(items, list) or not items:
+        raise MovementError("Expected a non-empty array of transactions")
+    if len(items) > MAX_BATCH_SIZE:
+        raise MovementError(f"A batch may contain at most {MAX_BATCH_SIZE} transactions")
+    return items, mode
+
+
+def _chunks(items, size=ROWS_PER_STATEMENT):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_stock(cursor, keys):
+    """Returns {(FuelTypeID, LocationType, LocationID): CurrentStock} for `keys`.
+
+    Rows are read with UPDLOCK so the balances cannot change underneath the
+    caller before its transaction commits. Missing keys are left out.
+    """
+    stock = {}
+    for chunk in _chunks(sorted(keys)):
+        predicate = " OR ".join(["(FuelTypeID = ? AND LocationType = ? AND LocationID = ?)"] * len(chunk))
+        params = [value for key in chunk for value in key]
+        cursor.execute(
+            "SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory WITH (UPDLOCK, HOLDLOCK) "
+            f"WHERE {predicate}",
+            *params
+        )
+        for row in cursor.fetchall():
+            stock[(row.FuelTypeID, row.LocationType, row.LocationID)] = float(row.CurrentStock)
+    return stock
+
+
+def net_inventory_deltas(movements):
+    """Sums each movement's effect into {(FuelTypeID, LocationType, LocationID): delta}."""
+    deltas = {}
+    for movement in movements:
+        if movement.source_location_type in STOCKED_LOCATION_TYPES:
+            deltas[movement.source_key] = deltas.get(movement.source_key, 0.0) - movement.quantity
+        deltas[movement.destination_key] = deltas.get(movement.destination_key, 0.0) + movement.quantity
+    return deltas
+
+
+def apply_inventory_deltas(cursor, deltas):
+    """Applies netted deltas with one multi-row MERGE per ROWS_PER_STATEMENT keys.
+
+    Keys are processed in sorted order so concurrent batches lock inventory
+    rows in the same sequence.
+    """
+    rows = [(key[0], key[1], key[2], delta) for key, delta in sorted(deltas.items()) if delta]
+    for chunk in _chunks(rows):
+        values = ", ".join(["(?, ?, ?, ?)"] * len(chunk))
+        cursor.execute(
+            "MERGE FuelInventory AS target "
+            f"USING (VALUES {values}) AS source (FuelTypeID, LocationType, LocationID, Quantity) "
+            "ON (target.FuelTypeID = source.FuelTypeID AND target.LocationType = source.LocationType AND target.LocationID = source.LocationID) "
+            "WHEN MATCHED THEN "
+            "    UPDATE SET CurrentStock = target.CurrentStock + source.Quantity, LastUpdated = GETDATE() "
+            "WHEN NOT MATCHED THEN "
+            "    INSERT (FuelTypeID, LocationType, LocationID, CurrentStock, LastUpdated) VALUES (source.FuelTypeID, source.LocationType, source.LocationID, source.Quantity, GETDATE());",
+            *[value for row in chunk for value in row]
+        )
+
+
+def debit_stock(cursor, key, quantity):
+    """Takes `quantity` from one inventory row if it holds enough.
+
+    A single conditional UPDATE locks the row, checks and decrements it, so
+    no other transaction can slip in between check and write. Returns
+    (new balance, average unit cost), or None when the row is missing or short.
+    """
+    cursor.execute(
+        "UPDATE FuelInventory WITH (ROWLOCK) SET CurrentStock = CurrentStock - ?, LastUpdated = GETDATE() "
+        "OUTPUT inserted.CurrentStock, inserted.AverageUnitCost "
+        "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ? AND CurrentStock >= ?",
+        quantity, *key, quantity
+    )
+    row = cursor.fetchone()
+    return None if row is None else (float(row.CurrentStock), float(row.AverageUnitCost))
+
+
+def commit_movement(cursor, movement):
+    """Writes one movement: source debit, destination credit and the ledger row.
+
+    Source and destination rows are updated in key order so two transfers in
+    opposite directions cannot deadlock on each other. The destination's
+    average cost is updated last, on the row this transaction already locked.
+    Raises InsufficientStock (caller rolls back) when the source is short;
+    returns the new source balance, or None for supplier deliveries.
+    """
+    steps = [(movement.destination_key, movement.quantity)]
+    if movement.source_location_type in STOCKED_LOCATION_TYPES:
+        steps.append((movement.source_key, -movement.quantity))
+    balance = unit_cost = None
+    for key, delta in sorted(steps):
+        if delta < 0:
+            debited = debit_stock(cursor, key, -delta)
+            if debited is None:
+                raise InsufficientStock(key)
+            balance, unit_cost = debited # Transfers move fuel at the source's average cost
+        else:
+            apply_inventory_deltas(cursor, {key: delta})
+    if movement.source_location_type not in STOCKED_LOCATION_TYPES:
+        unit_cost = fetch_price(cursor, movement.fuel_price_id)
+    receive(cursor, movement.destination_key, movement.quantity, unit_cost, extra_cost(movement))
+    cursor.execute(INSERT_TRANSACTION_SQL, *movement.insert_params())
+    adjust_snapshots(cursor, [movement])
+    return balance
+
+
+def add_movement(conn, movement):
+    """Commits one movement in its own transaction, retrying deadlock victims."""
+    return run_in_transaction(conn, lambda cursor: commit_movement(cursor, movement))
+
+
+def insert_movements(cursor, movements):
+    """Inserts all movements with one array-bound executemany()."""
+    cursor.fast_executemany = True
+    cursor.executemany(INSERT_TRANSACTION_SQL, [movement.insert_params() for movement in movements])
+
+
+def ingest_batch(conn, items, mode, resolve_price=None):
+    """Validates and writes a batch of transaction payloads in one transaction.
+
+    Every item is validated first (payload shape, then source stock, replayed
+    in order against the current balances so earlier items in the batch can
+    supply later ones). In 'atomic' mode any rejected item aborts the whole
+    batch; in 'partial' mode rejected items are skipped and the rest are
+    written. Returns (accepted, errors) where accepted is a list of
+    (index, Movement) and errors a list of {"index", "error"} dicts. Nothing
+    is written when errors is non-empty in atomic mode.
+
+    `resolve_price(movement, cursor)`, if given, supplies the FuelPriceID of
+    movements that arrive without one.
+    """
+    errors = []
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_movement(item)))
+        except MovementError as ex:
+            errors.append({"index": index, "error": str(ex)})
+    if errors and mode == 'atomic':
+        return [], errors
+
+    accepted, rejected = write_movements(conn, parsed, mode, resolve_price)
+    errors.extend(rejected)
+    errors.sort(key=lambda error: error["index"])
+    return accepted, errors
+
+
+def write_movements(conn, parsed, mode, resolve_price=None):
+    """Stock-checks and writes parsed (index, Movement) pairs in one transaction.
+
+    The write half of ingest_batch (also used to replay the ingest journal).
+    Returns (accepted, rejected) with rejected as {"index", "error"} dicts.
+    In 'partial' mode a batch that breaks a database constraint is written
+    again one movement per transaction, so only the offending items are
+    rejected.
+    """
+    if resolve_price is not None:
+        cursor = conn.cursor()
+        for _, movement in parsed:
+            if movement.fuel_price_id is None:
+                movement.fuel_price_id = resolve_price(movement, cursor)
+
+    sources = {m.source_key for _, m in parsed if m.source_location_type in STOCKED_LOCATION_TYPES}
+
+    def write(cursor):
+        balances = fetch_stock(cursor, sources)
+        accepted, rejected = [], []
+        for index, movement in parsed:
+            if movement.source_location_type in STOCKED_LOCATION_TYPES:
+                available = balances.get(movement.source_key)
+                if available is None or available < movement.quantity:
+                    rejected.append({"index": index, "error": "Insufficient stock at source location"})
+                    continue
+                balances[movement.source_key] = available - movement.quantity
+            if movement.destination_key in balances:
+                balances[movement.destination_key] += movement.quantity
+            elif movement.destination_key in sources:
+                balances[movement.destination_key] = movement.quantity
+            accepted.append((index, movement))
+
+        if (rejected and mode == 'atomic') or not accepted:
+            return [], rejected # Nothing written; committing just releases the row locks
+        movements = [movement for _, movement in accepted]
+        insert_movements(cursor, movements)
+        deltas = net_inventory_deltas(movements)
+        apply_inventory_deltas(cursor, deltas)
+        revalue(cursor, movements, deltas)
+        adjust_snapshots(cursor, movements)
+        return accepted, rejected
+
+    try:
+        return run_in_transaction(conn, write)
+    except pyodbc.IntegrityError:
+        if mode != 'partial' or len(parsed) == 1:
+            raise
+
+    accepted, rejected = [], []
+    for index, movement in parsed:
+        try:
+            written, failed = write_movements(conn, [(index, movement)], mode)
+        except pyodbc.IntegrityError as ex:
+            print(f"Fuel transaction {index} rejected by the database: {ex}")
+            written, failed = [], [{"index": index, "error": "Violates a database constraint"}]
+        accepted.extend(written)
+        rejected.extend(failed)
+    return accepted, rejected
@@ -0,0 +1,401 @@
+# Write-Behind Ingest Journal (journal.py)
+#
+# In accept-and-queue mode POST /api/fueltransactions only validates the
+# movement, appends it to a local append-only journal and answers 202 with
+# its UsageTransitionID. A background worker writes journaled movements to
+# the database in batches, so field sites on poor links get a quick answer
+# and keep working while the database is slow or unreachable.
+#
+# Appends are group-committed: a flusher thread writes everything queued
+# within INGEST_JOURNAL_SYNC_MS with one write and one fsync, and a request
+# returns once its record is on disk. The worker's position is kept in a
+# checkpoint file next to the journal. Replay is idempotent: records whose
+# UsageTransitionID is already in FuelTransactions are skipped, so a crash
+# between a database commit and the checkpoint write cannot post twice.
+# Records the database rejects (e.g. insufficient stock at replay time) are
+# moved to a .rejected file. So are records that break a constraint or do
+# not fit a column: a batch failing that way is split in halves until the
+# offending record is alone, so one bad record cannot hold up the queue
+# behind it. A fully applied journal is truncated once it grows past
+# INGEST_JOURNAL_COMPACT_BYTES.
+#
+# Offsets are only meaningful to the process that appends, so one process
+# owns a journal: start() takes an exclusive lock on <journal>.lock and
+# holds it until exit, and a second process pointed at the same path
+# answers 503 instead of queueing. Give each server process its own
+# INGEST_JOURNAL.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pyodbc
+
+from ingest import MovementError, parse_movement, write_movements
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+INGEST_JOURNAL = os.getenv('INGEST_JOURNAL', 'ingest_journal.jsonl')
+INGEST_WRITE_BEHIND = os.getenv('INGEST_WRITE_BEHIND', '0') not in ('0', 'false') # Queue every POST, not only on request
+INGEST_JOURNAL_SYNC_MS = float(os.getenv('INGEST_JOURNAL_SYNC_MS', '5'))     # Group-commit window
+INGEST_JOURNAL_BATCH = int(os.getenv('INGEST_JOURNAL_BATCH', '500'))         # Movements per database transaction
+INGEST_JOURNAL_RETRY = float(os.getenv('INGEST_JOURNAL_RETRY', '2'))         # Seconds between attempts after a failure
+INGEST_JOURNAL_COMPACT_BYTES = int(os.getenv('INGEST_JOURNAL_COMPACT_BYTES', str(64 * 1024 * 1024)))
+
+ROWS_PER_STATEMENT = 500
+
+# Failures caused by a record rather than by the database being unavailable
+RECORD_ERRORS = (pyodbc.IntegrityError, pyodbc.DataError)
+
+
+class JournalUnavailable(Exception):
+    """Raised when a record could not be made durable (answered with a 503)."""
+
+
+class _DatabaseUnavailable(Exception):
+    pass
+
+
+class _Batch:
+    """Records waiting for one write + fsync; requests wait on `done`."""
+
+    __slots__ = ('lines', 'done', 'error')
+
+    def __init__(self):
+        self.lines = []
+        self.done = threading.Event()
+        self.error = None
+
+
+def _lock_exclusively(file):
+    """Takes a non-blocking exclusive lock on an open file; False if another process holds it."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def existing_transition_ids(cursor, ids):
+    """The subset of `ids` already present in FuelTransactions (seeks its UNIQUE index)."""
+    found = set()
+    ids = list(ids)
+    for start in range(0, len(ids), ROWS_PER_STATEMENT):
+        chunk = ids[start:start + ROWS_PER_STATEMENT]
+        cursor.execute("SELECT UsageTransitionID FROM FuelTransactions WHERE UsageTransitionID IN ("
+                       + ", ".join(["?"] * len(chunk)) + ")", *chunk)
+        found.update(row.UsageTransitionID for row in cursor.fetchall())
+    return found
+
+
+class IngestJournal:
+    """Durable local queue of accepted movements plus the worker that drains it."""
+
+    def __init__(self, path=INGEST_JOURNAL, batch_size=INGEST_JOURNAL_BATCH,
+                 sync_window=INGEST_JOURNAL_SYNC_MS / 1000, retry_after=INGEST_JOURNAL_RETRY,
+                 compact_bytes=INGEST_JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.checkpoint_path = path + '.pos'
+        self.rejected_path = path + '.rejected'
+        self.lock_path = path + '.lock'
+        self.batch_size = batch_size
+        self.sync_window = sync_window
+        self.retry_after = retry_after
+        self.compact_bytes = compact_bytes
+
+        self._connect = None
+        self._resolve_price = None
+        self._on_commit = None
+
+        self._cond = threading.Condition()
+        self._lock_file = None    # Held open (and locked) for the life of the process
+        self._file = None
+        self._open_batch = None   # Batch still collecting records
+        self._flushing = False
+        self._durable_end = 0     # File offset up to which records are fsynced
+        self._applied = 0         # File offset up to which records are in the database
+        self._pending = deque()   # (end offset, accepted at) of durable records not yet applied
+        self._started = False
+        self._threads = []
+
+        # Counters reported by stats()
+        self._accepted = 0
+        self._applied_count = 0
+        self._duplicates = 0
+        self._rejected = 0
+        self._last_error = None
+        self._last_applied_at = None
+
+    def configure(self, connect, resolve_price=None, on_commit=None):
+        """Sets how the worker writes: `connect` is a context manager factory such as
+        db.db_connection, `resolve_price(movement, cursor)` fills missing FuelPriceIDs
+        and `on_commit(conn, movements)` runs after each committed batch."""
+        self._connect = connect
+        self._resolve_price = resolve_price
+        self._on_commit = on_commit
+
+    # --- Startup ---
+
+    def start(self):
+        """Locks and recovers the journal and starts the flusher and worker threads (idempotent).
+
+        Raises JournalUnavailable if another process holds the journal.
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._acquire()
+            self._recover()
+            self._started = True
+            self._threads = [
+                threading.Thread(target=self._flush_loop, name='ingest-journal-flush', daemon=True),
+                threading.Thread(target=self._apply_loop, name='ingest-journal-apply', daemon=True),
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def _acquire(self):
+        if self._lock_file is not None:
+            return
+        lock_file = open(self.lock_path, 'a+b')
+        if not _lock_exclusively(lock_file):
+            lock_file.close()
+            raise JournalUnavailable(f"{self.path} is in use by another process")
+        self._lock_file = lock_file
+
+    def _recover(self):
+        """Drops a torn final record and queues every record after the checkpoint."""
+        self._file = open(self.path, 'a+b')
+        applied = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as checkpoint:
+                applied = int(checkpoint.read() or 0)
+        if applied > os.path.getsize(self.path):
+            applied = 0 # Journal replaced behind our back; replay is idempotent
+        position = applied
+        with open(self.path, 'rb') as journal:
+            journal.seek(applied)
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    break # Torn write from a crash: never acknowledged, safe to drop
+                position += len(line)
+                try:
+                    accepted_at = json.loads(line)['acceptedAt']
+                except (ValueError, KeyError):
+                    accepted_at = time.time() # The worker moves it to the rejected file
+                self._pending.append((position, accepted_at))
+        self._file.truncate(position)
+        self._applied = applied
+        self._durable_end = position
+
+    # --- Accepting ---
+
+    def enqueue(self, movement, payload):
+        """Journals a validated movement and returns once it is on disk."""
+        try:
+            self.start()
+        except OSError as ex:
+            raise JournalUnavailable(str(ex)) from None
+        line = json.dumps({"id": movement.usage_transition_id, "acceptedAt": time.time(), "payload": payload},
+                          separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+        with self._cond:
+            if self._open_batch is None:
+                self._open_batch = _Batch()
+                self._cond.notify_all()
+            batch = self._open_batch
+            batch.lines.append(line)
+        batch.done.wait()
+        if batch.error is not None:
+            raise JournalUnavailable(batch.error)
+        with self._cond:
+            self._accepted += 1
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._open_batch is None:
+                    self._cond.wait()
+            if self.sync_window:
+                time.sleep(self.sync_window) # Let concurrent requests join this fsync
+            with self._cond:
+                batch, self._open_batch = self._open_batch, None
+                self._flushing = True
+                start = self._durable_end
+            try:
+                self._file.write(b''.join(batch.lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as ex:
+                print(f"Error writing ingest journal: {ex}")
+                batch.error = str(ex)
+                try:
+                    self._file.truncate(start)
+                except OSError:
+                    pass
+            with self._cond:
+                if batch.error is None:
+                    now = time.time()
+                    for line in batch.lines:
+                        start += len(line)
+                        self._pending.append((start, now))
+                    self._durable_end = start
+                self._flushing = False
+                self._cond.notify_all()
+            batch.done.set()
+
+    # --- Draining ---
+
+    def _apply_loop(self):
+        while True:
+            with self._cond:
+                while self._applied >= self._durable_end:
+                    self._cond.wait()
+                start, end = self._applied, self._durable_end
+            try:
+                lines, next_offset = self._read(start, end)
+                self._apply(lines)
+                self._save_checkpoint(next_offset) # Failing here only replays the batch, which is idempotent
+            except Exception as ex: # Database down, pool exhausted, deadlock retries used up, disk full...
+                print(f"Error applying ingest journal: {ex}")
+                with self._cond:
+                    self._last_error = str(ex)
+                time.sleep(self.retry_after)
+                continue
+            with self._cond:
+                self._applied = next_offset
+                while self._pending and self._pending[0][0] <= next_offset:
+                    self._pending.popleft()
+                self._last_error = None
+                self._last_applied_at = datetime.now().isoformat(timespec='seconds')
+                try:
+                    self._compact()
+                except OSError as ex: # Retried after the next batch
+                    print(f"Error compacting ingest journal: {ex}")
+                    self._last_error = str(ex)
+
+    def _read(self, start, end):
+        """Up to batch_size complete records from [start, end); returns (lines, next offset)."""
+        lines = []
+        with open(self.path, 'rb') as journal:
+            journal.seek(start)
+            position = start
+            while position < end and len(lines) < self.batch_size:
+                line = journal.readline()
+                position += len(line)
+                lines.append(line)
+        return lines, position
+
+    def _apply(self, lines):
+        parsed, invalid = [], []
+        for index, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+                movement = parse_movement(record['payload'])
+                movement.usage_transition_id = record['id']
+            except (ValueError, KeyError, TypeError, MovementError) as ex:
+                invalid.append({"index": index, "error": str(ex)})
+                continue
+            parsed.append((index, movement))
+
+        if self._connect is None:
+            raise _DatabaseUnavailable("Ingest journal is not configured with a database connection")
+        with self._connect() as conn:
+            if conn is None:
+                raise _DatabaseUnavailable("Database connection failed")
+            existing = existing_transition_ids(conn.cursor(), [movement.usage_transition_id for _, movement in parsed])
+            fresh = [(index, movement) for index, movement in parsed if movement.usage_transition_id not in existing]
+            accepted, rejected = self._write(conn, fresh) if fresh else ([], [])
+            late_duplicates = 0
+            if rejected:
+                # A record written by someone else since the check above breaks the UNIQUE
+                # constraint on UsageTransitionID: it is applied, not rejected.
+                ids = {index: movement.usage_transition_id for index, movement in fresh}
+                applied = existing_transition_ids(conn.cursor(), [ids[error["index"]] for error in rejected])
+                kept = [error for error in rejected if ids[error["index"]] not in applied]
+                late_duplicates, rejected = len(rejected) - len(kept), kept
+            if accepted and self._on_commit is not None:
+                try:
+                    self._on_commit(conn, [movement for _, movement in accepted])
+                except Exception as ex: # Committed already; replaying would only skip the batch
+                    print(f"Error after applying journaled movements: {ex}")
+
+        rejected = invalid + rejected
+        if rejected:
+            self._reject([(lines[error["index"]], error["error"]) for error in rejected])
+        with self._cond:
+            self._applied_count += len(accepted)
+            self._duplicates += len(parsed) - len(fresh) + late_duplicates
+            self._rejected += len(rejected)
+
+    def _write(self, conn, parsed):
+        """write_movements in partial mode, splitting a batch the database refuses
+        until each offending record is rejected on its own."""
+        try:
+            return write_movements(conn, parsed, 'partial', self._resolve_price)
+        except RECORD_ERRORS as ex:
+            if len(parsed) == 1:
+                print(f"Journaled fuel transaction {parsed[0][1].usage_transition_id} rejected by the database: {ex}")
+                return [], [{"index": parsed[0][0], "error": f"Rejected by the database: {ex}"}]
+        middle = len(parsed) // 2
+        accepted, rejected = self._write(conn, parsed[:middle])
+        more_accepted, more_rejected = self._write(conn, parsed[middle:])
+        return accepted + more_accepted, rejected + more_rejected
+
+    def _reject(self, entries):
+        with open(self.rejected_path, 'ab') as rejected:
+            for line, error in entries:
+                rejected.write(json.dumps({"record": line.decode('utf-8', 'replace').rstrip('\n'), "error": error,
+                                           "rejectedAt": time.time()}, separators=(',', ':')).encode('utf-8') + b'\n')
+            rejected.flush()
+            os.fsync(rejected.fileno())
+
+    def _save_checkpoint(self, offset):
+        temporary = f'{self.checkpoint_path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as checkpoint:
+            checkpoint.write(str(offset).encode('ascii'))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def _compact(self):
+        """Truncates a fully applied journal (caller holds the lock)."""
+        if (self._applied < self.compact_bytes or self._applied != self._durable_end
+                or self._open_batch is not None or self._flushing):
+            return
+        # Checkpoint first: a crash in between only replays records the database already has.
+        self._save_checkpoint(0)
+        self._file.truncate(0)
+        self._applied = self._durable_end = 0
+
+    # --- Monitoring ---
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self._started and all(thread.is_alive() for thread in self._threads),
+                "depth": len(self._pending),
+                "lagSeconds": round(time.time() - self._pending[0][1], 3) if self._pending else 0.0,
+                "journalBytes": self._durable_end,
+                "appliedBytes": self._applied,
+                "accepted": self._accepted,
+                "applied": self._applied_count,
+                "duplicatesSkipped": self._duplicates,
+                "rejected": self._rejected,
+                "lastError": self._last_error,
+                "lastAppliedAt": self._last_applied_at,
+            }
+
+
+# Process-wide journal used by POST /api/fueltransactions
+ingest_journal = IngestJournal()
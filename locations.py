@@ -0,0 +1,158 @@
+# Location Lookups (locations.py)
+#
+# Small in-memory dictionaries derived from the cached master data, so
+# request handlers can resolve a location's township or name and a fuel
+# type's name without a query. The list endpoints use them to select lean
+# rows keyed by IDs instead of joining Suppliers, Warehouses and Sites on
+# the polymorphic location columns.
+#
+# Each dictionary is rebuilt whenever one of the underlying cache entries
+# changes version (checked at most every LOOKUP_CHECK_SECONDS). An ID that
+# is not in the dictionary reloads its master list, at most once per
+# LOOKUP_MISS_REFRESH seconds, so rows created after the last reload still
+# resolve.
+#
+# location_known() and fuel_type_known() let the ingest path refuse IDs
+# that do not exist. They answer None when the cache cannot tell (never
+# loaded, or a reload was just spent on another miss); callers then accept
+# the ID as before.
+
+import os
+import threading
+import time
+
+from cache import MasterDataUnavailable, master_data
+
+LOOKUP_CHECK_SECONDS = 1.0 # How often a lookup compares its cache versions
+LOOKUP_MISS_REFRESH = float(os.getenv('LOOKUP_MISS_REFRESH', '30'))
+
+# LocationType -> (master-data list, ID field, name field)
+LOCATION_LISTS = {
+    'Supplier': ('suppliers', 'supplierID', 'supplierName'),
+    'Warehouse': ('warehouses', 'warehouseID', 'warehouseName'),
+    'Site': ('sites', 'siteID', 'siteName'),
+}
+
+
+class DerivedLookup:
+    """A dictionary built from cached master-data lists, rebuilt when their versions change."""
+
+    def __init__(self, names, build):
+        self.names = names
+        self._build = build
+        self._lock = threading.Lock()
+        self._built_for = None   # Versions of `names` the dictionary reflects
+        self._check_after = 0.0
+        self._value = {}
+
+    def get(self):
+        if time.monotonic() < self._check_after:
+            return self._value
+        try:
+            entries = [master_data.get(name) for name in self.names]
+        except MasterDataUnavailable:
+            return self._value # Keep answering from the last build
+        stamp = tuple(entry.version for entry in entries)
+        if stamp != self._built_for:
+            with self._lock:
+                if stamp != self._built_for:
+                    self._value = self._build(*entries)
+                    self._built_for = stamp
+        self._check_after = time.monotonic() + LOOKUP_CHECK_SECONDS
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._built_for is not None
+
+    def expire(self):
+        self._check_after = 0.0
+
+
+def _build_townships(sites, warehouses):
+    site_townships = {site["siteID"]: site["townshipID"] for site in sites.rows}
+    townships = {('Site', site_id): township_id for site_id, township_id in site_townships.items()}
+    for warehouse in warehouses.rows:
+        # WH4 warehouses belong to a site and may only carry the site's township.
+        township_id = warehouse["townshipID"] or site_townships.get(warehouse["siteID"])
+        townships[('Warehouse', warehouse["warehouseID"])] = township_id
+    return townships
+
+
+def _build_location_names(*entries):
+    names = {}
+    for (location_type, (_, id_field, name_field)), entry in zip(LOCATION_LISTS.items(), entries):
+        for row in entry.rows:
+            names[(location_type, row[id_field])] = row[name_field]
+    return names
+
+
+def _build_fuel_type_names(fuel_types):
+    return {row["fuelTypeID"]: row["fuelTypeName"] for row in fuel_types.rows}
+
+
+_townships = DerivedLookup(('sites', 'warehouses'), _build_townships)
+_location_names = DerivedLookup(tuple(names for names, _, _ in LOCATION_LISTS.values()), _build_location_names)
+_fuel_type_names = DerivedLookup(('fuelTypes',), _build_fuel_type_names)
+
+_miss_lock = threading.Lock()
+_last_miss_refresh = {} # master-data list -> monotonic time of the last reload caused by a miss
+
+
+def _refresh_after_miss(name, lookup):
+    """Reloads `name` for an unknown ID unless that happened recently; True if it did."""
+    now = time.monotonic()
+    with _miss_lock:
+        if now - _last_miss_refresh.get(name, float('-inf')) < LOOKUP_MISS_REFRESH:
+            return False
+        _last_miss_refresh[name] = now
+    master_data.invalidate(name)
+    lookup.expire()
+    return True
+
+
+def township_of(location_type, location_id):
+    """Returns the TownshipID of a Site or Warehouse, or None if unknown."""
+    if location_type not in ('Site', 'Warehouse'):
+        return None
+    return _townships.get().get((location_type, location_id))
+
+
+def location_name(location_type, location_id):
+    """Returns the name of a Supplier, Warehouse or Site, or None if unknown."""
+    key = (location_type, location_id)
+    name = _location_names.get().get(key)
+    if name is None and location_type in LOCATION_LISTS:
+        if _refresh_after_miss(LOCATION_LISTS[location_type][0], _location_names):
+            name = _location_names.get().get(key)
+    return name
+
+
+def _known(lookup, key, name):
+    if key in lookup.get():
+        return True
+    if not _refresh_after_miss(name, lookup):
+        return None
+    if key in lookup.get():
+        return True
+    return False if lookup.loaded else None
+
+
+def location_known(location_type, location_id):
+    """Whether a Supplier, Warehouse or Site exists: True, False, or None if the cache cannot tell."""
+    if location_type not in LOCATION_LISTS:
+        return False
+    return _known(_location_names, (location_type, location_id), LOCATION_LISTS[location_type][0])
+
+
+def fuel_type_known(fuel_type_id):
+    """Whether a fuel type exists: True, False, or None if the cache cannot tell."""
+    return _known(_fuel_type_names, fuel_type_id, 'fuelTypes')
+
+
+def fuel_type_name(fuel_type_id):
+    """Returns the name of a fuel type, or None if unknown."""
+    name = _fuel_type_names.get().get(fuel_type_id)
+    if name is None and _refresh_after_miss('fuelTypes', _fuel_type_names):
+        name = _fuel_type_names.get().get(fuel_type_id)
+    return name
@@ -0,0 +1,393 @@
+# Request and Database Metrics (metrics.py)
+#
+# Counters, gauges and histograms exposed at /metrics in the Prometheus text
+# format: request counts and latency per route and status, requests in
+# flight, connection open time, per-statement execution and fetch time,
+# rows fetched and JSON serialization time.
+#
+# Recording is cheap enough to leave on in production: every thread writes
+# to its own shard (a plain dict), so the hot path takes no lock. A scrape
+# sums the shards; shards of finished threads are folded into a retired
+# total so per-request threads do not accumulate. The same folding also
+# runs when a new shard is registered and the list has doubled since the
+# last sweep, so shards stay bounded even if nothing scrapes /metrics.
+# METRICS_ENABLED=0 turns the instrumentation off entirely.
+#
+# The same cursor wrapper feeds the current request's trace (tracing.py),
+# which drives the Server-Timing header and the slow-query log.
+
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+from tracing import current_trace
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') not in ('0', 'false')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# --- Per-thread shards ---
+
+_local = threading.local()
+_shards = []          # (thread, shard dict) of every thread that recorded something
+_retired = {}         # Totals of shards whose thread has finished
+_shards_lock = threading.Lock()
+
+SHARD_SWEEP_MIN = 64  # Registrations before the first sweep of finished threads
+_sweep_at = SHARD_SWEEP_MIN
+
+
+def _shard():
+    global _sweep_at
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), shard))
+            if len(_shards) >= _sweep_at:
+                _retire_finished()
+                _sweep_at = max(SHARD_SWEEP_MIN, 2 * len(_shards))
+    return shard
+
+
+def _merge_into(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        if current is None:
+            totals[key] = list(value)
+        else:
+            for position, amount in enumerate(value):
+                current[position] += amount
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _retire_finished():
+    """Folds the shards of finished threads into _retired (caller holds _shards_lock)."""
+    live = []
+    for thread, shard in _shards:
+        if thread.is_alive():
+            live.append((thread, shard))
+        else:
+            for key, value in list(shard.items()):
+                _merge_into(_retired, key, value)
+    _shards[:] = live
+
+
+def _collect():
+    """Sums every shard into {(metric name, labels): value}."""
+    with _shards_lock:
+        _retire_finished()
+        live = list(_shards)
+        totals = {key: list(value) if isinstance(value, list) else value for key, value in _retired.items()}
+    for _, shard in live:
+        for key, value in list(shard.items()): # list() copies atomically under the GIL
+            _merge_into(totals, key, list(value) if isinstance(value, list) else value)
+    return totals
+
+
+# --- Metric types ---
+
+_metrics = []
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        _metrics.append(self)
+
+    def inc(self, labels=(), amount=1):
+        shard = _shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Up/down gauge; per-thread increments and decrements sum to the level."""
+
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        _metrics.append(self)
+
+    def observe(self, value, labels=()):
+        shard = _shard()
+        key = (self.name, labels)
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0] * (len(self.buckets) + 3) # per bucket, +Inf, sum, count
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+
+class CallbackGauge:
+    """Gauge read at scrape time from `callback() -> {labels: value}`."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames, callback):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.callback = callback
+        _metrics.append(self)
+
+
+HTTP_REQUESTS = Counter('http_requests_total', "HTTP requests served.", ('method', 'route', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', "Time from request start to response close.",
+                         ('method', 'route', 'status'))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', "Requests currently being handled.", ('route',))
+SERIALIZATION = Histogram('http_json_serialization_seconds', "Time spent encoding JSON responses.", ('route',))
+DB_CONNECT = Histogram('db_connect_duration_seconds', "Time to open a new database connection.")
+DB_EXECUTE = Histogram('db_query_duration_seconds', "Statement execution time.", ('statement',))
+DB_FETCH = Histogram('db_fetch_duration_seconds', "Time spent fetching result rows.", ('statement',))
+DB_ROWS = Counter('db_rows_fetched_total', "Result rows fetched.", ('statement',))
+HTTP_OVER_BUDGET = Counter('http_requests_over_query_budget_total',
+                           "Requests that ran more statements than QUERY_BUDGET.", ('route',))
+
+
+# --- Exposition ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    totals = _collect()
+    by_metric = {}
+    for (name, labels), value in totals.items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if isinstance(metric, CallbackGauge):
+            samples = sorted(metric.callback().items())
+        else:
+            samples = sorted(by_metric.get(metric.name, []))
+        for labels, value in samples:
+            if metric.kind != 'histogram':
+                lines.append(f"{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(value[-2])}")
+            lines.append(f"{metric.name}_count{_labels(metric.labelnames, labels)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Database instrumentation ---
+
+_STATEMENT = re.compile(
+    r'^\s*(?:(SELECT)\b.*?\bFROM\s+(\w+)|(INSERT)\s+INTO\s+(\w+)|(UPDATE)\s+(\w+)|(DELETE)\s+FROM\s+(\w+)'
+    r'|(MERGE)\s+(?:INTO\s+)?(\w+)|(SELECT))',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    """Low-cardinality label for a statement, e.g. 'select FuelTransactions'."""
+    match = _STATEMENT.match(sql)
+    if match is None:
+        return 'other'
+    parts = [part for part in match.groups() if part]
+    return ' '.join([parts[0].lower()] + parts[1:])
+
+
+class InstrumentedCursor:
+    """Cursor wrapper timing execute and fetch calls per statement."""
+
+    __slots__ = ('_cursor', '_statement', '_record')
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_statement', 'other')
+        object.__setattr__(self, '_record', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def _timed_execute(self, method, sql, args, param_count):
+        statement = statement_label(sql)
+        trace = current_trace()
+        record = trace.query(sql, param_count) if trace is not None else None
+        object.__setattr__(self, '_statement', statement)
+        object.__setattr__(self, '_record', record)
+        started = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_EXECUTE.observe(elapsed, (statement,))
+            if record is not None:
+                record.execute_seconds = elapsed
+        return self
+
+    def execute(self, sql, *params):
+        return self._timed_execute(self._cursor.execute, sql, params, len(params))
+
+    def executemany(self, sql, seq_of_params):
+        return self._timed_execute(self._cursor.executemany, sql, (seq_of_params,),
+                                   len(seq_of_params) if hasattr(seq_of_params, '__len__') else 0)
+
+    def _timed_fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        elapsed = time.perf_counter() - started
+        statement = (self._statement,)
+        DB_FETCH.observe(elapsed, statement)
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        if rows:
+            DB_ROWS.inc(statement, rows)
+        record = self._record
+        if record is not None:
+            record.fetch_seconds += elapsed
+            record.rows += rows
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+    def fetchval(self):
+        return self._timed_fetch(self._cursor.fetchval)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class InstrumentedConnection:
+    """Connection wrapper handing out InstrumentedCursors; everything else passes through."""
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor())
+
+
+def instrumented_connect(connect):
+    """Wraps a connect callable so it records open time and returns instrumented connections."""
+    if not METRICS_ENABLED:
+        return connect
+
+    def open_connection():
+        started = time.perf_counter()
+        conn = connect()
+        elapsed = time.perf_counter() - started
+        DB_CONNECT.observe(elapsed)
+        trace = current_trace()
+        if trace is not None:
+            trace.add('connect', elapsed)
+        return InstrumentedConnection(conn)
+    return open_connection
+
+
+# --- Flask instrumentation ---
+
+def _route():
+    from flask import has_request_context, request
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def record_serialization(elapsed):
+    """Records time spent encoding a response body (JSON provider or serialize.py)."""
+    if not METRICS_ENABLED:
+        return
+    SERIALIZATION.observe(elapsed, (_route(),))
+    trace = current_trace()
+    if trace is not None:
+        trace.add('json', elapsed)
+
+
+def instrument_app(app):
+    """Records request counts, latency, in-flight requests and JSON encoding time."""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().dumps(obj, **kwargs)
+            finally:
+                record_serialization(time.perf_counter() - started)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = _route()
+        HTTP_IN_FLIGHT.inc((g.metrics_route,))
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        labels = (request.method, g.metrics_route, str(response.status_code))
+        trace = current_trace()
+
+        def finish():
+            # Runs when the response is closed, so streamed bodies are included.
+            HTTP_LATENCY.observe(time.perf_counter() - started, labels)
+            HTTP_REQUESTS.inc(labels)
+            HTTP_IN_FLIGHT.dec((labels[1],))
+            if trace is not None and trace.over_budget():
+                HTTP_OVER_BUDGET.inc((labels[1],))
+        response.call_on_close(finish)
+        return response
@@ -0,0 +1,160 @@
+# Keyset Pagination Helpers (paging.py)
+#
+# List endpoints return one page at a time, ordered by an indexed key, and
+# hand the client an opaque cursor for the next page. Seeking past the last
+# key (instead of OFFSET n) keeps every page as cheap as the first one.
+
+import base64
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request
+
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', '500'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '5000'))
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class QueryParamError(ValueError):
+    """Raised for malformed paging or filter query parameters (answered with a 400)."""
+
+
+def encode_cursor(values):
+    """Encodes the key of the last returned row as an opaque, URL-safe token."""
+    plain = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    raw = json.dumps(plain, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Decodes a cursor produced by encode_cursor(); returns a list of `size` values."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise QueryParamError("Invalid cursor") from None
+    if not isinstance(values, list) or len(values) != size:
+        raise QueryParamError("Invalid cursor")
+    return values
+
+
+def parse_limit(args):
+    """Reads `limit` from the query string, defaulting to DEFAULT_PAGE_SIZE."""
+    raw = args.get('limit')
+    if raw in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise QueryParamError("limit must be an integer") from None
+    if limit < 1:
+        raise QueryParamError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_int(args, name):
+    raw = args.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise QueryParamError(f"{name} must be an integer") from None
+
+
+def parse_float(args, name):
+    raw = args.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        raise QueryParamError(f"{name} must be a number") from None
+
+
+def parse_datetime(raw, name):
+    """Parses 'YYYY-MM-DD' or an ISO timestamp ('Z' suffix allowed)."""
+    try:
+        if len(raw) == 10:
+            return datetime.strptime(raw, '%Y-%m-%d')
+        return datetime.fromisoformat(raw.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        raise QueryParamError(f"{name} must be a date (YYYY-MM-DD) or ISO timestamp") from None
+
+
+def parse_date_range(args, dates_only=False):
+    """Returns (start, end) from `from`/`to`; `end` is exclusive.
+
+    A date-only `to` covers that whole day, so ?from=2025-07-01&to=2025-07-31
+    means all of July. With `dates_only` the bounds are returned as dates for
+    filtering DATE columns.
+    """
+    start = end = None
+    if args.get('from'):
+        start = parse_datetime(args['from'], 'from')
+    if args.get('to'):
+        end = parse_datetime(args['to'], 'to')
+        if len(args['to']) == 10:
+            end += timedelta(days=1)
+    if start and end and start >= end:
+        raise QueryParamError("from must be earlier than to")
+    if dates_only:
+        if start is not None:
+            start = start.date() if start.time() == time() else start.date() + timedelta(days=1)
+        if end is not None:
+            end = end.date() if end.time() == time() else end.date() + timedelta(days=1)
+    return start, end
+
+
+def parse_cursor(args, parsers):
+    """Decodes `cursor` from the query string, converting each value with `parsers`.
+
+    Returns None when no cursor was given.
+    """
+    token = args.get('cursor')
+    if not token:
+        return None
+    values = decode_cursor(token, len(parsers))
+    try:
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (TypeError, ValueError):
+        raise QueryParamError("Invalid cursor") from None
+
+
+def where_clause(conditions):
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+
+def fetch_page(cursor, sql, params, limit, key):
+    """Runs a keyset query that asks for limit + 1 rows.
+
+    Returns (rows, next_key); next_key is `key(last_row)` when another page
+    exists, else None.
+    """
+    cursor.execute(sql, *params, limit + 1)
+    rows = cursor.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, key(rows[-1])
+    return rows, None
+
+
+def page_response(items, next_key):
+    """Returns the page as a JSON list, with the next-page cursor in headers.
+
+    `items` is a list, or a JSON array already encoded to bytes (RowPlan.encode).
+    """
+    if isinstance(items, bytes):
+        response = Response(items, mimetype='application/json')
+    else:
+        response = jsonify(items)
+    if next_key is not None:
+        token = encode_cursor(next_key)
+        response.headers[NEXT_CURSOR_HEADER] = token
+        args = request.args.to_dict()
+        args['cursor'] = token
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
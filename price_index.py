@@ -0,0 +1,171 @@
+# Effective Price Index (price_index.py)
+#
+# Resolves which FuelPrices row applies to a movement: the latest price of
+# the fuel type effective on the transaction date, where the most specific
+# context (site, then township, then supplier) wins over generic prices.
+#
+# Prices are held in memory per context (FuelTypeID, SupplierID, TownshipID,
+# SiteID) as sorted effective-date arrays, so a lookup is a handful of
+# binary searches. The index loads FuelPrices once and afterwards only reads
+# rows above the highest FuelPriceID it has seen: right after this process
+# writes prices, and every PRICE_INDEX_REFRESH seconds to pick up writes from
+# other processes.
+
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from itertools import product
+
+from db import db_connection
+
+PRICE_INDEX_REFRESH = float(os.getenv('PRICE_INDEX_REFRESH', '30')) # Seconds between catch-up reads
+
+# Context masks (supplier, township, site) from most to least specific: more
+# matching dimensions first, then site over township over supplier.
+_CONTEXT_MASKS = sorted(product((False, True), repeat=3),
+                        key=lambda mask: (sum(mask), mask[2], mask[1], mask[0]), reverse=True)
+
+
+class PriceIndexUnavailable(Exception):
+    """Raised when the index has to be loaded but no database connection is available."""
+
+
+class PriceMatch:
+    """One FuelPrices row as held by the index."""
+
+    __slots__ = ('fuel_price_id', 'fuel_type_id', 'price', 'effective_date', 'supplier_id', 'township_id', 'site_id')
+
+    def __init__(self, fuel_price_id, fuel_type_id, price, effective_date, supplier_id, township_id, site_id):
+        self.fuel_price_id = fuel_price_id
+        self.fuel_type_id = fuel_type_id
+        self.price = price
+        self.effective_date = effective_date
+        self.supplier_id = supplier_id
+        self.township_id = township_id
+        self.site_id = site_id
+
+    def to_dict(self):
+        return {
+            "fuelPriceID": self.fuel_price_id,
+            "fuelTypeID": self.fuel_type_id,
+            "price": self.price,
+            "effectiveDate": self.effective_date.isoformat(),
+            "supplierID": self.supplier_id,
+            "townshipID": self.township_id,
+            "siteID": self.site_id,
+        }
+
+
+class _Series:
+    """Prices of one context, sorted by effective date (replaced, never mutated)."""
+
+    __slots__ = ('dates', 'matches')
+
+    def __init__(self, dates, matches):
+        self.dates = dates
+        self.matches = matches
+
+
+class PriceIndex:
+    """In-memory interval index over FuelPrices with incremental catch-up."""
+
+    def __init__(self, refresh_interval=PRICE_INDEX_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._series = {}
+        self._high_water = 0 # Highest FuelPriceID loaded
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._refreshes = 0
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def _merge(self, rows):
+        grouped = {}
+        for row in rows:
+            match = PriceMatch(row.FuelPriceID, row.FuelTypeID, float(row.Price), row.EffectiveDate,
+                               row.SupplierID, row.TownshipID, row.SiteID)
+            key = (match.fuel_type_id, match.supplier_id, match.township_id, match.site_id)
+            grouped.setdefault(key, []).append(match)
+        series = dict(self._series)
+        for key, matches in grouped.items():
+            current = series.get(key)
+            if current is not None:
+                matches = current.matches + matches
+            matches.sort(key=lambda match: (match.effective_date, match.fuel_price_id))
+            series[key] = _Series([match.effective_date for match in matches], matches)
+        self._series = series
+
+    def refresh(self, cursor=None):
+        """Loads prices added since the last refresh (everything on the first call)."""
+        if cursor is None:
+            with db_connection() as conn:
+                if conn is None:
+                    raise PriceIndexUnavailable("Database connection failed while loading fuel prices")
+                return self.refresh(conn.cursor())
+        with self._lock:
+            cursor.execute(
+                "SELECT FuelPriceID, FuelTypeID, Price, EffectiveDate, SupplierID, TownshipID, SiteID "
+                "FROM FuelPrices WHERE FuelPriceID > ? ORDER BY FuelPriceID",
+                self._high_water
+            )
+            rows = cursor.fetchall()
+            if rows:
+                self._merge(rows)
+                self._high_water = rows[-1].FuelPriceID
+            self._loaded_at = time.monotonic()
+            self._refreshes += 1
+            return len(rows)
+
+    def notify_written(self, cursor):
+        """Catches up after this process wrote prices (no-op until first use)."""
+        if self.loaded:
+            self.refresh(cursor)
+
+    def _ensure_fresh(self, cursor):
+        if not self.loaded or time.monotonic() - self._loaded_at > self.refresh_interval:
+            self.refresh(cursor)
+
+    def resolve(self, fuel_type_id, when, supplier_id=None, township_id=None, site_id=None, cursor=None):
+        """Returns the PriceMatch effective for a movement, or None.
+
+        `when` is a date or datetime. A price applies if every context column
+        it sets equals the movement's; among those, the most specific context
+        with a price effective on or before `when` wins, latest date first.
+        """
+        self._ensure_fresh(cursor)
+        if isinstance(when, datetime):
+            when = when.date()
+        self._lookups += 1
+        series = self._series
+        context = (supplier_id, township_id, site_id)
+        for mask in _CONTEXT_MASKS:
+            if any(use and value is None for use, value in zip(mask, context)):
+                continue
+            key = (fuel_type_id,) + tuple(value if use else None for use, value in zip(mask, context))
+            prices = series.get(key)
+            if prices is None:
+                continue
+            position = bisect_right(prices.dates, when)
+            if position:
+                return prices.matches[position - 1]
+        return None
+
+    def stats(self):
+        series = self._series
+        return {
+            "contexts": len(series),
+            "prices": sum(len(prices.dates) for prices in series.values()),
+            "highWaterFuelPriceID": self._high_water,
+            "lookups": self._lookups,
+            "refreshes": self._refreshes,
+            "ageSeconds": round(time.monotonic() - self._loaded_at, 3) if self.loaded else None,
+        }
+
+
+# Process-wide index shared by the price lookup and transaction endpoints
+price_index = PriceIndex()
@@ -0,0 +1,289 @@
+# Bulk Fuel Price Import (prices.py)
+#
+# Price lists arrive as spreadsheets with hundreds of rows per day. Instead
+# of inserting prices one by one and looking up each previous price with a
+# separate query, an import is validated as a whole, sorted by fuel type and
+# effective date, and its fluctuations (previous price, amount, type) are
+# computed for every row in one vectorized pass. The database is only asked
+# for the prices already stored around the imported dates; both tables are
+# then written with executemany() inside a single transaction. Back-dated
+# imports also rebuild the later fluctuations they invalidate (fluctuations.py).
+#
+# Usage (CLI):
+#   python -m prices prices.csv
+#   python -m prices prices.json --dry-run
+
+import argparse
+import io
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from fluctuations import rebuild_fluctuations
+
+# Import columns, as posted by the frontend (camelCase) and in CSV headers
+PRICE_COLUMNS = ['fuelTypeID', 'price', 'effectiveDate', 'supplierID', 'townshipID', 'siteID']
+CONTEXT_COLUMNS = ['supplierID', 'townshipID', 'siteID']
+
+MAX_IMPORT_ROWS = 50000
+
+
+class PriceImportError(ValueError):
+    """Raised when an import contains invalid rows; `errors` lists them by row index."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def read_prices_csv(text):
+    """Parses CSV text with a header row naming PRICE_COLUMNS into a DataFrame."""
+    try:
+        frame = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False, skipinitialspace=True)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as ex:
+        raise PriceImportError(f"Invalid CSV: {ex}") from None
+    return prices_frame(frame.to_dict('records'))
+
+
+def prices_frame(records):
+    """Builds the raw import DataFrame from a list of price dicts."""
+    if not isinstance(records, list) or not records:
+        raise PriceImportError("Expected a non-empty list of prices")
+    if len(records) > MAX_IMPORT_ROWS:
+        raise PriceImportError(f"An import may contain at most {MAX_IMPORT_ROWS} prices")
+    if not all(isinstance(record, dict) for record in records):
+        raise PriceImportError("Every price must be an object")
+    frame = pd.DataFrame.from_records(records)
+    for column in PRICE_COLUMNS:
+        if column not in frame.columns:
+            frame[column] = None
+    return frame[PRICE_COLUMNS]
+
+
+def validate_prices(frame):
+    """Converts column types and checks every row; returns the typed DataFrame.
+
+    Raises PriceImportError listing each bad row (0-based index in the
+    import) when anything is missing, malformed or duplicated.
+    """
+    blank = frame.isna() | frame.astype(str).apply(lambda column: column.str.strip() == '')
+    typed = pd.DataFrame(index=frame.index)
+    typed['FuelTypeID'] = pd.to_numeric(frame['fuelTypeID'].where(~blank['fuelTypeID']), errors='coerce')
+    typed['Price'] = pd.to_numeric(frame['price'].where(~blank['price']), errors='coerce')
+    typed['EffectiveDate'] = pd.to_datetime(frame['effectiveDate'].where(~blank['effectiveDate']),
+                                            format='%Y-%m-%d', errors='coerce')
+    for column, target in zip(CONTEXT_COLUMNS, ('SupplierID', 'TownshipID', 'SiteID')):
+        typed[target] = pd.to_numeric(frame[column].where(~blank[column]), errors='coerce')
+
+    problems = pd.Series('', index=frame.index)
+    missing = blank[['fuelTypeID', 'price', 'effectiveDate']].any(axis=1)
+    problems[missing] = "Missing required fields: fuelTypeID, price, effectiveDate"
+    bad_types = ~missing & typed[['FuelTypeID', 'Price', 'EffectiveDate']].isna().any(axis=1)
+    bad_context = typed[['SupplierID', 'TownshipID', 'SiteID']].isna() & ~blank[CONTEXT_COLUMNS].to_numpy()
+    bad_types |= ~missing & bad_context.any(axis=1)
+    problems[bad_types] = "Invalid data types for price or effectiveDate"
+    problems[(problems == '') & (typed['Price'] <= 0)] = "Price must be positive"
+    key = ['FuelTypeID', 'EffectiveDate', 'SupplierID', 'TownshipID', 'SiteID']
+    duplicated = (problems == '') & typed.duplicated(subset=key, keep='first')
+    problems[duplicated] = "Duplicate price for the same fuel type, date and context"
+
+    if (problems != '').any():
+        errors = [{"index": int(index), "error": message} for index, message in problems[problems != ''].items()]
+        raise PriceImportError(f"{len(errors)} of {len(frame)} prices are invalid", errors)
+
+    for column in ('FuelTypeID', 'SupplierID', 'TownshipID', 'SiteID'):
+        typed[column] = typed[column].astype('Int64')
+    typed['EffectiveDate'] = typed['EffectiveDate'].dt.date
+    return typed
+
+
+def fetch_existing_prices(cursor, frame):
+    """Reads the stored prices each fuel type's fluctuations depend on.
+
+    For every fuel type in the import that is the latest stored date before
+    the earliest imported date (the only "previous price" the database has
+    to supply) plus any stored prices inside the imported date range.
+    """
+    rows = []
+    bounds = frame.groupby('FuelTypeID')['EffectiveDate'].agg(['min', 'max'])
+    for fuel_type_id, (first, last) in bounds.iterrows():
+        cursor.execute(
+            "SELECT FuelPriceID, FuelTypeID, Price, EffectiveDate, SupplierID, TownshipID, SiteID FROM FuelPrices "
+            "WHERE FuelTypeID = ? AND EffectiveDate <= ? AND EffectiveDate >= COALESCE("
+            "    (SELECT MAX(EffectiveDate) FROM FuelPrices WHERE FuelTypeID = ? AND EffectiveDate < ?), ?) "
+            "ORDER BY EffectiveDate, FuelPriceID",
+            int(fuel_type_id), last, int(fuel_type_id), first, first
+        )
+        rows.extend(tuple(row) for row in cursor.fetchall())
+    existing = pd.DataFrame.from_records(
+        rows, columns=['FuelPriceID', 'FuelTypeID', 'Price', 'EffectiveDate', 'SupplierID', 'TownshipID', 'SiteID'])
+    existing['Price'] = existing['Price'].astype(float)
+    for column in ('FuelTypeID', 'SupplierID', 'TownshipID', 'SiteID'):
+        existing[column] = existing[column].astype('Int64')
+    return existing
+
+
+def compute_fluctuations(frame, existing):
+    """Adds PreviousPrice, FluctuationAmount and FluctuationType to the import.
+
+    The previous price of a row is the last price of the same fuel type on
+    the latest earlier date, whether stored or imported (prices imported on
+    the same date follow stored ones, in import order). Returns the import
+    sorted by fuel type and effective date.
+    """
+    combined = pd.concat([
+        existing.assign(_order=-1, _row=-1)[['FuelTypeID', 'EffectiveDate', 'Price', '_order', '_row']],
+        frame.assign(_order=np.arange(len(frame)), _row=frame.index)[['FuelTypeID', 'EffectiveDate', 'Price', '_order', '_row']],
+    ], ignore_index=True)
+    combined = combined.sort_values(['FuelTypeID', 'EffectiveDate', '_order'], kind='stable')
+
+    day_close = combined.groupby(['FuelTypeID', 'EffectiveDate'], sort=True)['Price'].last()
+    previous = day_close.groupby(level='FuelTypeID').shift(1).rename('PreviousPrice')
+
+    result = frame.join(previous, on=['FuelTypeID', 'EffectiveDate'])
+    result = result.sort_values(['FuelTypeID', 'EffectiveDate'], kind='stable')
+    amount = (result['Price'] - result['PreviousPrice']).round(4)
+    result['FluctuationAmount'] = amount
+    result['FluctuationType'] = np.select(
+        [amount.isna(), amount > 0, amount < 0], ['-', 'Increase', 'Decrease'], default='No Change')
+    return result
+
+
+def _find_conflicts(frame, existing):
+    """Returns import rows whose unique key is already stored."""
+    key = ['FuelTypeID', 'EffectiveDate', 'SupplierID', 'TownshipID', 'SiteID']
+    stored = existing[key].assign(_stored=True)
+    # Nulls compare equal here, as they do in SQL Server's UNIQUE constraint.
+    matched = frame.reset_index().merge(stored, on=key, how='inner')
+    return [{"index": int(index), "error": "A price already exists for this fuel type, date and context"}
+            for index in sorted(matched['index'].unique())]
+
+
+def _backdated_fuel_types(cursor, frame):
+    """Returns {FuelTypeID: first imported date} for fuel types with stored prices after that date.
+
+    Those fuel types have later fluctuations that the import makes stale.
+    """
+    backdated = {}
+    for fuel_type_id, first in frame.groupby('FuelTypeID')['EffectiveDate'].min().items():
+        cursor.execute(
+            "SELECT CASE WHEN EXISTS (SELECT 1 FROM FuelPrices WHERE FuelTypeID = ? AND EffectiveDate > ?) "
+            "THEN 1 ELSE 0 END",
+            int(fuel_type_id), first
+        )
+        if cursor.fetchval():
+            backdated[int(fuel_type_id)] = first
+    return backdated
+
+
+def _value(value):
+    """Converts pandas/numpy scalars to plain Python values for the driver."""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def import_prices(conn, frame, dry_run=False):
+    """Validates, computes fluctuations for and stores an import in one transaction.
+
+    `frame` is the raw DataFrame from prices_frame()/read_prices_csv().
+    Returns a summary dict; raises PriceImportError for invalid rows.
+    """
+    typed = validate_prices(frame)
+    cursor = conn.cursor()
+    conn.autocommit = False
+    try:
+        existing = fetch_existing_prices(cursor, typed)
+        conflicts = _find_conflicts(typed, existing)
+        if conflicts:
+            raise PriceImportError(f"{len(conflicts)} of {len(typed)} prices already exist", conflicts)
+        result = compute_fluctuations(typed, existing)
+        backdated = _backdated_fuel_types(cursor, typed)
+
+        if not dry_run:
+            price_columns = ['FuelTypeID', 'Price', 'EffectiveDate', 'SupplierID', 'TownshipID', 'SiteID']
+            fluctuation_columns = ['FuelTypeID', 'EffectiveDate', 'Price', 'PreviousPrice',
+                                   'FluctuationAmount', 'FluctuationType']
+            records = result.astype(object).to_dict('split')['data']
+            positions = {column: result.columns.get_loc(column) for column in result.columns}
+            cursor.fast_executemany = True
+            cursor.executemany(
+                "INSERT INTO FuelPrices (FuelTypeID, Price, EffectiveDate, SupplierID, TownshipID, SiteID) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [[_value(record[positions[column]]) for column in price_columns] for record in records]
+            )
+            cursor.executemany(
+                "INSERT INTO PriceFluctuations (FuelTypeID, FluctuationDate, CurrentPrice, PreviousPrice, FluctuationAmount, FluctuationType) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [[_value(record[positions[column]]) for column in fluctuation_columns] for record in records]
+            )
+            # Back-dated prices change the previous price of later stored rows too.
+            for fuel_type_id, first in backdated.items():
+                rebuild_fluctuations(cursor, fuel_type_id, start=first)
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+
+    counts = result['FluctuationType'].value_counts()
+    # `result` is sorted by fuel type and date, keeping import order within a day.
+    latest = result.groupby('FuelTypeID', sort=True)[['EffectiveDate', 'Price']].last()
+    return {
+        "imported": 0 if dry_run else len(result),
+        "validated": len(result),
+        "fuelTypes": int(result['FuelTypeID'].nunique()),
+        "fromDate": result['EffectiveDate'].min().isoformat(),
+        "toDate": result['EffectiveDate'].max().isoformat(),
+        "fluctuations": {kind: int(count) for kind, count in counts.items()},
+        "rebuiltFrom": {str(fuel_type_id): first.isoformat() for fuel_type_id, first in backdated.items()},
+        "latestByFuelType": {
+            str(fuel_type_id): {"effectiveDate": row.EffectiveDate.isoformat(), "price": float(row.Price)}
+            for fuel_type_id, row in latest.iterrows()
+        },
+    }
+
+
+def load_file(path):
+    """Reads a .csv or .json price file into the raw import DataFrame."""
+    with open(path, encoding='utf-8-sig') as handle:
+        text = handle.read()
+    if path.lower().endswith('.json'):
+        try:
+            return prices_frame(json.loads(text))
+        except json.JSONDecodeError as ex:
+            raise PriceImportError(f"Invalid JSON: {ex}") from None
+    return read_prices_csv(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import fuel prices from a CSV or JSON file.")
+    parser.add_argument('path', help="CSV (header: fuelTypeID,price,effectiveDate,...) or JSON array")
+    parser.add_argument('--dry-run', action='store_true', help="Validate and compute, but write nothing")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    try:
+        frame = load_file(args.path)
+        with db_connection() as conn:
+            if conn is None:
+                print("Database connection failed", file=sys.stderr)
+                return 2
+            summary = import_prices(conn, frame, dry_run=args.dry_run)
+    except PriceImportError as ex:
+        print(str(ex), file=sys.stderr)
+        for error in ex.errors[:50]:
+            print(f"  row {error['index']}: {error['error']}", file=sys.stderr)
+        return 1
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,56 +1,104 @@
+# Report Decks (pypage.py)
+#
+# create_swo_presentation() builds the fixed SWO documentation deck.
+#
+# build_monthly_decks() builds one deck per township and per site for a
+# month, from live inventory, movement, price and forecast data. The data is
+# read once, in a few grouped queries, and split into one small job per
+# deck. Each job is rendered in a process pool. Charts are described by a
+# spec (plain data) and written to an image cache under the SHA-256 of that
+# spec, so a chart whose data did not change since an earlier run (or that
+# another deck already rendered, like a township's prices on each of its
+# sites) is reused instead of drawn again.
+#
+# Usage (CLI):
+#   python pypage.py                                      # the SWO documentation deck
+#   python pypage.py monthly --month 2026-09 --workers 8  # township and site decks
+
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.dml.color import RGBColor
+import argparse
+import hashlib
+import json
 import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
 
-def create_swo_presentation():
-    # Initialize presentation
+DECK_OUTPUT_DIR = os.getenv('DECK_OUTPUT_DIR', 'decks')
+DECK_IMAGE_CACHE = os.getenv('DECK_IMAGE_CACHE', os.path.join('images', 'cache'))
+
+CHART_STYLE = 1 # Part of every chart hash; bump when the drawing code changes
+LOW_STOCK_ROWS = 10 # Locations listed on the days-of-supply slide
+
+# Color scheme (Nord theme)
+COLORS = {
+    'dark_bg': RGBColor(46, 52, 64),     # #2e3440
+    'light_text': RGBColor(216, 222, 233), # #d8dee9
+    'blue': RGBColor(136, 192, 208),      # #88c0d0
+}
+CHART_COLORS = ['#88c0d0', '#bf616a', '#a3be8c', '#ebcb8b', '#b48ead', '#d08770']
+
+
+# --- Helper Function for Safe Image Addition ---
+def add_safe_image(slide, img_path, left, top, width, height):
+    """Adds image with error handling"""
+    try:
+        if os.path.exists(img_path):
+            slide.shapes.add_picture(img_path, left, top, width, height)
+        else:
+            # Create placeholder if image missing
+            txt_box = slide.shapes.add_textbox(left, top, width, height)
+            tf = txt_box.text_frame
+            tf.text = f"Image not found:\n{os.path.basename(img_path)}"
+            tf.paragraphs[0].font.color.rgb = COLORS['light_text']
+            print(f"Warning: Missing image - {img_path}")
+    except Exception as e:
+        print(f"Error adding image: {e}")
+
+
+def new_presentation():
     prs = Presentation()
     prs.slide_width = Inches(13.33)
     prs.slide_height = Inches(7.5)
+    return prs
 
-    # Color scheme (Nord theme)
-    colors = {
-        'dark_bg': RGBColor(46, 52, 64),     # #2e3440
-        'light_text': RGBColor(216, 222, 233), # #d8dee9
-        'blue': RGBColor(136, 192, 208),      # #88c0d0
-    }
 
-    # --- Helper Function for Safe Image Addition ---
-    def add_safe_image(slide, img_path, left, top, width, height):
-        """Adds image with error handling"""
-        try:
-            if os.path.exists(img_path):
-                slide.shapes.add_picture(img_path, left, top, width, height)
-            else:
-                # Create placeholder if image missing
-                txt_box = slide.shapes.add_textbox(left, top, width, height)
-                tf = txt_box.text_frame
-                tf.text = f"Image not found:\n{os.path.basename(img_path)}"
-                tf.paragraphs[0].font.color.rgb = colors['light_text']
-                print(f"Warning: Missing image - {img_path}")
-        except Exception as e:
-            print(f"Error adding image: {e}")
+def add_dark_slide(prs, layout, title_text, title_color='blue'):
+    """Adds a slide with the dark background and a colored title."""
+    slide = prs.slides.add_slide(prs.slide_layouts[layout])
+    slide.background.fill.solid()
+    slide.background.fill.fore_color.rgb = COLORS['dark_bg']
+    title = slide.shapes.title
+    title.text = title_text
+    title.text_frame.paragraphs[0].font.color.rgb = COLORS[title_color]
+    return slide
 
-    # --- Slide 1: Title Slide ---
-    slide = prs.slides.add_slide(prs.slide_layouts[0])
-    background = slide.background
-    background.fill.solid()
-    background.fill.fore_color.rgb = colors['dark_bg']
 
-    title = slide.shapes.title
-    title.text = "SWO System Documentation"
-    title.text_frame.paragraphs[0].font.color.rgb = colors['light_text']
-    title.text_frame.paragraphs[0].font.size = Pt(44)
+def add_text_lines(slide, lines, left, top, width, height, size=18):
+    textbox = slide.shapes.add_textbox(left, top, width, height)
+    tf = textbox.text_frame
+    for line in lines:
+        p = tf.add_paragraph()
+        p.text = line
+        p.font.color.rgb = COLORS['light_text']
+        p.font.size = Pt(size)
+        p.space_after = Pt(12)
+    return textbox
 
-    # --- Slide 2: System Mental Model ---
-    slide = prs.slides.add_slide(prs.slide_layouts[1])
-    slide.background.fill.solid()
-    slide.background.fill.fore_color.rgb = colors['dark_bg']
 
-    title = slide.shapes.title
-    title.text = "System Mental Model"
-    title.text_frame.paragraphs[0].font.color.rgb = colors['blue']
+def create_swo_presentation():
+    # Initialize presentation
+    prs = new_presentation()
+
+    # --- Slide 1: Title Slide ---
+    slide = add_dark_slide(prs, 0, "SWO System Documentation", 'light_text')
+    slide.shapes.title.text_frame.paragraphs[0].font.size = Pt(44)
+
+    # --- Slide 2: System Mental Model ---
+    slide = add_dark_slide(prs, 1, "System Mental Model")
 
     # Add image (with error handling)
     img_path = os.path.join("images", "mindmap.png")  # Relative path
@@ -64,13 +112,7 @@ def create_swo_presentation():
     )
 
     # --- Slide 3: SOP Steps ---
-    slide = prs.slides.add_slide(prs.slide_layouts[1])
-    slide.background.fill.solid()
-    slide.background.fill.fore_color.rgb = colors['dark_bg']
-
-    title = slide.shapes.title
-    title.text = "Monthly SWO Update SOP"
-    title.text_frame.paragraphs[0].font.color.rgb = colors['blue']
+    slide = add_dark_slide(prs, 1, "Monthly SWO Update SOP")
 
     steps = [
         "1. Data Collection from Outlook",
@@ -81,15 +123,7 @@ def create_swo_presentation():
         "6. Verification",
         "7. Documentation"
     ]
-
-    textbox = slide.shapes.add_textbox(Inches(1), Inches(1.5), Inches(8), Inches(4))
-    tf = textbox.text_frame
-    for step in steps:
-        p = tf.add_paragraph()
-        p.text = step
-        p.font.color.rgb = colors['light_text']
-        p.font.size = Pt(18)
-        p.space_after = Pt(12)
+    add_text_lines(slide, steps, Inches(1), Inches(1.5), Inches(8), Inches(4))
 
     # Save presentation
     output_path = "SWO_Documentation.pptx"
@@ -99,10 +133,366 @@ def create_swo_presentation():
     except Exception as e:
         print(f"Error saving presentation: {e}")
 
+
+# --- Chart image cache ---
+
+_cached_charts = set() # Paths this process already rendered or found, so they are not checked again
+
+
+def chart_hash(spec):
+    payload = json.dumps([CHART_STYLE, spec], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _render_chart(spec, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 4.5), dpi=100)
+    fig.patch.set_facecolor('#2e3440')
+    ax.set_facecolor('#2e3440')
+    if spec['kind'] == 'bar':
+        ax.bar(spec['labels'], spec['values'], color=CHART_COLORS[0])
+    else:
+        for color, (name, points) in zip(CHART_COLORS * 4, spec['series'].items()):
+            days = [day for day, _ in points]
+            values = [value for _, value in points]
+            if spec['kind'] == 'step':
+                ax.step(days, values, where='post', color=color, label=name)
+            else:
+                ax.plot(days, values, color=color, label=name)
+        ax.legend(facecolor='#3b4252', edgecolor='#4c566a', labelcolor='#d8dee9')
+    ax.set_title(spec['title'], color='#d8dee9')
+    ax.set_ylabel(spec.get('unit', ''), color='#d8dee9')
+    ax.tick_params(colors='#d8dee9')
+    for side in ax.spines.values():
+        side.set_color('#4c566a')
+    fig.tight_layout()
+    # Decks in other workers may want the same chart; publish it complete or not at all.
+    temporary = f"{path}.{os.getpid()}.tmp"
+    fig.savefig(temporary, format='png', facecolor=fig.get_facecolor())
+    plt.close(fig)
+    os.replace(temporary, path)
+
+
+def cached_chart(spec, cache_dir):
+    """Returns (image path, rendered) for `spec`, drawing it only if not cached yet."""
+    path = os.path.join(cache_dir, chart_hash(spec) + '.png')
+    if path in _cached_charts:
+        return path, False
+    rendered = not os.path.exists(path)
+    if rendered:
+        _render_chart(spec, path)
+    _cached_charts.add(path)
+    return path, rendered
+
+
+# --- Monthly decks ---
+
+def _month_range(month):
+    start = date(month.year, month.month, 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-') or 'unnamed'
+
+
+def build_deck(job):
+    """Builds one monthly deck from its job dict; returns a result dict (runs in a worker)."""
+    started = time.perf_counter()
+    rendered = reused = 0
+    prs = new_presentation()
+
+    slide = add_dark_slide(prs, 0, job['title'], 'light_text')
+    slide.shapes.title.text_frame.paragraphs[0].font.size = Pt(40)
+    slide.placeholders[1].text = job['subtitle']
+    slide.placeholders[1].text_frame.paragraphs[0].font.color.rgb = COLORS['blue']
+
+    for heading, spec, empty in job['charts']:
+        slide = add_dark_slide(prs, 5, heading)
+        if spec is None:
+            add_text_lines(slide, [empty], Inches(1), Inches(1.5), Inches(11), Inches(1))
+            continue
+        path, fresh = cached_chart(spec, job['image_cache'])
+        rendered, reused = rendered + fresh, reused + (not fresh)
+        # Cache paths are known to exist, so the picture is added without add_safe_image's check.
+        slide.shapes.add_picture(path, Inches(0.9), Inches(1.5), Inches(11.5), Inches(5.2))
+
+    slide = add_dark_slide(prs, 5, "Days of supply")
+    lines = job['low_stock'] or ["No location has outflow to forecast."]
+    add_text_lines(slide, lines, Inches(1), Inches(1.5), Inches(11), Inches(5), size=16)
+
+    os.makedirs(os.path.dirname(job['output_path']), exist_ok=True)
+    prs.save(job['output_path'])
+    return {"path": job['output_path'], "seconds": time.perf_counter() - started,
+            "chartsRendered": rendered, "chartsReused": reused}
+
+
+def load_deck_data(cursor, month):
+    """Reads everything the month's decks need, once; returns DataFrames by name."""
+    import pandas as pd
+
+    start, end = _month_range(month)
+
+    def frame(sql, *params):
+        cursor.execute(sql, *params)
+        columns = [column[0] for column in cursor.description]
+        return pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=columns,
+                                         coerce_float=True)
+
+    data = {
+        'townships': frame("SELECT TownshipID, TownshipName FROM Townships"),
+        'sites': frame("SELECT SiteID, SiteName, TownshipID FROM Sites"),
+        'warehouses': frame("SELECT WarehouseID, WarehouseName, TownshipID, SiteID FROM Warehouses"),
+        'fuelTypes': frame("SELECT FuelTypeID, FuelTypeName FROM FuelTypes"),
+        'inventory': frame("SELECT FuelTypeID, LocationType, LocationID, CurrentStock FROM FuelInventory"),
+        # Received and issued quantities per location and day
+        'movements': frame("""
+            SELECT LocationType, LocationID, Day, SUM(Received) AS Received, SUM(Issued) AS Issued
+            FROM (
+                SELECT DestinationLocationType AS LocationType, DestinationLocationID AS LocationID,
+                       CAST(TransactionDate AS DATE) AS Day, Quantity AS Received, 0 AS Issued
+                FROM FuelTransactions
+                WHERE TransactionDate >= ? AND TransactionDate < ?
+                UNION ALL
+                SELECT SourceLocationType, SourceLocationID, CAST(TransactionDate AS DATE), 0, Quantity
+                FROM FuelTransactions
+                WHERE SourceLocationType IN ('Warehouse', 'Site') AND TransactionDate >= ? AND TransactionDate < ?
+            ) moves
+            GROUP BY LocationType, LocationID, Day
+        """, start, end, start, end),
+        # Prices in effect during the month: every one within it and, per fuel type and
+        # price context (supplier, township, site), the latest one before it
+        'prices': frame("""
+            SELECT FuelTypeID, SupplierID, TownshipID, SiteID, Price, EffectiveDate
+            FROM FuelPrices
+            WHERE EffectiveDate >= ? AND EffectiveDate < ?
+            UNION ALL
+            SELECT FuelTypeID, SupplierID, TownshipID, SiteID, Price, EffectiveDate
+            FROM (
+                SELECT FuelTypeID, SupplierID, TownshipID, SiteID, Price, EffectiveDate,
+                       ROW_NUMBER() OVER (PARTITION BY FuelTypeID, SupplierID, TownshipID, SiteID
+                                          ORDER BY EffectiveDate DESC, FuelPriceID DESC) AS PriceRank
+                FROM FuelPrices
+                WHERE EffectiveDate < ?
+            ) earlier
+            WHERE PriceRank = 1
+        """, start, end, start),
+        'forecasts': frame("SELECT FuelTypeID, LocationType, LocationID, DaysOfSupply, ReorderQuantity "
+                           "FROM SupplyForecasts WHERE DaysOfSupply IS NOT NULL"),
+    }
+    for name in ('inventory', 'movements', 'prices', 'forecasts'):
+        for column in ('CurrentStock', 'Received', 'Issued', 'Price', 'DaysOfSupply', 'ReorderQuantity'):
+            if column in data[name]:
+                data[name][column] = data[name][column].astype(float)
+    return data
+
+
+def _location_scopes(data):
+    """One row per stocked location with its name, township and site (WH4 warehouses count to their site)."""
+    import pandas as pd
+
+    sites, warehouses = data['sites'], data['warehouses']
+    site_townships = dict(zip(sites['SiteID'], sites['TownshipID']))
+    return pd.concat([
+        pd.DataFrame({'LocationType': 'Site', 'LocationID': sites['SiteID'], 'LocationName': sites['SiteName'],
+                      'TownshipID': sites['TownshipID'], 'ScopeSiteID': sites['SiteID']}),
+        pd.DataFrame({'LocationType': 'Warehouse', 'LocationID': warehouses['WarehouseID'],
+                      'LocationName': warehouses['WarehouseName'],
+                      'TownshipID': warehouses['TownshipID'].fillna(warehouses['SiteID'].map(site_townships)),
+                      'ScopeSiteID': warehouses['SiteID']}),
+    ], ignore_index=True)
+
+
+def _price_series(prices, township_id, site_id, fuel_names, start, end):
+    """{fuel name: [(day of month, price)]}: the price in effect at a township (site_id None) or site.
+
+    A price applies when its township and site are unset or match. Each day
+    the most specific level with a price in effect wins: site, then township,
+    then general, as in price_index. Within that level a price without a
+    supplier wins; otherwise the chart shows the mean of the suppliers' prices.
+    """
+    import pandas as pd
+
+    applicable = prices[(prices['TownshipID'].isna() | (prices['TownshipID'] == township_id))
+                        & (prices['SiteID'].isna() | (prices['SiteID'] == site_id))]
+    month_days = (end - start).days
+    series = {}
+    for fuel_type_id, rows in applicable.sort_values('EffectiveDate').groupby('FuelTypeID'):
+        daily = {} # (level, SupplierID) -> price in effect on each day of the month (None before the first)
+        for row in rows.itertuples():
+            level = 0 if pd.notna(row.SiteID) else 1 if pd.notna(row.TownshipID) else 2
+            supplier_id = None if pd.isna(row.SupplierID) else row.SupplierID
+            day = max((date.fromisoformat(str(row.EffectiveDate)[:10]) - start).days, 0)
+            in_effect = daily.setdefault((level, supplier_id), [None] * month_days)
+            in_effect[day:] = [row.Price] * (month_days - day)
+        points = []
+        for day in range(month_days):
+            quotes = [(level, supplier_id, in_effect[day]) for (level, supplier_id), in_effect in daily.items()
+                      if in_effect[day] is not None]
+            if not quotes:
+                continue
+            best = min(level for level, _, _ in quotes)
+            quotes = {supplier_id: price for level, supplier_id, price in quotes if level == best}
+            price = round(quotes[None] if None in quotes else sum(quotes.values()) / len(quotes), 2)
+            if not points or points[-1][1] != price:
+                points.append((day + 1, price))
+        if points:
+            if points[-1][0] != month_days:
+                points.append((month_days, points[-1][1])) # Extend the step to the end of the month
+            series[fuel_names.get(fuel_type_id, str(fuel_type_id))] = points
+    return series
+
+
+def monthly_jobs(data, month, scopes=('township', 'site'), output_dir=DECK_OUTPUT_DIR,
+                 image_cache=DECK_IMAGE_CACHE):
+    """Splits the month's data into one job dict per township and/or site deck."""
+    import pandas as pd
+
+    start, end = _month_range(month)
+    label = start.strftime('%B %Y')
+    fuel_names = dict(zip(data['fuelTypes']['FuelTypeID'], data['fuelTypes']['FuelTypeName']))
+    locations = _location_scopes(data)
+    keys = ['LocationType', 'LocationID']
+    inventory = data['inventory'].merge(locations, on=keys)
+    movements = data['movements'].merge(locations, on=keys)
+    movements['DayOfMonth'] = pd.to_datetime(movements['Day']).dt.day
+    forecasts = data['forecasts'].merge(locations, on=keys)
+    township_names = dict(zip(data['townships']['TownshipID'], data['townships']['TownshipName']))
+    days = list(range(1, (end - start).days + 1))
+    # One pass per scope column splits each frame by township or site.
+    frames = (inventory, movements, forecasts)
+    split = {column: [dict(tuple(frame.groupby(column))) for frame in frames]
+             for column in ('TownshipID', 'ScopeSiteID')}
+    # (TownshipID, SiteID) -> series; sites without prices of their own share (and reuse)
+    # their township's price chart
+    price_series = {}
+    priced_sites = set(data['prices']['SiteID'].dropna())
+
+    def job(kind, scope_id, name, township_id, scope_column):
+        stocked, moves, forecast = (parts.get(scope_id, frame.iloc[:0])
+                                    for parts, frame in zip(split[scope_column], frames))
+        stock = stocked.groupby('FuelTypeID')['CurrentStock'].sum()
+        moved = moves.groupby('DayOfMonth')[['Received', 'Issued']].sum().reindex(days, fill_value=0.0)
+        low = forecast.nsmallest(LOW_STOCK_ROWS, 'DaysOfSupply')
+        price_key = (township_id, scope_id if kind == 'site' and scope_id in priced_sites else None)
+        if price_key not in price_series:
+            price_series[price_key] = _price_series(data['prices'], *price_key, fuel_names, start, end)
+        prices = price_series[price_key]
+        return {
+            'title': name,
+            'subtitle': f"{kind.capitalize()} fuel report - {label}",
+            'charts': [
+                ("Stock on hand", {
+                    'kind': 'bar', 'title': f"Current stock - {name}", 'unit': 'Quantity',
+                    'labels': [fuel_names.get(fuel_type_id, str(fuel_type_id)) for fuel_type_id in stock.index],
+                    'values': [round(value, 2) for value in stock.tolist()],
+                } if len(stock) else None, "No stock held."),
+                ("Movements", {
+                    'kind': 'line', 'title': f"Daily movements - {label}", 'unit': 'Quantity',
+                    'series': {column: [[day, round(value, 2)] for day, value in zip(days, moved[column].tolist())]
+                               for column in ('Received', 'Issued')},
+                } if moved.to_numpy().any() else None, "No movements this month."),
+                ("Prices", {
+                    'kind': 'step', 'title': f"Fuel prices - {label}", 'unit': 'Price per unit',
+                    'series': {fuel: [list(point) for point in points] for fuel, points in prices.items()},
+                } if prices else None, "No prices in effect this month."),
+            ],
+            'low_stock': [
+                f"{row.LocationName} ({fuel_names.get(row.FuelTypeID, row.FuelTypeID)}): "
+                f"{row.DaysOfSupply:,.1f} days, reorder {row.ReorderQuantity:,.0f}"
+                for row in low.itertuples()
+            ],
+            'image_cache': image_cache,
+            'output_path': os.path.join(output_dir, start.strftime('%Y-%m'),
+                                        f"{kind}-{int(scope_id):05d}-{_slug(name)}.pptx"),
+        }
+
+    jobs = []
+    if 'township' in scopes:
+        for township_id, name in sorted(township_names.items()):
+            jobs.append(job('township', township_id, name, township_id, 'TownshipID'))
+    if 'site' in scopes:
+        for site in data['sites'].sort_values('SiteID').itertuples():
+            jobs.append(job('site', site.SiteID, site.SiteName, site.TownshipID, 'ScopeSiteID'))
+    return jobs
+
+
+def build_monthly_decks(jobs, workers=None, progress=print):
+    """Builds the decks in a process pool (inline with workers=1); returns a summary dict."""
+    started = time.perf_counter()
+    results = []
+    if jobs:
+        os.makedirs(jobs[0]['image_cache'], exist_ok=True)
+
+    def report(result):
+        results.append(result)
+        progress(f"[{len(results):>{len(str(len(jobs)))}}/{len(jobs)}] {result['seconds']:6.2f}s  "
+                 f"{result['path']}  (charts: {result['chartsRendered']} rendered, "
+                 f"{result['chartsReused']} reused)")
+
+    if workers == 1:
+        for job in jobs:
+            report(build_deck(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(build_deck, job) for job in jobs]):
+                report(future.result())
+
+    deck_seconds = [result['seconds'] for result in results]
+    return {
+        "decks": len(results),
+        "elapsedSeconds": round(time.perf_counter() - started, 2),
+        "deckSecondsTotal": round(sum(deck_seconds), 2),
+        "deckSecondsMax": round(max(deck_seconds), 2) if deck_seconds else 0,
+        "chartsRendered": sum(result['chartsRendered'] for result in results),
+        "chartsReused": sum(result['chartsReused'] for result in results),
+    }
+
+
+def _previous_month():
+    return (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build report decks.")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('docs', help="The SWO documentation deck (default)")
+    monthly = commands.add_parser('monthly', help="Monthly township and site decks from live data")
+    monthly.add_argument('--month', type=lambda raw: date.fromisoformat(raw + '-01'), default=_previous_month(),
+                         help="Month to report (YYYY-MM, default: last month)")
+    monthly.add_argument('--scope', nargs='+', choices=('township', 'site'), default=['township', 'site'])
+    monthly.add_argument('--out', default=DECK_OUTPUT_DIR, help="Output directory (a YYYY-MM folder is added)")
+    monthly.add_argument('--image-cache', default=DECK_IMAGE_CACHE, help="Chart image cache directory")
+    monthly.add_argument('--workers', type=int, help="Worker processes (default: CPU count, 1: no pool)")
+    args = parser.parse_args(argv)
+
+    if args.command != 'monthly':
+        # Create images directory if it doesn't exist
+        if not os.path.exists("images"):
+            os.makedirs("images")
+            print("Created 'images' directory for diagrams")
+
+        create_swo_presentation()
+        return 0
+
+    from db import db_connection # Deferred so the documentation deck needs no database driver
+
+    started = time.perf_counter()
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        data = load_deck_data(conn.cursor(), args.month)
+    jobs = monthly_jobs(data, args.month, args.scope, args.out, args.image_cache)
+    print(f"Loaded data for {len(jobs)} decks in {time.perf_counter() - started:.2f}s", flush=True)
+    summary = build_monthly_decks(jobs, args.workers, progress=lambda line: print(line, flush=True))
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
 if __name__ == "__main__":
-    # Create images directory if it doesn't exist
-    if not os.path.exists("images"):
-        os.makedirs("images")
-        print("Created 'images' directory for diagrams")
-    
-    create_swo_presentation()
\ No newline at end of file
+    raise SystemExit(main())
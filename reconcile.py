@@ -0,0 +1,249 @@
+# Ledger Reconciliation (reconcile.py)
+#
+# Checks that every FuelInventory.CurrentStock still equals the net of all
+# FuelTransactions credits and debits for its (fuel type, location), and
+# optionally repairs the balances that drifted (failed partial writes,
+# manual SQL).
+#
+# The ledger is streamed in TransactionID order with fetchmany() in chunks
+# of RECONCILE_CHUNK_ROWS. Each chunk is reduced with NumPy into per-location
+# sums, held in two arrays (encoded location keys and balances in integer
+# cents, so tens of millions of rows add up exactly). Memory is bounded by
+# the number of locations, not by the ledger. The accumulators and the last
+# TransactionID read are saved to a checkpoint file, so the next run only
+# reads new transactions (use --full after editing old ledger rows).
+#
+# The final comparison reads FuelInventory WITH (UPDLOCK, HOLDLOCK) and the
+# ledger tail in one transaction, so concurrent movements cannot show up
+# as false discrepancies.
+#
+# Inventory rows the ledger never touched (opening balances entered
+# directly, as valuation.py also treats them) are not discrepancies: they
+# are listed separately as "unledgered" and --repair leaves them alone.
+# Only --zero-unledgered sets them to 0.
+#
+# Usage (CLI):
+#   python -m reconcile                 # report, resuming from the checkpoint
+#   python -m reconcile --repair --full
+
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import run_in_transaction
+
+RECONCILE_CHUNK_ROWS = int(os.getenv('RECONCILE_CHUNK_ROWS', '100000'))
+RECONCILE_CHECKPOINT = os.getenv('RECONCILE_CHECKPOINT', 'reconcile_checkpoint.npz')
+RECONCILE_CHECKPOINT_EVERY = 50 # Chunks between checkpoint saves while streaming
+RECONCILE_REPORT_LIMIT = 1000   # Discrepancies listed in a report (all are counted)
+
+LOCATION_TYPES = ('Warehouse', 'Site') # Encoded as 0 and 1
+
+LEDGER_SQL = (
+    "SELECT TransactionID, FuelTypeID, SourceLocationType, SourceLocationID, "
+    "DestinationLocationType, DestinationLocationID, Quantity "
+    "FROM FuelTransactions WHERE TransactionID > ? ORDER BY TransactionID"
+)
+
+_run_lock = threading.Lock()
+
+
+def encode_keys(fuel_type_ids, location_type_codes, location_ids):
+    """Packs (FuelTypeID, location type code, LocationID) arrays into int64 keys."""
+    return (fuel_type_ids << 33) | (location_type_codes << 32) | location_ids
+
+
+def decode_key(code):
+    code = int(code)
+    return code >> 33, LOCATION_TYPES[(code >> 32) & 1], code & 0xFFFFFFFF
+
+
+class LedgerAccumulator:
+    """Net ledger balance per location as sorted key and cent arrays."""
+
+    def __init__(self, codes=None, cents=None, last_transaction_id=0, rows_read=0):
+        self.codes = np.zeros(0, dtype=np.int64) if codes is None else codes
+        self.cents = np.zeros(0, dtype=np.int64) if cents is None else cents
+        self.last_transaction_id = last_transaction_id
+        self.rows_read = rows_read
+
+    def add_rows(self, rows):
+        """Folds one fetched chunk of LEDGER_SQL rows into the balances."""
+        if not rows:
+            return
+        ids, fuel_types, source_types, source_ids, destination_types, destination_ids, quantities = zip(*rows)
+        fuel_types = np.asarray(fuel_types, dtype=np.int64)
+        cents = np.rint(np.asarray(quantities, dtype=np.float64) * 100).astype(np.int64)
+        source_types = np.asarray(source_types)
+        destination_codes = encode_keys(fuel_types, (np.asarray(destination_types) == 'Site').astype(np.int64),
+                                        np.asarray(destination_ids, dtype=np.int64))
+        stocked = np.isin(source_types, LOCATION_TYPES)
+        source_codes = encode_keys(fuel_types[stocked], (source_types[stocked] == 'Site').astype(np.int64),
+                                   np.asarray(source_ids, dtype=np.int64)[stocked])
+        self._merge(np.concatenate([destination_codes, source_codes]),
+                    np.concatenate([cents, -cents[stocked]]))
+        self.last_transaction_id = int(ids[-1])
+        self.rows_read += len(rows)
+
+    def _merge(self, codes, cents):
+        keys, positions = np.unique(np.concatenate([self.codes, codes]), return_inverse=True)
+        totals = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(totals, positions, np.concatenate([self.cents, cents]))
+        self.codes, self.cents = keys, totals
+
+    def balances(self):
+        """{(FuelTypeID, LocationType, LocationID): cents}"""
+        return {decode_key(code): int(cents) for code, cents in zip(self.codes, self.cents)}
+
+    def save(self, path):
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, codes=self.codes, cents=self.cents,
+                 position=np.array([self.last_transaction_id, self.rows_read], dtype=np.int64))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """Returns the saved accumulator, or a fresh one if there is no checkpoint."""
+        if not path or not os.path.exists(path):
+            return cls()
+        with np.load(path) as saved:
+            last_transaction_id, rows_read = (int(value) for value in saved['position'])
+            return cls(saved['codes'], saved['cents'], last_transaction_id, rows_read)
+
+
+def stream_ledger(cursor, accumulator, chunk_rows=RECONCILE_CHUNK_ROWS, checkpoint=None):
+    """Reads every ledger row after the accumulator's position into it."""
+    cursor.execute(LEDGER_SQL, accumulator.last_transaction_id)
+    chunks = 0
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        accumulator.add_rows(rows)
+        chunks += 1
+        if checkpoint and chunks % RECONCILE_CHECKPOINT_EVERY == 0:
+            accumulator.save(checkpoint)
+
+
+def _discrepancies(ledger, inventory):
+    """Locations whose inventory balance differs from the ledger (both in cents).
+
+    Returns (found, unledgered): `found` covers every location in the
+    ledger, `unledgered` the inventory rows with stock but no ledger rows.
+    """
+    found = []
+    for key in sorted(ledger):
+        ledger_cents = ledger[key]
+        inventory_cents = inventory.get(key)
+        if inventory_cents is None or inventory_cents != ledger_cents:
+            found.append((key, ledger_cents, inventory_cents))
+    unledgered = [(key, 0, cents) for key, cents in sorted(inventory.items()) if key not in ledger and cents]
+    return found, unledgered
+
+
+def _repair(cursor, found):
+    repaired = 0
+    for (fuel_type_id, location_type, location_id), ledger_cents, inventory_cents in found:
+        if inventory_cents is None:
+            cursor.execute("INSERT INTO FuelInventory (FuelTypeID, LocationType, LocationID, CurrentStock) "
+                           "VALUES (?, ?, ?, ?)", fuel_type_id, location_type, location_id, ledger_cents / 100)
+        else:
+            cursor.execute("UPDATE FuelInventory SET CurrentStock = ?, LastUpdated = GETDATE() "
+                           "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ?",
+                           ledger_cents / 100, fuel_type_id, location_type, location_id)
+        repaired += cursor.rowcount
+    return repaired
+
+
+def reconcile(conn, checkpoint=RECONCILE_CHECKPOINT, full=False, repair=False, zero_unledgered=False):
+    """Compares FuelInventory with the ledger; returns a report dict.
+
+    Resumes from `checkpoint` unless `full` (or no checkpoint exists). With
+    `repair`, drifted balances are set to the ledger's and missing inventory
+    rows are created, in the same transaction as the comparison. Unledgered
+    rows (opening balances) are only reported, unless `repair` and
+    `zero_unledgered` are both set, which sets them to 0 as well.
+    """
+    with _run_lock:
+        started = time.perf_counter()
+        accumulator = LedgerAccumulator() if full else LedgerAccumulator.load(checkpoint)
+        resumed_from = accumulator.last_transaction_id
+
+        # Bulk of the ledger: plain streaming reads, no locks held.
+        stream_ledger(conn.cursor(), accumulator, checkpoint=checkpoint)
+
+        def work(cursor):
+            cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock "
+                           "FROM FuelInventory WITH (UPDLOCK, HOLDLOCK)")
+            inventory = {(row.FuelTypeID, row.LocationType, row.LocationID): int(round(float(row.CurrentStock) * 100))
+                         for row in cursor.fetchall()}
+            stream_ledger(cursor, accumulator) # Rows committed since the bulk pass
+            found, unledgered = _discrepancies(accumulator.balances(), inventory)
+            fix = found + (unledgered if zero_unledgered else []) if repair else []
+            return found, unledgered, (_repair(cursor, fix) if fix else 0), len(inventory)
+
+        found, unledgered, repaired, locations = run_in_transaction(conn, work)
+        if checkpoint:
+            accumulator.save(checkpoint)
+
+    return {
+        "transactionsRead": accumulator.rows_read,
+        "resumedFromTransactionID": resumed_from,
+        "lastTransactionID": accumulator.last_transaction_id,
+        "ledgerLocations": len(accumulator.codes),
+        "inventoryLocations": locations,
+        "discrepancyCount": len(found),
+        "discrepancies": [
+            {
+                "fuelTypeID": fuel_type_id,
+                "locationType": location_type,
+                "locationID": location_id,
+                "ledgerStock": ledger_cents / 100,
+                "inventoryStock": None if inventory_cents is None else inventory_cents / 100,
+                "difference": round(((inventory_cents or 0) - ledger_cents) / 100, 2),
+            }
+            for (fuel_type_id, location_type, location_id), ledger_cents, inventory_cents
+            in found[:RECONCILE_REPORT_LIMIT]
+        ],
+        "unledgeredCount": len(unledgered),
+        "unledgered": [
+            {
+                "fuelTypeID": fuel_type_id,
+                "locationType": location_type,
+                "locationID": location_id,
+                "inventoryStock": inventory_cents / 100,
+            }
+            for (fuel_type_id, location_type, location_id), _, inventory_cents in unledgered[:RECONCILE_REPORT_LIMIT]
+        ],
+        "repaired": repaired,
+        "elapsedSeconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile FuelInventory against the transaction ledger.")
+    parser.add_argument('--full', action='store_true', help="Ignore the checkpoint and read the whole ledger")
+    parser.add_argument('--repair', action='store_true', help="Set drifted balances to the ledger's")
+    parser.add_argument('--zero-unledgered', action='store_true',
+                        help="With --repair, also set inventory rows without ledger history to 0")
+    parser.add_argument('--checkpoint', default=RECONCILE_CHECKPOINT,
+                        help="Checkpoint file (empty string: none)")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        report = reconcile(conn, args.checkpoint or None, args.full, args.repair, args.zero_unledgered)
+    print(json.dumps(report, indent=2))
+    return 1 if report["discrepancyCount"] and not args.repair else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
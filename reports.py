@@ -0,0 +1,387 @@
+# Consumption and Cost Reports (reports.py)
+#
+# Aggregates FuelTransactions into daily, weekly or monthly buckets, grouped
+# by fuel type, site, warehouse and/or township (of the destination), with
+# quantities moved, transport / loading / other costs and the landed cost
+# (fuel at the transaction's price plus those costs).
+#
+# Rows are read in chunks of REPORT_CHUNK_ROWS and each chunk is reduced with
+# a pandas group-by before the next one is fetched, so memory is bounded by
+# the number of groups, not the number of transactions. Buckets of closed
+# periods (ending before the current one started) are cached per report
+# shape; only the open period and cache misses are read from the database.
+#
+# Each cached bucket keeps a stamp of the ledger rows it was built from
+# (COUNT and MAX(TransactionID) over its dates). A report first reads the
+# stamps of its closed buckets in one grouped query over the TransactionDate
+# index and rebuilds any bucket whose stamp moved, so back-dated movements
+# written by other workers or processes are picked up too. Movements
+# recorded in this process also drop their buckets right away.
+#
+# Usage (CLI):
+#   python -m reports --period month --group-by fuelType,township --from 2024-01-01 --out fuel.parquet
+
+import argparse
+import io
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+
+from cache import MasterDataUnavailable, master_data
+from locations import township_of
+
+REPORT_CHUNK_ROWS = int(os.getenv('REPORT_CHUNK_ROWS', '50000'))
+REPORT_CACHE_BUCKETS = int(os.getenv('REPORT_CACHE_BUCKETS', '5000')) # Closed buckets kept in memory
+
+PERIODS = {'day': 'D', 'week': 'W-SUN', 'month': 'M'} # Weeks start on Monday
+DIMENSIONS = ('fuelType', 'site', 'warehouse', 'township', 'transactionType')
+MEASURES = ['movements', 'quantity', 'fuelCost', 'transportationCost', 'loadingUnloadingCost',
+            'otherCost', 'landedCost']
+
+REPORT_QUERY = """
+    SELECT t.TransactionDate, t.TransactionType, t.FuelTypeID, t.DestinationLocationType, t.DestinationLocationID,
+           t.Quantity, p.Price, t.TransportationCost, t.LoadingUnloadingCost, t.OtherCost
+    FROM FuelTransactions t
+    LEFT JOIN FuelPrices p ON p.FuelPriceID = t.FuelPriceID
+    WHERE t.TransactionDate >= ? AND t.TransactionDate < ?
+"""
+
+# Ledger rows per day, for the stamps of cached buckets ({fuel_filter}: optional FuelTypeID)
+BUCKET_STAMPS_QUERY = """
+    SELECT CAST(TransactionDate AS DATE) AS Day, COUNT(*) AS Movements, MAX(TransactionID) AS LastTransactionID
+    FROM FuelTransactions
+    WHERE TransactionDate >= ? AND TransactionDate < ? {fuel_filter}
+    GROUP BY CAST(TransactionDate AS DATE)
+"""
+REPORT_COLUMNS = ['TransactionDate', 'TransactionType', 'FuelTypeID', 'DestinationLocationType',
+                  'DestinationLocationID', 'Quantity', 'Price', 'TransportationCost',
+                  'LoadingUnloadingCost', 'OtherCost']
+
+
+class ReportError(ValueError):
+    """Raised for an invalid report request (answered with a 400)."""
+
+
+def parse_group_by(raw):
+    """Reads a comma-separated groupBy list; defaults to fuelType."""
+    dimensions = [name.strip() for name in (raw or 'fuelType').split(',') if name.strip()]
+    unknown = [name for name in dimensions if name not in DIMENSIONS]
+    if unknown:
+        raise ReportError(f"Unknown groupBy dimension(s): {', '.join(unknown)}; "
+                          f"use {', '.join(DIMENSIONS)}")
+    return tuple(dict.fromkeys(dimensions))
+
+
+def period_start(day, period):
+    """First day of the period containing `day`."""
+    return pd.Period(day, freq=PERIODS[period]).start_time.date()
+
+
+def next_period(day, period):
+    """First day of the period after the one starting on `day`."""
+    return (pd.Period(day, freq=PERIODS[period]) + 1).start_time.date()
+
+
+def bucket_starts(start, end, period):
+    """Period start dates covering [start, end), widened to whole periods."""
+    starts = []
+    bucket = period_start(start, period)
+    while bucket < end:
+        starts.append(bucket)
+        bucket = next_period(bucket, period)
+    return starts
+
+
+# --- Location dimensions ---
+
+def _location_lookups():
+    """{WarehouseID: SiteID} and a township resolver, from the master data cache."""
+    try:
+        warehouses = master_data.get('warehouses').rows
+    except MasterDataUnavailable:
+        warehouses = []
+    warehouse_sites = {row["warehouseID"]: row["siteID"] for row in warehouses}
+
+    def township(location_type, location_id):
+        try:
+            return township_of(location_type, location_id)
+        except MasterDataUnavailable:
+            return None
+    return warehouse_sites, township
+
+
+def _add_dimensions(chunk, dimensions, lookups):
+    """Adds the requested dimension columns derived from each row's destination."""
+    warehouse_sites, township = lookups
+    destination_type = chunk['DestinationLocationType']
+    destination_id = chunk['DestinationLocationID']
+    is_site = destination_type == 'Site'
+    is_warehouse = destination_type == 'Warehouse'
+    if 'fuelType' in dimensions:
+        chunk['fuelType'] = chunk['FuelTypeID']
+    if 'transactionType' in dimensions:
+        chunk['transactionType'] = chunk['TransactionType']
+    if 'warehouse' in dimensions:
+        chunk['warehouse'] = destination_id.where(is_warehouse).astype('Int64')
+    if 'site' in dimensions:
+        # Warehouses on a site (WH4) count towards that site.
+        chunk['site'] = destination_id.where(is_site, destination_id.map(warehouse_sites).where(is_warehouse)).astype('Int64')
+    if 'township' in dimensions:
+        pairs = chunk[['DestinationLocationType', 'DestinationLocationID']].drop_duplicates()
+        townships = pd.Series(
+            [township(location_type, location_id) for location_type, location_id in pairs.itertuples(index=False)],
+            index=pd.MultiIndex.from_frame(pairs), dtype='Int64'
+        )
+        keys = pd.MultiIndex.from_frame(chunk[['DestinationLocationType', 'DestinationLocationID']])
+        chunk['township'] = townships.reindex(keys).to_numpy()
+    return chunk
+
+
+def _reduce_chunk(rows, period, dimensions, lookups):
+    """Turns one fetched chunk into per-(bucket, dimensions) sums."""
+    chunk = pd.DataFrame.from_records(rows, columns=REPORT_COLUMNS, coerce_float=True)
+    quantity = chunk['Quantity'].astype(float)
+    costs = chunk[['TransportationCost', 'LoadingUnloadingCost', 'OtherCost']].astype(float).fillna(0.0)
+    chunk = _add_dimensions(chunk, dimensions, lookups)
+    chunk['bucket'] = pd.to_datetime(chunk['TransactionDate']).dt.to_period(PERIODS[period]).dt.start_time.dt.date
+    chunk['movements'] = 1
+    chunk['quantity'] = quantity
+    chunk['fuelCost'] = quantity * chunk['Price'].astype(float) # NaN without a price
+    chunk['transportationCost'] = costs['TransportationCost']
+    chunk['loadingUnloadingCost'] = costs['LoadingUnloadingCost']
+    chunk['otherCost'] = costs['OtherCost']
+    chunk['landedCost'] = chunk['fuelCost'].fillna(0.0) + costs.sum(axis=1)
+    keys = ['bucket', *dimensions]
+    return chunk.groupby(keys, dropna=False, sort=False)[MEASURES].sum(min_count=1)
+
+
+def _empty_result(dimensions):
+    index = pd.MultiIndex.from_arrays([[] for _ in range(1 + len(dimensions))], names=['bucket', *dimensions])
+    return pd.DataFrame(columns=MEASURES, index=index, dtype=float)
+
+
+def aggregate_transactions(cursor, period, dimensions, start, end, fuel_type_id=None):
+    """Reads transactions dated in [start, end) chunk by chunk; returns summed measures.
+
+    The result is indexed by (bucket, *dimensions) with one column per measure.
+    """
+    sql, params = REPORT_QUERY, [datetime.combine(start, time()), datetime.combine(end, time())]
+    if fuel_type_id is not None:
+        sql += " AND t.FuelTypeID = ?"
+        params.append(fuel_type_id)
+    cursor.execute(sql, *params)
+    lookups = _location_lookups()
+    partials = []
+    while True:
+        rows = cursor.fetchmany(REPORT_CHUNK_ROWS)
+        if not rows:
+            break
+        partials.append(_reduce_chunk(rows, period, dimensions, lookups))
+    if not partials:
+        return _empty_result(dimensions)
+    combined = pd.concat(partials)
+    if len(partials) > 1:
+        combined = combined.groupby(level=list(range(combined.index.nlevels)), dropna=False).sum(min_count=1)
+    return combined
+
+
+# --- Closed-period cache ---
+
+def bucket_stamps(cursor, period, start, end, fuel_type_id=None):
+    """{bucket start: (movements, last TransactionID)} for the buckets in [start, end) holding rows."""
+    fuel_filter, params = "", [datetime.combine(start, time()), datetime.combine(end, time())]
+    if fuel_type_id is not None:
+        fuel_filter = "AND FuelTypeID = ?"
+        params.append(fuel_type_id)
+    cursor.execute(BUCKET_STAMPS_QUERY.format(fuel_filter=fuel_filter), *params)
+    stamps = {}
+    for row in cursor.fetchall():
+        bucket = period_start(row.Day, period)
+        movements, last = stamps.get(bucket, (0, 0))
+        stamps[bucket] = (movements + row.Movements, max(last, row.LastTransactionID))
+    return stamps
+
+
+class ReportCache:
+    """LRU cache of aggregated closed buckets, keyed by report shape and bucket start.
+
+    Entries carry the ledger stamp they were built from; get() treats an
+    entry with a different stamp as a miss and drops it.
+    """
+
+    def __init__(self, max_buckets=REPORT_CACHE_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict() # (shape, bucket) -> (frame, stamp)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+
+    def get(self, shape, bucket, stamp):
+        with self._lock:
+            entry = self._buckets.get((shape, bucket))
+            if entry is not None and entry[1] != stamp:
+                del self._buckets[(shape, bucket)]
+                self._stale += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._buckets.move_to_end((shape, bucket))
+            self._hits += 1
+            return entry[0]
+
+    def put(self, shape, bucket, frame, stamp):
+        with self._lock:
+            self._buckets[(shape, bucket)] = (frame, stamp)
+            self._buckets.move_to_end((shape, bucket))
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+    def invalidate(self, since=None):
+        """Drops buckets that may contain days on or after `since` (everything when None)."""
+        with self._lock:
+            if since is None:
+                self._buckets.clear()
+                return
+            for key in [key for key in self._buckets if next_period(key[1], key[0][0]) > since]:
+                del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {"buckets": len(self._buckets), "hits": self._hits, "misses": self._misses, "stale": self._stale}
+
+
+report_cache = ReportCache()
+
+
+def invalidate_reports(movements):
+    """Drops cached buckets that committed movements fall into."""
+    if movements:
+        report_cache.invalidate(min(movement.transaction_date for movement in movements).date())
+
+
+def consumption_report(conn, period, dimensions, start, end, fuel_type_id=None, today=None):
+    """Builds the report for dates [start, end), widened to whole periods.
+
+    Closed buckets come from report_cache where their ledger stamp still
+    matches; the contiguous range of missing, stale or open buckets is
+    aggregated in one pass. Returns a flat DataFrame with a 'period'
+    column, the dimensions and the measures.
+    """
+    if period not in PERIODS:
+        raise ReportError(f"period must be one of {', '.join(PERIODS)}")
+    today = today or date.today()
+    starts = bucket_starts(start, end, period)
+    current = period_start(today, period)
+    shape = (period, dimensions, fuel_type_id)
+    closed = [bucket for bucket in starts if bucket < current]
+    cursor = conn.cursor()
+    # Read before aggregating: a movement committed in between makes the stamp older, never newer.
+    stamps = bucket_stamps(cursor, period, closed[0], next_period(closed[-1], period), fuel_type_id) if closed else {}
+
+    frames, missing = [], []
+    for bucket in starts:
+        cached = report_cache.get(shape, bucket, stamps.get(bucket, (0, 0))) if bucket < current else None
+        if cached is None:
+            missing.append(bucket)
+        else:
+            frames.append(cached)
+
+    if missing:
+        fresh = aggregate_transactions(cursor, period, dimensions, missing[0],
+                                       next_period(missing[-1], period), fuel_type_id)
+        buckets = fresh.index.get_level_values('bucket')
+        for bucket in missing:
+            part = fresh[buckets == bucket]
+            if bucket < current:
+                report_cache.put(shape, bucket, part, stamps.get(bucket, (0, 0)))
+            frames.append(part)
+
+    result = pd.concat(frames) if frames else _empty_result(dimensions)
+    result = result.sort_index().reset_index().rename(columns={'bucket': 'period'})
+    result['movements'] = result['movements'].fillna(0).astype(int)
+    return result
+
+
+# --- Output ---
+
+def label_report(frame, dimensions):
+    """Adds *Name columns for the ID dimensions from the master data cache."""
+    labels = {
+        'fuelType': ('fuelTypes', 'fuelTypeID', 'fuelTypeName'),
+        'site': ('sites', 'siteID', 'siteName'),
+        'warehouse': ('warehouses', 'warehouseID', 'warehouseName'),
+        'township': ('townships', 'townshipID', 'townshipName'),
+    }
+    frame = frame.copy()
+    for dimension in dimensions:
+        if dimension not in labels:
+            continue
+        name, key, label = labels[dimension]
+        try:
+            names = {row[key]: row[label] for row in master_data.get(name).rows}
+        except MasterDataUnavailable:
+            names = {}
+        position = frame.columns.get_loc(dimension) + 1
+        frame.insert(position, dimension + 'Name', frame[dimension].map(names))
+        frame = frame.rename(columns={dimension: key})
+    return frame
+
+
+def report_records(frame):
+    """JSON-ready rows: ISO periods, None instead of NaN, money rounded to cents."""
+    frame = frame.copy()
+    frame['period'] = [bucket.isoformat() for bucket in frame['period']]
+    money = [column for column in MEASURES if column not in ('movements',)]
+    frame[money] = frame[money].round(2)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict('records')
+
+
+def report_csv(frame):
+    return frame.to_csv(index=False, float_format='%.2f')
+
+
+def report_parquet(frame):
+    """Parquet bytes (requires pyarrow or fastparquet)."""
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a consumption and cost report.")
+    parser.add_argument('--period', choices=list(PERIODS), default='month')
+    parser.add_argument('--group-by', default='fuelType', help=f"Comma-separated: {', '.join(DIMENSIONS)}")
+    parser.add_argument('--from', dest='start', type=date.fromisoformat, required=True,
+                        help="First day (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat, help="Last day, inclusive (default: today)")
+    parser.add_argument('--fuel-type', type=int, help="Only this FuelTypeID")
+    parser.add_argument('--out', required=True, help="Output file (.csv or .parquet)")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    dimensions = parse_group_by(args.group_by)
+    end = (args.end or date.today()) + timedelta(days=1)
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        frame = label_report(consumption_report(conn, args.period, dimensions, args.start, end, args.fuel_type),
+                             dimensions)
+    if args.out.endswith('.parquet'):
+        with open(args.out, 'wb') as handle:
+            handle.write(report_parquet(frame))
+    else:
+        frame.to_csv(args.out, index=False, float_format='%.2f')
+    print(f"Wrote {len(frame)} rows to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -13,6 +13,9 @@ GO
 
 -- Drop tables if they exist to ensure a clean slate for recreation
 -- Drop in reverse dependency order
+IF OBJECT_ID('PriceFluctuationRebuilds', 'U') IS NOT NULL DROP TABLE PriceFluctuationRebuilds;
+IF OBJECT_ID('SupplyForecasts', 'U') IS NOT NULL DROP TABLE SupplyForecasts;
+IF OBJECT_ID('InventorySnapshots', 'U') IS NOT NULL DROP TABLE InventorySnapshots;
 IF OBJECT_ID('FuelInventory', 'U') IS NOT NULL DROP TABLE FuelInventory;
 IF OBJECT_ID('FuelTransactions', 'U') IS NOT NULL DROP TABLE FuelTransactions;
 IF OBJECT_ID('PriceFluctuations', 'U') IS NOT NULL DROP TABLE PriceFluctuations;
@@ -174,6 +177,7 @@ CREATE TABLE FuelInventory (
     LocationType NVARCHAR(20) NOT NULL, -- 'Warehouse', 'Site'
     LocationID INT NOT NULL, -- ID from Warehouses or Sites table based on LocationType
     CurrentStock DECIMAL(18,2) NOT NULL DEFAULT 0,
+    AverageUnitCost DECIMAL(18,6) NOT NULL DEFAULT 0, -- Moving weighted-average cost per unit (valuation.py)
     LastUpdated DATETIME DEFAULT GETDATE(),
     CreatedAt DATETIME DEFAULT GETDATE(),
     CONSTRAINT UQ_FuelInventory_LocationTypeID UNIQUE (FuelTypeID, LocationType, LocationID),
@@ -183,11 +187,80 @@ CREATE TABLE FuelInventory (
 );
 GO
 
+-- 10. InventorySnapshots Table
+-- Periodic copies of FuelInventory balances for point-in-time (asOf) queries.
+-- A snapshot at SnapshotAt holds the balance after every transaction dated before it.
+CREATE TABLE InventorySnapshots (
+    SnapshotID INT PRIMARY KEY IDENTITY(1,1),
+    SnapshotAt DATETIME NOT NULL,
+    FuelTypeID INT NOT NULL,
+    LocationType NVARCHAR(20) NOT NULL, -- 'Warehouse', 'Site'
+    LocationID INT NOT NULL,
+    Stock DECIMAL(18,2) NOT NULL,
+    CreatedAt DATETIME DEFAULT GETDATE(),
+    CONSTRAINT UQ_InventorySnapshots_AtLocation UNIQUE (SnapshotAt, FuelTypeID, LocationType, LocationID),
+    CONSTRAINT FK_InventorySnapshots_FuelTypes FOREIGN KEY (FuelTypeID) REFERENCES FuelTypes(FuelTypeID)
+);
+GO
+
+-- 11. SupplyForecasts Table
+-- Days of supply and suggested reorder quantity per FuelInventory row, from rolling
+-- 7/30/90-day outflow averages (forecast.py). Rates are computed for whole days before AsOfDate.
+CREATE TABLE SupplyForecasts (
+    ForecastID INT PRIMARY KEY IDENTITY(1,1),
+    FuelTypeID INT NOT NULL,
+    LocationType NVARCHAR(20) NOT NULL, -- 'Warehouse', 'Site'
+    LocationID INT NOT NULL,
+    CurrentStock DECIMAL(18,2) NOT NULL,
+    Outflow7Days DECIMAL(18,4) NOT NULL, -- Average quantity leaving the location per day
+    Outflow30Days DECIMAL(18,4) NOT NULL,
+    Outflow90Days DECIMAL(18,4) NOT NULL,
+    DailyOutflow DECIMAL(18,4) NOT NULL, -- Rate the forecast uses (highest window average)
+    DaysOfSupply DECIMAL(18,2) NULL, -- NULL when nothing leaves the location
+    ReorderQuantity DECIMAL(18,2) NOT NULL,
+    AsOfDate DATE NOT NULL,
+    ComputedAt DATETIME NOT NULL,
+    ThroughTransactionID INT NOT NULL DEFAULT 0, -- MAX(FuelTransactions.TransactionID) the row reflects
+    CONSTRAINT UQ_SupplyForecasts_Location UNIQUE (FuelTypeID, LocationType, LocationID),
+    CONSTRAINT FK_SupplyForecasts_FuelTypes FOREIGN KEY (FuelTypeID) REFERENCES FuelTypes(FuelTypeID)
+);
+GO
+
+-- 12. PriceFluctuationRebuilds Table
+-- One row per PriceFluctuations rebuild (fluctuations.py): the rebuild deleted the range's rows
+-- up to ReplacedThroughID and re-inserted them under new IDs. GET /api/changes reports these so
+-- clients syncing fluctuations drop the replaced rows.
+CREATE TABLE PriceFluctuationRebuilds (
+    RebuildID INT PRIMARY KEY IDENTITY(1,1),
+    FuelTypeID INT NULL, -- NULL when every fuel type was rebuilt
+    FromDate DATE NULL, -- NULL: from the beginning of history
+    ToDate DATE NULL, -- Exclusive; NULL: through the latest price
+    ReplacedThroughID INT NOT NULL, -- MAX(FluctuationID) before the rebuild
+    RebuiltAt DATETIME DEFAULT GETDATE(),
+    CONSTRAINT FK_PriceFluctuationRebuilds_FuelTypes FOREIGN KEY (FuelTypeID) REFERENCES FuelTypes(FuelTypeID)
+);
+GO
+
 -- Create Indexes for performance optimization
+-- The list endpoints page with keyset seeks on (date DESC, id DESC), so the id is part
+-- of each key to give a stable, fully index-ordered scan.
 CREATE INDEX IX_FuelPrices_FuelTypeID_EffectiveDate ON FuelPrices (FuelTypeID, EffectiveDate DESC);
-CREATE INDEX IX_FuelTransactions_TransactionDate ON FuelTransactions (TransactionDate DESC);
-CREATE INDEX IX_FuelTransactions_FuelTypeID ON FuelTransactions (FuelTypeID);
-CREATE INDEX IX_FuelInventory_Location ON FuelInventory (LocationType, LocationID);
+CREATE INDEX IX_FuelTransactions_TransactionDate ON FuelTransactions (TransactionDate DESC, TransactionID DESC);
+CREATE INDEX IX_FuelTransactions_FuelTypeID ON FuelTransactions (FuelTypeID, TransactionDate DESC, TransactionID DESC);
+CREATE INDEX IX_FuelTransactions_Source ON FuelTransactions (SourceLocationType, SourceLocationID, TransactionDate DESC, TransactionID DESC);
+CREATE INDEX IX_FuelTransactions_Destination ON FuelTransactions (DestinationLocationType, DestinationLocationID, TransactionDate DESC, TransactionID DESC);
+CREATE INDEX IX_PriceFluctuations_FluctuationDate ON PriceFluctuations (FluctuationDate DESC, FluctuationID DESC)
+    INCLUDE (FuelTypeID, CurrentPrice, PreviousPrice, FluctuationAmount, FluctuationType);
+CREATE INDEX IX_PriceFluctuations_FuelTypeID_FluctuationDate ON PriceFluctuations (FuelTypeID, FluctuationDate DESC, FluctuationID DESC)
+    INCLUDE (CurrentPrice, PreviousPrice, FluctuationAmount, FluctuationType);
+-- Covers the stock value by location read (valuation.py).
+CREATE INDEX IX_FuelInventory_Location ON FuelInventory (LocationType, LocationID)
+    INCLUDE (FuelTypeID, CurrentStock, AverageUnitCost);
+-- Back-dated transactions adjust the snapshots of one location taken after them.
+CREATE INDEX IX_InventorySnapshots_Location ON InventorySnapshots (FuelTypeID, LocationType, LocationID, SnapshotAt);
+-- The low-stock endpoint pages through forecasts in DaysOfSupply order.
+CREATE INDEX IX_SupplyForecasts_DaysOfSupply ON SupplyForecasts (DaysOfSupply, FuelTypeID, LocationType, LocationID)
+    INCLUDE (CurrentStock, DailyOutflow, ReorderQuantity);
 GO
 
 -- Example Data Insertion (Optional, for testing)
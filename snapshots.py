@@ -0,0 +1,294 @@
+# Inventory Snapshots (snapshots.py)
+#
+# FuelInventory only holds current balances. To answer "what was in stock
+# at location X at time T" without replaying the whole ledger, balances are
+# written to InventorySnapshots at fixed boundaries (every
+# SNAPSHOT_INTERVAL_HOURS, aligned to midnight). A snapshot at T holds the
+# balance after every movement dated before T.
+#
+# An as-of query loads the nearest snapshot at or before T and replays only
+# the movements dated between it and T, so its cost is bounded by one
+# snapshot interval of ledger rows rather than by the length of history.
+# Movements dated before an existing snapshot (back-dated entries) adjust
+# the later snapshots in the same transaction, which keeps them exact.
+#
+# Usage (CLI, e.g. from cron):
+#   python -m snapshots                         # snapshot the latest boundary if missing
+#   python -m snapshots --backfill-from 2024-01-01
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from db import run_in_transaction
+
+SNAPSHOT_INTERVAL_HOURS = float(os.getenv('SNAPSHOT_INTERVAL_HOURS', '24'))
+SNAPSHOT_CHECK_SECONDS = float(os.getenv('SNAPSHOT_CHECK_SECONDS', '600')) # Scheduler polling interval
+
+ROWS_PER_STATEMENT = 500
+
+SNAPSHOT_EPOCH = datetime(2000, 1, 3) # A Monday, so weekly intervals start on Mondays
+
+# Net effect of ledger rows on each (FuelTypeID, LocationType, LocationID):
+# destinations are credited, stocked sources debited.
+LEDGER_DELTAS_SQL = """
+    SELECT FuelTypeID, LocationType, LocationID, SUM(Delta) AS Delta, COUNT(*) AS Entries
+    FROM (
+        SELECT FuelTypeID, DestinationLocationType AS LocationType, DestinationLocationID AS LocationID,
+               Quantity AS Delta
+        FROM FuelTransactions
+        {destination_where}
+        UNION ALL
+        SELECT FuelTypeID, SourceLocationType, SourceLocationID, -Quantity
+        FROM FuelTransactions
+        WHERE SourceLocationType IN ('Warehouse', 'Site') {source_and}
+    ) entries
+    GROUP BY FuelTypeID, LocationType, LocationID
+"""
+
+
+def snapshot_interval():
+    return timedelta(hours=SNAPSHOT_INTERVAL_HOURS)
+
+
+def snapshot_boundary(moment, interval=None):
+    """The latest snapshot boundary at or before `moment`."""
+    interval = interval or snapshot_interval()
+    return SNAPSHOT_EPOCH + ((moment - SNAPSHOT_EPOCH) // interval) * interval
+
+
+def _conditions(prefix, start, end, fuel_type_id, location_type, location_id):
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("TransactionDate >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("TransactionDate < ?")
+        params.append(end)
+    if fuel_type_id is not None:
+        conditions.append("FuelTypeID = ?")
+        params.append(fuel_type_id)
+    if location_type is not None:
+        conditions.append(f"{prefix}LocationType = ?")
+        params.append(location_type)
+    if location_id is not None:
+        conditions.append(f"{prefix}LocationID = ?")
+        params.append(location_id)
+    return conditions, params
+
+
+def ledger_deltas(cursor, start=None, end=None, fuel_type_id=None, location_type=None, location_id=None):
+    """Sums movements dated in [start, end) per inventory key.
+
+    Returns ({(FuelTypeID, LocationType, LocationID): delta}, ledger entries read).
+    """
+    destination, destination_params = _conditions('Destination', start, end, fuel_type_id,
+                                                   location_type, location_id)
+    source, source_params = _conditions('Source', start, end, fuel_type_id, location_type, location_id)
+    sql = LEDGER_DELTAS_SQL.format(
+        destination_where=("WHERE " + " AND ".join(destination)) if destination else "",
+        source_and="".join(" AND " + condition for condition in source),
+    )
+    cursor.execute(sql, *destination_params, *source_params)
+    deltas, entries = {}, 0
+    for row in cursor.fetchall():
+        deltas[(row.FuelTypeID, row.LocationType, row.LocationID)] = float(row.Delta)
+        entries += row.Entries
+    return deltas, entries
+
+
+def _insert_snapshot(cursor, at, balances):
+    rows = [(at, *key, round(stock, 2)) for key, stock in sorted(balances.items())]
+    cursor.fast_executemany = True
+    for offset in range(0, len(rows), ROWS_PER_STATEMENT):
+        cursor.executemany(
+            "INSERT INTO InventorySnapshots (SnapshotAt, FuelTypeID, LocationType, LocationID, Stock) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows[offset:offset + ROWS_PER_STATEMENT]
+        )
+    return len(rows)
+
+
+def _snapshot_exists(cursor, at):
+    cursor.execute("SELECT TOP 1 SnapshotAt FROM InventorySnapshots WHERE SnapshotAt = ?", at)
+    return cursor.fetchone() is not None
+
+
+def _balances_at(cursor, at):
+    """Current balances minus everything dated at or after `at`.
+
+    Reads FuelInventory with UPDLOCK, HOLDLOCK so no movement can commit
+    between the balance read and the snapshot insert.
+    """
+    cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock "
+                   "FROM FuelInventory WITH (UPDLOCK, HOLDLOCK)")
+    balances = {(row.FuelTypeID, row.LocationType, row.LocationID): float(row.CurrentStock)
+                for row in cursor.fetchall()}
+    later, _ = ledger_deltas(cursor, start=at)
+    for key, delta in later.items():
+        balances[key] = balances.get(key, 0.0) - delta
+    return balances
+
+
+def take_snapshot(conn, at=None):
+    """Writes the snapshot for boundary `at` (default: the latest one) unless it exists.
+
+    Returns {"snapshotAt", "rows"}; rows is 0 when the snapshot already existed.
+    """
+    at = at or snapshot_boundary(datetime.now())
+
+    def work(cursor):
+        if _snapshot_exists(cursor, at):
+            return 0
+        return _insert_snapshot(cursor, at, _balances_at(cursor, at))
+
+    return {"snapshotAt": at.isoformat(), "rows": run_in_transaction(conn, work)}
+
+
+def backfill(conn, start, interval=None):
+    """Writes every missing snapshot from the boundary at `start` up to now.
+
+    Walks backwards from the latest boundary, subtracting one interval of
+    movements per step, so the ledger is read once in total.
+    """
+    interval = interval or snapshot_interval()
+    boundaries = []
+    at = snapshot_boundary(datetime.now(), interval)
+    first = snapshot_boundary(datetime.combine(start, datetime.min.time()), interval)
+    while at >= first:
+        boundaries.append(at)
+        at -= interval
+
+    def work(cursor):
+        written = 0
+        balances = _balances_at(cursor, boundaries[0])
+        for position, at in enumerate(boundaries):
+            if position:
+                moved, _ = ledger_deltas(cursor, start=at, end=boundaries[position - 1])
+                for key, delta in moved.items():
+                    balances[key] = balances.get(key, 0.0) - delta
+            if not _snapshot_exists(cursor, at):
+                written += _insert_snapshot(cursor, at, balances)
+        return written
+
+    written = run_in_transaction(conn, work) if boundaries else 0
+    return {"snapshots": len(boundaries), "rows": written,
+            "from": boundaries[-1].isoformat() if boundaries else None,
+            "to": boundaries[0].isoformat() if boundaries else None}
+
+
+def adjust_snapshots(cursor, movements):
+    """Folds movements dated before the latest snapshot into the snapshots after them.
+
+    Runs on the writer's cursor after its inventory updates, so a snapshot
+    being taken concurrently either includes these movements or is visible here.
+    """
+    cursor.execute("SELECT TOP 1 SnapshotAt FROM InventorySnapshots ORDER BY SnapshotAt DESC")
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    horizon = row.SnapshotAt
+    adjusted = 0
+    for movement in movements:
+        if movement.transaction_date >= horizon:
+            continue
+        steps = [(movement.destination_key, movement.quantity)]
+        if movement.source_location_type in ('Warehouse', 'Site'):
+            steps.append((movement.source_key, -movement.quantity))
+        for key, delta in steps:
+            cursor.execute(
+                "UPDATE InventorySnapshots SET Stock = Stock + ? "
+                "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ? AND SnapshotAt > ?",
+                delta, *key, movement.transaction_date
+            )
+            adjusted += cursor.rowcount
+            # Snapshots taken before this location held stock have no row for it yet.
+            cursor.execute(
+                "INSERT INTO InventorySnapshots (SnapshotAt, FuelTypeID, LocationType, LocationID, Stock) "
+                "SELECT DISTINCT s.SnapshotAt, ?, ?, ?, ? FROM InventorySnapshots s "
+                "WHERE s.SnapshotAt > ? AND NOT EXISTS (SELECT 1 FROM InventorySnapshots x "
+                "WHERE x.SnapshotAt = s.SnapshotAt AND x.FuelTypeID = ? AND x.LocationType = ? AND x.LocationID = ?)",
+                *key, delta, movement.transaction_date, *key
+            )
+            adjusted += cursor.rowcount
+    return adjusted
+
+
+def inventory_as_of(cursor, as_of, fuel_type_id=None, location_type=None, location_id=None):
+    """Balances at `as_of` from the nearest earlier snapshot plus the ledger since.
+
+    Returns ({key: stock}, snapshot time or None, ledger entries replayed).
+    """
+    cursor.execute("SELECT TOP 1 SnapshotAt FROM InventorySnapshots WHERE SnapshotAt <= ? "
+                   "ORDER BY SnapshotAt DESC", as_of)
+    row = cursor.fetchone()
+    snapshot_at = row.SnapshotAt if row else None
+
+    balances = {}
+    if snapshot_at is not None:
+        conditions, params = ["SnapshotAt = ?"], [snapshot_at]
+        for column, value in (("FuelTypeID", fuel_type_id), ("LocationType", location_type),
+                              ("LocationID", location_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        cursor.execute("SELECT FuelTypeID, LocationType, LocationID, Stock FROM InventorySnapshots "
+                       "WHERE " + " AND ".join(conditions), *params)
+        balances = {(row.FuelTypeID, row.LocationType, row.LocationID): float(row.Stock)
+                    for row in cursor.fetchall()}
+
+    moved, entries = ledger_deltas(cursor, snapshot_at, as_of, fuel_type_id, location_type, location_id)
+    for key, delta in moved.items():
+        balances[key] = balances.get(key, 0.0) + delta
+    return balances, snapshot_at, entries
+
+
+def start_scheduler(connect, check_every=SNAPSHOT_CHECK_SECONDS):
+    """Starts a daemon thread that takes the due snapshot every `check_every` seconds.
+
+    `connect` is a context manager factory such as db.db_connection. Does
+    nothing when SNAPSHOT_INTERVAL_HOURS is 0.
+    """
+    if SNAPSHOT_INTERVAL_HOURS <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                with connect() as conn:
+                    if conn is not None:
+                        take_snapshot(conn)
+            except Exception as ex: # Another process may have written the same boundary
+                print(f"Error taking inventory snapshot: {ex}")
+            time.sleep(check_every)
+
+    thread = threading.Thread(target=run, name='inventory-snapshots', daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write inventory snapshots.")
+    parser.add_argument('--backfill-from', type=date.fromisoformat,
+                        help="Also write every missing snapshot since this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    from db import db_connection # Deferred so --help works without a database driver
+
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        if args.backfill_from:
+            result = backfill(conn, args.backfill_from)
+        else:
+            result = take_snapshot(conn)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,93 @@
+# Streaming List Exports (streaming.py)
+#
+# Large list endpoints can stream their full result instead of returning one
+# page: rows are read from the cursor with fetchmany() in fixed batches and
+# written to the client as they arrive, so memory stays flat and the first
+# byte goes out as soon as the first batch is read.
+#
+# Request a stream with `Accept: application/x-ndjson` (one JSON object per
+# line) or `?stream=1` (a chunked JSON array; add `&format=ndjson` for NDJSON).
+# Each batch is converted and encoded by the endpoint's RowPlan (serialize.py).
+
+import os
+from contextlib import ExitStack
+
+import pyodbc
+from flask import Response, jsonify
+
+from db import db_connection
+from serialize import dumps
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def stream_format(req):
+    """Returns 'ndjson', 'json' or None (no streaming) for the current request."""
+    if req.accept_mimetypes.best == NDJSON_MIMETYPE or req.args.get('format') == 'ndjson':
+        return 'ndjson'
+    if req.args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def _ndjson_chunks(cursor, plan, label):
+    while True:
+        try:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+        except pyodbc.Error as ex:
+            print(f"Error streaming {label}: {ex}")
+            yield dumps({"error": f"Failed to stream {label}"}) + b'\n'
+            return
+        if not rows:
+            return
+        yield plan.encode_lines(cursor, rows)
+
+
+def _json_array_chunks(cursor, plan, label):
+    yield b'['
+    first = True
+    while True:
+        try:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+        except pyodbc.Error as ex:
+            # Headers are already sent; ending without ']' makes the body invalid JSON,
+            # which is how the client learns the export was cut short.
+            print(f"Error streaming {label}: {ex}")
+            return
+        if not rows:
+            break
+        chunk = plan.encode(cursor, rows)[1:-1] # Drop the batch's own brackets
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']'
+
+
+def stream_response(sql, params, plan, label, fmt):
+    """Runs `sql` and streams every row, converted with the RowPlan `plan`.
+
+    The query is executed before the response starts so connection and SQL
+    errors still produce a normal 500. The pooled connection stays checked
+    out until the response is closed (finished or client disconnected).
+    """
+    resources = ExitStack()
+    conn = resources.enter_context(db_connection())
+    if conn is None:
+        resources.close()
+        return jsonify({"error": "Database connection failed"}), 500
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, *params)
+    except pyodbc.Error as ex:
+        resources.close()
+        print(f"Error fetching {label}: {ex}")
+        return jsonify({"error": f"Failed to fetch {label}"}), 500
+
+    if fmt == 'ndjson':
+        response = Response(_ndjson_chunks(cursor, plan, label), mimetype=NDJSON_MIMETYPE)
+    else:
+        response = Response(_json_array_chunks(cursor, plan, label), mimetype='application/json')
+    response.call_on_close(resources.close)
+    response.headers['X-Accel-Buffering'] = 'no' # Let reverse proxies pass chunks straight through
+    return response
@@ -0,0 +1,216 @@
+# Per-Request SQL Tracing (tracing.py)
+#
+# Every statement a request runs through an instrumented cursor (see
+# metrics.py) is recorded on the request's trace: SQL text with literals
+# redacted (bound parameters are only counted, never stored), where in the
+# code it was issued, execute and fetch time and rows fetched.
+#
+# When the response goes out it carries a Server-Timing header splitting
+# the request into connect / execute / fetch / JSON time. When the response
+# closes, statements slower than SLOW_QUERY_MS are written to a rotating
+# slow-query log with their origin, and so are requests that ran more than
+# QUERY_BUDGET statements. Server-Timing is sent before a streamed body, so
+# for streamed lists it only covers the work done up to the first chunk.
+
+import logging
+import logging.handlers
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+
+TRACE_REQUESTS = os.getenv('TRACE_REQUESTS', '1') not in ('0', 'false')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '500'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'slow_queries.log') # Empty string: log to stderr
+SLOW_QUERY_LOG_BYTES = int(os.getenv('SLOW_QUERY_LOG_BYTES', str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', '5'))
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', '25')) # Statements per request before it is flagged
+
+TRACE_MAX_QUERIES = 1000 # Statements kept per trace; later ones are only counted
+ORIGIN_FRAMES = 3        # Application frames recorded as a statement's origin
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.join(_APP_DIR, 'metrics.py'), os.path.join(_APP_DIR, 'tracing.py')}
+
+_LITERAL = re.compile(r"N?'(?:[^']|'')*'|(?<![\w.])\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def redact(sql):
+    """Collapses whitespace and replaces string and number literals with '?'."""
+    return _LITERAL.sub('?', _WHITESPACE.sub(' ', sql).strip())
+
+
+def _origin():
+    """The innermost application frames outside the instrumentation, innermost first."""
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < ORIGIN_FRAMES:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and filename not in _SKIP_FILES:
+            frames.append((os.path.relpath(filename, _APP_DIR), frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    return tuple(frames)
+
+
+class QueryRecord:
+    """One executed statement; the instrumented cursor fills in the timings."""
+
+    __slots__ = ('sql', 'params', 'origin', 'execute_seconds', 'fetch_seconds', 'rows')
+
+    def __init__(self, sql, params, origin):
+        self.sql = sql
+        self.params = params
+        self.origin = origin
+        self.execute_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.rows = 0
+
+    @property
+    def seconds(self):
+        return self.execute_seconds + self.fetch_seconds
+
+
+class RequestTrace:
+    """Statements and phase timings of one request."""
+
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = []
+        self.query_count = 0
+        self.timings = {'connect': 0.0, 'json': 0.0}
+
+    def query(self, sql, params):
+        """Starts a record for a statement executed with `params` bound parameters."""
+        self.query_count += 1
+        record = QueryRecord(sql, params, _origin())
+        if len(self.queries) < TRACE_MAX_QUERIES:
+            self.queries.append(record)
+        return record
+
+    def add(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def over_budget(self):
+        return QUERY_BUDGET > 0 and self.query_count > QUERY_BUDGET
+
+    def server_timing(self):
+        """Server-Timing header value for the work done so far (milliseconds)."""
+        execute = sum(record.execute_seconds for record in self.queries)
+        fetch = sum(record.fetch_seconds for record in self.queries)
+        entries = [
+            f'connect;dur={self.timings["connect"] * 1000:.1f}',
+            f'db;desc="{self.query_count} queries";dur={execute * 1000:.1f}',
+            f'fetch;dur={fetch * 1000:.1f}',
+            f'json;dur={self.timings["json"] * 1000:.1f}',
+            f'app;dur={(time.perf_counter() - self.started) * 1000:.1f}',
+        ]
+        if self.over_budget():
+            entries.append(f'budget;desc="over query budget of {QUERY_BUDGET}"')
+        return ', '.join(entries)
+
+
+# --- Current trace ---
+
+_local = threading.local()
+
+
+def current_trace():
+    """The trace of the request being handled on this thread, or None."""
+    return getattr(_local, 'trace', None)
+
+
+def start_trace(method, route):
+    _local.trace = trace = RequestTrace(method, route)
+    return trace
+
+
+def end_trace(trace):
+    """Detaches `trace` from the thread and logs its slow statements."""
+    if getattr(_local, 'trace', None) is trace:
+        _local.trace = None
+    log_slow(trace)
+
+
+# --- Slow-query log ---
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def slow_query_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                logger = logging.getLogger('fuelinventory.slowqueries')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                if SLOW_QUERY_LOG:
+                    handler = logging.handlers.RotatingFileHandler(
+                        SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS,
+                        encoding='utf-8', delay=True
+                    )
+                else:
+                    handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def _format_origin(origin):
+    return ' <- '.join(f'{filename}:{line} {function}' for filename, line, function in origin) or 'unknown'
+
+
+def log_slow(trace):
+    """Logs the trace's statements over SLOW_QUERY_MS and an over-budget warning."""
+    threshold = SLOW_QUERY_MS / 1000
+    slow = [record for record in trace.queries if record.seconds >= threshold]
+    if not slow and not trace.over_budget():
+        return
+    logger = slow_query_logger()
+    request_label = f'{trace.method} {trace.route}'
+    for record in slow:
+        logger.warning(
+            "slow query %.1f ms (execute %.1f ms, fetch %.1f ms, %d rows) in %s at %s | %s [%d params redacted]",
+            record.seconds * 1000, record.execute_seconds * 1000, record.fetch_seconds * 1000, record.rows,
+            request_label, _format_origin(record.origin), redact(record.sql), record.params
+        )
+    if trace.over_budget():
+        statements = {}
+        for record in trace.queries:
+            key = (record.sql, record.origin[:1])
+            statements[key] = statements.get(key, 0) + 1
+        (sql, origin), repeats = max(statements.items(), key=lambda item: item[1])
+        logger.warning(
+            "query budget exceeded: %s ran %d statements (budget %d); most repeated (%dx) at %s | %s",
+            request_label, trace.query_count, QUERY_BUDGET, repeats, _format_origin(origin), redact(sql)
+        )
+
+
+# --- Flask integration ---
+
+def trace_requests(app):
+    """Traces every request's SQL and adds the Server-Timing header."""
+    if not TRACE_REQUESTS:
+        return
+    from flask import request
+
+    @app.before_request
+    def begin_trace():
+        start_trace(request.method, request.url_rule.rule if request.url_rule is not None else 'unmatched')
+
+    @app.after_request
+    def add_server_timing(response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.call_on_close(lambda: end_trace(trace))
+        return response
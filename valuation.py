@@ -0,0 +1,299 @@
+# Inventory Valuation (valuation.py)
+#
+# FuelInventory.AverageUnitCost carries the moving weighted-average cost of
+# the stock held at each (fuel type, location), so the value of a location's
+# stock is CurrentStock * AverageUnitCost, read straight from its inventory
+# rows through IX_FuelInventory_Location.
+#
+# Costing rules, applied in ledger (TransactionID) order:
+#   - A supplier delivery arrives at its FuelPrices price, or at the
+#     destination's current average when it has no price.
+#   - A transfer leaves its source at the source's average cost, which does
+#     not change, and arrives at that cost.
+#   - Transportation, loading/unloading and other costs are added to the
+#     value received.
+#   - The destination's new average is (stock x average + value received) /
+#     (stock + quantity); a destination without stock takes the received
+#     unit cost.
+#
+# ingest.commit_movement updates the destination's average with one UPDATE
+# (RECEIVE_SQL) and takes the source's cost from its debit's OUTPUT, so a
+# single movement costs O(1). Batches replay their movements in memory over
+# the rows they touched (revalue). rebuild() replays the whole ledger, e.g.
+# after adding the column or repairing balances with reconcile.py.
+#
+# Usage (CLI):
+#   python -m valuation                 # rebuild every average from the ledger
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from db import db_connection, run_in_transaction
+from locations import fuel_type_name, location_name
+
+VALUATION_CHUNK_ROWS = int(os.getenv('VALUATION_CHUNK_ROWS', '100000'))
+
+COST_DIGITS = 6 # AverageUnitCost is DECIMAL(18,6)
+ROWS_PER_STATEMENT = 500
+
+STOCKED_LOCATION_TYPES = ('Warehouse', 'Site')
+
+# Runs right after the destination row was credited with the movement's
+# quantity, so CurrentStock - quantity is the stock it held before. Params:
+# quantity x 4, unit cost (NULL: the destination's own average), extra cost,
+# then the key. Mirrors received_average().
+RECEIVE_SQL = (
+    "UPDATE FuelInventory SET AverageUnitCost = CASE "
+    "WHEN CurrentStock - ? > 0 "
+    "THEN ((CurrentStock - ?) * AverageUnitCost + ? * COALESCE(?, AverageUnitCost) + ?) / CurrentStock "
+    "ELSE (? * COALESCE(?, AverageUnitCost) + ?) / ? END "
+    "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ?"
+)
+
+LEDGER_SQL = (
+    "SELECT ft.TransactionID, ft.FuelTypeID, ft.SourceLocationType, ft.SourceLocationID, "
+    "ft.DestinationLocationType, ft.DestinationLocationID, ft.Quantity, fp.Price, "
+    "COALESCE(ft.TransportationCost, 0) + COALESCE(ft.LoadingUnloadingCost, 0) + COALESCE(ft.OtherCost, 0) "
+    "FROM FuelTransactions ft LEFT JOIN FuelPrices fp ON ft.FuelPriceID = fp.FuelPriceID "
+    "WHERE ft.TransactionID > ? ORDER BY ft.TransactionID"
+)
+
+_run_lock = threading.Lock()
+
+
+def extra_cost(movement):
+    """Transportation, loading/unloading and other costs of a Movement."""
+    return sum(float(value or 0) for value in
+               (movement.transportation_cost, movement.loading_unloading_cost, movement.other_cost))
+
+
+def received_average(stock, average, quantity, unit_cost, extra):
+    """The average unit cost after receiving `quantity` at `unit_cost` (None: at `average`) plus `extra`."""
+    received = quantity * (average if unit_cost is None else unit_cost) + extra
+    if stock <= 0:
+        return received / quantity
+    return (stock * average + received) / (stock + quantity)
+
+
+class CostBook:
+    """Stock and average unit cost per (FuelTypeID, LocationType, LocationID), movement by movement."""
+
+    def __init__(self, positions=None):
+        self.positions = positions if positions is not None else {} # key -> [stock, average]
+
+    def apply(self, fuel_type_id, source_type, source_id, destination_type, destination_id,
+              quantity, price, extra):
+        if source_type in STOCKED_LOCATION_TYPES:
+            position = self.positions.get((fuel_type_id, source_type, source_id))
+            if position is None:
+                position = self.positions[(fuel_type_id, source_type, source_id)] = [0.0, 0.0]
+            position[0] -= quantity
+            unit_cost = position[1]
+        else:
+            unit_cost = price
+        key = (fuel_type_id, destination_type, destination_id)
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = [0.0, 0.0]
+        position[1] = received_average(position[0], position[1], quantity, unit_cost, extra)
+        position[0] += quantity
+
+    def apply_movement(self, movement, price):
+        self.apply(movement.fuel_type_id, movement.source_location_type, movement.source_location_id,
+                   movement.destination_location_type, movement.destination_location_id,
+                   movement.quantity, price, extra_cost(movement))
+
+    def apply_rows(self, rows):
+        """Folds LEDGER_SQL rows in; returns the last TransactionID (None for no rows)."""
+        last = None
+        for row in rows:
+            last, fuel_type_id, source_type, source_id, destination_type, destination_id, quantity, price, extra = row
+            self.apply(fuel_type_id, source_type, source_id, destination_type, destination_id, float(quantity),
+                       None if price is None else float(price), float(extra))
+        return last
+
+
+# --- Incremental updates (inside the movement's transaction) ---
+
+def fetch_price(cursor, fuel_price_id):
+    """The unit price behind a FuelPriceID (primary key seek), or None."""
+    if fuel_price_id is None:
+        return None
+    cursor.execute("SELECT Price FROM FuelPrices WHERE FuelPriceID = ?", fuel_price_id)
+    row = cursor.fetchone()
+    return None if row is None else float(row.Price)
+
+
+def receive(cursor, key, quantity, unit_cost, extra):
+    """Folds a credited movement into the destination row's average (see RECEIVE_SQL)."""
+    cursor.execute(RECEIVE_SQL, quantity, quantity, quantity, unit_cost, extra,
+                   quantity, unit_cost, extra, quantity, *key)
+
+
+def _chunks(items, size=ROWS_PER_STATEMENT):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_prices(cursor, fuel_price_ids):
+    prices = {}
+    for chunk in _chunks(sorted(fuel_price_ids)):
+        cursor.execute("SELECT FuelPriceID, Price FROM FuelPrices WHERE FuelPriceID IN ("
+                       + ", ".join(["?"] * len(chunk)) + ")", *chunk)
+        prices.update((row.FuelPriceID, float(row.Price)) for row in cursor.fetchall())
+    return prices
+
+
+def write_averages(cursor, positions):
+    """Stores {key: [stock, average]} averages with one array-bound executemany()."""
+    rows = [(round(average, COST_DIGITS), *key) for key, (_, average) in sorted(positions.items())]
+    if not rows:
+        return 0
+    cursor.fast_executemany = True
+    cursor.executemany("UPDATE FuelInventory SET AverageUnitCost = ? "
+                       "WHERE FuelTypeID = ? AND LocationType = ? AND LocationID = ?", rows)
+    return len(rows)
+
+
+def revalue(cursor, movements, deltas):
+    """Recomputes the averages of the rows a written batch touched.
+
+    Runs after the batch's netted `deltas` were applied, in the same
+    transaction (the rows are already locked). Stock before the batch is the
+    current stock minus the delta; the movements are then replayed in order,
+    so transfers within the batch pass on costs received earlier in it.
+    """
+    keys = sorted(key for key in deltas if key[1] in STOCKED_LOCATION_TYPES)
+    positions = {}
+    for chunk in _chunks(keys):
+        predicate = " OR ".join(["(FuelTypeID = ? AND LocationType = ? AND LocationID = ?)"] * len(chunk))
+        cursor.execute("SELECT FuelTypeID, LocationType, LocationID, CurrentStock, AverageUnitCost "
+                       f"FROM FuelInventory WHERE {predicate}", *[value for key in chunk for value in key])
+        for row in cursor.fetchall():
+            key = (row.FuelTypeID, row.LocationType, row.LocationID)
+            positions[key] = [float(row.CurrentStock) - deltas[key], float(row.AverageUnitCost)]
+    existing = set(positions)
+
+    price_ids = {m.fuel_price_id for m in movements
+                 if m.source_location_type not in STOCKED_LOCATION_TYPES and m.fuel_price_id is not None}
+    prices = fetch_prices(cursor, price_ids) if price_ids else {}
+    book = CostBook(positions)
+    for movement in movements:
+        book.apply_movement(movement, prices.get(movement.fuel_price_id))
+    # Keys whose net delta was 0 for a location without a row have nothing to update.
+    return write_averages(cursor, {key: book.positions[key] for key in existing})
+
+
+# --- Rebuild ---
+
+def _replay(cursor, book, after, chunk_rows=VALUATION_CHUNK_ROWS):
+    """Applies every ledger row after TransactionID `after`; returns (last TransactionID, rows read)."""
+    cursor.execute(LEDGER_SQL, after)
+    rows_read = 0
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return after, rows_read
+        after = book.apply_rows(rows)
+        rows_read += len(rows)
+
+
+def rebuild(conn):
+    """Recomputes every AverageUnitCost from the ledger; returns a report dict.
+
+    The bulk of the ledger is read without locks. The inventory rows are then
+    locked, the transactions committed meanwhile are replayed and the
+    averages written, in one transaction. Inventory rows the ledger never
+    touched (opening balances entered directly) keep their average.
+    """
+    with _run_lock:
+        started = time.perf_counter()
+        book = CostBook()
+        last_transaction_id, rows_read = _replay(conn.cursor(), book, 0)
+
+        def work(cursor):
+            cursor.execute("SELECT FuelTypeID, LocationType, LocationID FROM FuelInventory WITH (UPDLOCK, HOLDLOCK)")
+            existing = {(row.FuelTypeID, row.LocationType, row.LocationID) for row in cursor.fetchall()}
+            last, tail = _replay(cursor, book, last_transaction_id)
+            updated = write_averages(cursor, {key: position for key, position in book.positions.items()
+                                              if key in existing})
+            return last, tail, updated
+
+        last_transaction_id, tail_rows, updated = run_in_transaction(conn, work)
+
+    return {
+        "transactionsRead": rows_read + tail_rows,
+        "lastTransactionID": last_transaction_id,
+        "ledgerLocations": len(book.positions),
+        "updated": updated,
+        "elapsedSeconds": round(time.perf_counter() - started, 3),
+    }
+
+
+# --- Reporting ---
+
+def stock_value_report(cursor, fuel_type_id=None, location_type=None, location_id=None):
+    """Stock value per location from the inventory rows (one read)."""
+    conditions, params = [], []
+    if location_type is not None:
+        conditions.append("LocationType = ?")
+        params.append(location_type)
+    if location_id is not None:
+        conditions.append("LocationID = ?")
+        params.append(location_id)
+    if fuel_type_id is not None:
+        conditions.append("FuelTypeID = ?")
+        params.append(fuel_type_id)
+    # Covered by IX_FuelInventory_Location (LocationType, LocationID) INCLUDE (..., AverageUnitCost)
+    cursor.execute(
+        "SELECT LocationType, LocationID, FuelTypeID, CurrentStock, AverageUnitCost FROM FuelInventory "
+        + ("WHERE " + " AND ".join(conditions) + " " if conditions else "")
+        + "ORDER BY LocationType, LocationID, FuelTypeID",
+        *params
+    )
+    locations = []
+    current = None
+    total = 0.0
+    for row in cursor.fetchall():
+        if current is None or (current["locationType"], current["locationID"]) != (row.LocationType, row.LocationID):
+            current = {
+                "locationType": row.LocationType,
+                "locationID": row.LocationID,
+                "locationName": location_name(row.LocationType, row.LocationID),
+                "stockValue": 0.0,
+                "fuels": [],
+            }
+            locations.append(current)
+        stock = float(row.CurrentStock)
+        average = float(row.AverageUnitCost)
+        value = round(stock * average, 2)
+        current["fuels"].append({
+            "fuelTypeID": row.FuelTypeID,
+            "fuelTypeName": fuel_type_name(row.FuelTypeID),
+            "currentStock": stock,
+            "averageUnitCost": round(average, COST_DIGITS),
+            "stockValue": value,
+        })
+        current["stockValue"] = round(current["stockValue"] + value, 2)
+        total += value
+    return {"totalValue": round(total, 2), "locations": locations}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild FuelInventory average unit costs from the ledger.")
+    parser.parse_args(argv)
+
+    with db_connection() as conn:
+        if conn is None:
+            print("Database connection failed")
+            return 2
+        report = rebuild(conn)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())